@@ -18,12 +18,25 @@ from modules.models       import *
 from modules.utils        import *
 from modules.preprocess   import *
 from modules.estimate_FDR import *
-from modules.parse_opts   import parse_opts
+from modules.cache        import cache_key, load_cache, save_cache, cached_genes, clear_cache, file_digest
+from modules.index        import load_index
+from modules.server       import ProfilePool, serve
+from modules.workqueue    import work
+from modules.checkpoint   import checkpoint_key, open_checkpoint, load_stage, save_stage, stage_name, stage_dir
+from modules.meta         import profile_cost, schedule, consensus_ranking
+from modules.incremental  import build_state, append_state, state_normalized, save_state, load_state
+from modules.parse_opts   import parse_opts, read_profiles, read_values, profile_format, read_sparse, pseudo_bulk
 
 #-----------------------------------------------------
 # Global seeting
 
 LOGS = log_infos()
+PREPROCESS_PARAMS = {'percentile' : 5, 'renorm' : 'zscore'}
+LOGSCALE_VALUES   = 10 ** 7 # values checked by is_logscale in out-of-core mode
+CANDIDATE_NUM     = 2000    # candidates kept after scoring against the query genes
+CANDIDATE_STRIDE  = 10      # every 10th gene is scored exactly to estimate the recall of approximate candidates
+MODULE_CUTOFF     = 0.6     # average similarity within a query module, as the quality check of score_queries
+INPLACE_FACTOR    = 2.5     # peak memory of in-place preprocessing relative to the profile file, text files overestimate it
 
 #-----------------------------------------------------
 
@@ -43,20 +56,49 @@ def chk_quries(profiles, query_genes, verbose = True):
     else:
         return query_pass
 
-def preprocess(profiles, query_genes, verbose = True):
+def preprocess(profiles, query_genes, verbose = True, tmp_dir = None, values = None, nthreads = None):
     '''
     Preprocess gene expression profiles.
     :param profiles: [pd.DataFrame] Gene expression profile, N genes x K samples.
     :param query_genes: [list] A list of query genes.
     :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param tmp_dir: [str] Out-of-core mode, profiles are normalized column by column into this directory, default: None.
+    :param values: [np.array] Writable values of profiles owned by the caller, normalized in place and the remained rows moved to their front, default: None.
+    :param nthreads: [int] Number of threads sorting and ranking blocks of columns, default: None, all cpus.
     :return: profiles_sub [pd.DataFrame]
     
     '''
-    profiles = 2 ** profiles if is_logscale(profiles) else profiles
-    show_msg('>> Normalizing by quantile method', LOGS.info, verbose)
-    profiles_norm = quantile_normalized(profiles)
-    show_msg('>> Filtering out low-expressed genes across samples', LOGS.info, verbose)
-    profiles_tmp  = filter_lowexps(profiles_norm, query_genes, percentile = 5)
+    if values is not None and not tmp_dir:
+        with stage('is_logscale', **frame_infos(profiles)):
+            logc = is_logscale(profiles)
+        show_msg('>> Normalizing by quantile method in place', LOGS.info, verbose)
+        with stage('quantile_normalized', inplace = True, **frame_infos(profiles)):
+            profiles_norm = quantile_normalized_inplace(values, profiles.index, logc, nthreads)
+        show_msg('>> Filtering out low-expressed genes across samples', LOGS.info, verbose)
+        with stage('filter_lowexps', inplace = True) as record:
+            profiles_tmp  = filter_lowexps_inplace(values, profiles_norm.index, query_genes, percentile = PREPROCESS_PARAMS['percentile'], nthreads = nthreads)
+            record.update(frame_infos(profiles_tmp))
+        del profiles_norm
+    elif tmp_dir:
+        with stage('is_logscale', **frame_infos(profiles)):
+            logc = is_logscale(profiles, LOGSCALE_VALUES)
+        show_msg('>> Normalizing by quantile method out of core', LOGS.info, verbose)
+        with stage('quantile_normalized', out_of_core = True, **frame_infos(profiles)):
+            profiles_norm = quantile_normalized_ooc(profiles, os.path.join(tmp_dir, 'profiles_norm.npy'), logc, nthreads)
+        show_msg('>> Filtering out low-expressed genes across samples', LOGS.info, verbose)
+        with stage('filter_lowexps', out_of_core = True) as record:
+            profiles_tmp  = filter_lowexps_ooc(profiles_norm, query_genes, percentile = PREPROCESS_PARAMS['percentile'])
+            record.update(frame_infos(profiles_tmp))
+    else:
+        with stage('is_logscale', **frame_infos(profiles)):
+            profiles = 2 ** profiles if is_logscale(profiles) else profiles
+        show_msg('>> Normalizing by quantile method', LOGS.info, verbose)
+        with stage('quantile_normalized', **frame_infos(profiles)):
+            profiles_norm = quantile_normalized(profiles, nthreads)
+        show_msg('>> Filtering out low-expressed genes across samples', LOGS.info, verbose)
+        with stage('filter_lowexps') as record:
+            profiles_tmp  = filter_lowexps(profiles_norm, query_genes, percentile = PREPROCESS_PARAMS['percentile'], nthreads = nthreads)
+            record.update(frame_infos(profiles_tmp))
     tmp_chk_genes = [ gene for gene in query_genes if gene in profiles_tmp.index ]
     profiles_sub  = profiles_tmp if query_genes == tmp_chk_genes else profiles_sub
     
@@ -64,34 +106,376 @@ def preprocess(profiles, query_genes, verbose = True):
     show_msg('>> {0} genes and {1} samples entering downstream analysis'.format(nrows, ncols), LOGS.info, verbose)
     return profiles_sub
 
-def search_markers(query_genes, profiles_sub, outfile = None, verbose = True):
+def reduce_profiles(profiles_sub, verbose = True, basis = None, values = None, **svd_params):
     '''
-    Search marker genes on the basis of query gene.
-    :param profiles: [pd.DataFrame] Gene expression profile, N genes x K samples.
-    :param query_gene: [list] A list of query genes.
-    :param outfile: [str] The file used to save search results.
+    Reduce the preprocessed profiles by SVD.
+    :param profiles_sub: [pd.DataFrame] Preprocessed gene expression profile, N genes x K samples.
     :param verbose: [bool] verbose logical, to print the detailed information, default: True.
-    :return: 0
+    :param basis: [pd.DataFrame] Reduced profiles of an earlier fit to warm start from, default: None.
+    :param values: [np.array] Writable values of profiles_sub owned by the caller, renormalized in place, default: None.
+    :param svd_params: [dict] engine, n_components and time_budget of svd_filter.
+    :return: profiles_svd [pd.DataFrame]
     
     '''
-    profiles_svd = svd_filter(profiles_sub, renorm = 'zscore'); del profiles_sub
-    show_msg('>> Searching cell type-specific genes on the basis of query genes.', LOGS.info, verbose)
-    scores_df, gene_counts = [], profiles_svd.rank(axis = 0, method = 'min') - 1
-    query_genes_remained   = chk_queries_quality(gene_counts, query_genes, gene_counts.shape[0], LOGS, cutoff = 0.6, verbose = verbose)
+    basis = basis.reindex(profiles_sub.index).fillna(0).values if basis is not None else None
+    with stage('svd_filter', warm = basis is not None, inplace = values is not None, **frame_infos(profiles_sub)) as record:
+        profiles_svd = svd_filter(profiles_sub, renorm = PREPROCESS_PARAMS['renorm'], basis = basis, LOGS = LOGS, verbose = verbose, values = values, **svd_params)
+        record['components'] = profiles_svd.shape[1]
+    return profiles_svd
+
+def rank_profiles(profiles_sub, verbose = True, profiles_svd = None, values = None, **svd_params):
+    '''
+    Reduce the preprocessed profiles by SVD and transform them into gene counts of the smallest integer dtype.
+    :param profiles_sub: [pd.DataFrame] Preprocessed gene expression profile, N genes x K samples.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param profiles_svd: [pd.DataFrame] Profiles already reduced by reduce_profiles, default: None.
+    :param values: [np.array] Writable values of profiles_sub owned by the caller, which must not use them afterwards, default: None.
+    :param svd_params: [dict] engine, n_components and time_budget of svd_filter.
+    :return: gene_counts [pd.DataFrame]
     
-    for idx, query in enumerate(query_genes_remained):
-        show_msg('>> Calculating similarity score: {0}...'.format(query), LOGS.info, verbose)
-        score_sim = measure_similarity(gene_counts.loc[query], gene_counts, gene_counts.shape[0], axis = 1)
-        scores_df.append(score_sim)
+    '''
+    profiles_svd = reduce_profiles(profiles_sub, verbose, values = values, **svd_params) if profiles_svd is None else profiles_svd
+    with stage('rank') as record:
+        rankdata, values = __import__('scipy.stats').stats.rankdata, profiles_svd.values
+        counts = np.empty(values.shape, dtype = rank_dtype(values.shape[0]))
+        for idx in range(values.shape[1]): # column by column, float ranks of all columns would take twice the reduced profiles
+            counts[:, idx] = rankdata(values[:, idx], method = 'min') - 1
+        gene_counts  = pd.DataFrame(counts, index = profiles_svd.index, columns = profiles_svd.columns, copy = False)
+        record.update(frame_infos(gene_counts))
+    return gene_counts
+
+def sparse_counts(profile_fil, fmt, query_genes, verbose = True, precision = 'double', svd_params = None):
+    '''
+    Preprocess a sparse single-cell profile into gene counts without densifying the cells.
+    Cells are scaled to the median library size instead of quantile normalized, which would fill in the zeros.
+    :param profile_fil: [str] Matrix Market or scipy CSR profile, genes x cells.
+    :param fmt: [str] mtx or csr.
+    :param query_genes: [list] A list of query genes, empty to preprocess without query genes.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param precision: [str] 'double' or 'single' float precision of expression values, default: double.
+    :param svd_params: [dict] n_components and time_budget of svd_filter_sparse, default: None.
+    :return: query_genes [list], gene_counts [pd.DataFrame], genes [pd.Index] all genes of the profile
     
-    scores_actual = pd.DataFrame(
-            np.array(scores_df).T, 
-            index = gene_counts.index
-        ).sort_values(by = 0, ascending = False).mean(axis = 1) / (max_score(gene_counts.shape[0], gene_counts.shape[1]) * gene_counts.shape[1])
+    '''
+    svd_params = svd_params if svd_params else {}
+    with stage('read_sparse') as record:
+        values, genes, cells = read_sparse(profile_fil, fmt, PRECISIONS[precision])
+        record.update(shape = list(values.shape), nnz = int(values.nnz))
+    profile_genes = genes
+    query_genes = chk_quries(pd.DataFrame(index = genes), query_genes, verbose) if query_genes else query_genes
+    with stage('is_logscale', nnz = int(values.nnz)):
+        if is_logscale(values, LOGSCALE_VALUES): values.data = 2 ** values.data - 1 # log2(x + 1) values, zeros stay zeros
+    show_msg('>> Normalizing {0} cells by library size'.format(values.shape[1]), LOGS.info, verbose)
+    with stage('library_normalized', nnz = int(values.nnz)):
+        values = library_normalized(values)
+    show_msg('>> Filtering out low-expressed genes across cells', LOGS.info, verbose)
+    with stage('filter_lowexps', sparse = True) as record:
+        values, genes = filter_lowexps_sparse(values, genes, query_genes, percentile = PREPROCESS_PARAMS['percentile'])
+        record.update(shape = list(values.shape), nnz = int(values.nnz))
+    show_msg('>> {0} genes and {1} cells entering downstream analysis'.format(*values.shape), LOGS.info, verbose)
     
-    scores_actual = scores_actual.iloc[0 : 2000]
-    show_msg('>> Estimating P-value to screen significant genes.', LOGS.info, verbose)
-    pvalues = estimate_FDR(scores_actual, gene_counts.loc[scores_actual.index, : ], scores_actual.index)
+    if values.shape[1] <= 50: # too few cells to be reduced, dense as any bulk profile
+        return query_genes, rank_profiles(pd.DataFrame(values.toarray(), index = genes), verbose, **svd_params), profile_genes
+    with stage('svd_filter', sparse = True, nnz = int(values.nnz)) as record:
+        profiles_svd = svd_filter_sparse(values, genes, renorm = PREPROCESS_PARAMS['renorm'], LOGS = LOGS, verbose = verbose, **svd_params)
+        record['components'] = profiles_svd.shape[1]
+    return query_genes, rank_profiles(None, verbose, profiles_svd), profile_genes
+
+def storage_mode(profile_fil, out_of_core = False, cell_labels = None, max_memory = None):
+    '''
+    Storage of the values of a profile while it is preprocessed.
+    :param profile_fil: [str] Gene expression profile file.
+    :param out_of_core: [bool] Stream the profile column by column from memory-mapped files, default: False.
+    :param cell_labels: [str] Cell labels, labeled cells are summed in memory, default: None.
+    :param max_memory: [int] Memory budget in bytes, default: None.
+    :return: mode [str] 'sparse', 'out_of_core', 'in_place' or 'memory'
+    
+    '''
+    if cell_labels: return 'memory'
+    if profile_format(profile_fil) in ['mtx', 'csr']: return 'sparse'
+    if out_of_core: return 'out_of_core'
+    if not max_memory: return 'memory'
+    return 'out_of_core' if os.path.getsize(profile_fil) * INPLACE_FACTOR > max_memory else 'in_place'
+
+def preprocess_counts(profile_fil, query_genes, verbose = True, precision = 'double', out_of_core = False, svd_params = None, cell_labels = None, max_memory = None, nthreads = None):
+    '''
+    Read and preprocess a profile into gene counts, query genes below the expression cutoff are kept with all genes above them.
+    :param profile_fil: [str] Gene expression profile file.
+    :param query_genes: [list] A list of query genes, empty to preprocess without query genes.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param precision: [str] 'double' or 'single' float precision of expression values, default: double.
+    :param out_of_core: [bool] Stream the profile column by column from memory-mapped files, default: False.
+    :param svd_params: [dict] engine, n_components and time_budget of svd_filter, default: None, full PCA.
+    :param cell_labels: [str] Cell labels, cells of the same label are summed into pseudo-bulk samples, default: None.
+    :param max_memory: [int] Memory budget in bytes, intermediates are transformed in place, or out of core beyond the budget, default: None.
+    :param nthreads: [int] Number of threads of the preprocessing, default: None, all cpus.
+    :return: query_genes [list], gene_counts [pd.DataFrame], genes [pd.Index] all genes of the profile
+    
+    '''
+    svd_params = svd_params if svd_params else {}
+    mode = storage_mode(profile_fil, out_of_core, cell_labels, max_memory)
+    if max_memory and not out_of_core and mode in ['out_of_core', 'in_place']:
+        show_msg('>> Preprocessing {0} within {1:.1f} GB'.format(mode.replace('_', ' '), max_memory / 2 ** 30), LOGS.info, verbose)
+    tmp_dir = tempfile.mkdtemp(prefix = 'msearcher-') if mode == 'out_of_core' else None
+    try:
+        if mode == 'sparse':
+            return sparse_counts(profile_fil, profile_format(profile_fil), query_genes, verbose, precision, svd_params)
+        values = None # values owned by the in-place mode, data frames only get read-only views of them under copy-on-write
+        with stage('read_profiles', pseudo_bulk = bool(cell_labels)) as record:
+            if mode == 'in_place':
+                values, genes, samples = read_values(profile_fil, PRECISIONS[precision])
+                profiles = pd.DataFrame(values, index = genes, columns = samples, copy = False)
+            else:
+                profiles = pseudo_bulk(profile_fil, cell_labels, PRECISIONS[precision]) if cell_labels else read_profiles(profile_fil, PRECISIONS[precision], tmp_dir)
+            record.update(frame_infos(profiles))
+        if cell_labels: show_msg('>> {0} pseudo-bulk samples summed from labeled cells'.format(profiles.shape[1]), LOGS.info, verbose)
+        query_genes  = chk_quries(profiles, query_genes, verbose) if query_genes else query_genes
+        genes        = profiles.index
+        profiles_sub = preprocess(profiles, query_genes, verbose, tmp_dir, values, nthreads)
+        del profiles # released before the reduction, not kept alive next to its copies
+        values       = values[0 : profiles_sub.shape[0]] if values is not None else None
+        profiles_svd = reduce_profiles(profiles_sub, verbose, values = values, **svd_params)
+        del profiles_sub, values # the reduced profiles are ranked without the values they were reduced from
+        gene_counts  = rank_profiles(None, verbose, profiles_svd)
+    finally:
+        if tmp_dir: shutil.rmtree(tmp_dir, ignore_errors = True)
+    return query_genes, gene_counts, genes
+
+def load_counts(profile_fil, query_genes, cache_dir = None, cache_size = None, verbose = True, precision = 'double', out_of_core = False, svd_params = None, cell_labels = None, max_memory = None, nthreads = None, keep_lowexps = True):
+    '''
+    Load gene counts of a profile from the cache, or preprocess the profile and cache them.
+    Only gene counts preprocessed without query genes are cached, they are the same for every query. Query genes below
+    their expression cutoff would keep more genes, so such queries are preprocessed again without the cache.
+    :param profile_fil: [str] Gene expression profile file.
+    :param query_genes: [list] A list of query genes, empty to preprocess without query genes.
+    :param cache_dir: [str] Directory of cached profiles, default: None, no cache.
+    :param cache_size: [int] Maximum bytes of the cache, default: None, unbounded.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param precision: [str] 'double' or 'single' float precision of expression values, default: double.
+    :param out_of_core: [bool] Stream the profile column by column from memory-mapped files, default: False.
+    :param svd_params: [dict] engine, n_components and time_budget of svd_filter, default: None, full PCA.
+    :param cell_labels: [str] Cell labels, cells of the same label are summed into pseudo-bulk samples, default: None.
+    :param max_memory: [int] Memory budget in bytes, intermediates are transformed in place, or out of core beyond the budget, default: None.
+    :param nthreads: [int] Number of threads of the preprocessing, default: None, all cpus.
+    :param keep_lowexps: [bool] Keep query genes below the expression cutoff, False to preprocess without them and return all query genes of the profile, default: True.
+    :return: query_genes [list], gene_counts [pd.DataFrame]
+    
+    '''
+    svd_params = svd_params if svd_params else {}
+    preprocess_params = dict(verbose = verbose, precision = precision, out_of_core = out_of_core, svd_params = svd_params, cell_labels = cell_labels, max_memory = max_memory, nthreads = nthreads)
+    if not cache_dir and keep_lowexps: return preprocess_counts(profile_fil, query_genes, **preprocess_params)[0 : 2]
+    if not cache_dir:
+        gene_counts, genes = preprocess_counts(profile_fil, [], **preprocess_params)[1 : 3]
+        return [ gene for gene in query_genes if gene in genes ], gene_counts
+    
+    labels_key = {'labels' : file_digest(cell_labels)} if cell_labels else {}
+    key = cache_key(profile_fil, precision = precision, svd = sorted(svd_params.items()), storage = storage_mode(profile_fil, out_of_core, cell_labels, max_memory),
+        **dict(PREPROCESS_PARAMS, **labels_key))
+    with stage('load_cache', cached = False) as record:
+        gene_counts, genes = load_cache(cache_dir, key), cached_genes(cache_dir, key)
+        record['cached'] = gene_counts is not None and genes is not None
+    if gene_counts is not None and genes is not None:
+        show_msg('>> Loading preprocessed profile from cache {0}'.format(key), LOGS.info, verbose)
+    else:
+        gene_counts, genes = preprocess_counts(profile_fil, [], **preprocess_params)[1 : 3]
+        with stage('save_cache', **frame_infos(gene_counts)):
+            save_cache(cache_dir, key, gene_counts, cache_size, genes)
+    
+    if not keep_lowexps: return [ gene for gene in query_genes if gene in genes ], gene_counts
+    query_genes = chk_quries(pd.DataFrame(index = genes), query_genes, verbose) if query_genes else query_genes
+    lowexps = [ gene for gene in query_genes if gene not in gene_counts.index ]
+    if not lowexps: return query_genes, gene_counts
+    show_msg('>> Query genes below the expression cutoff, preprocessed again without the cache: {0}'.format(', '.join(lowexps)), LOGS.info, verbose)
+    return preprocess_counts(profile_fil, query_genes, **preprocess_params)[0 : 2]
+
+def state_profile_counts(state, query_genes, verbose = True, precision = 'double', svd_params = None):
+    '''
+    Preprocess the samples of an incremental state into gene counts, warm started from the basis of the state.
+    :param state: [dict] State returned by build_state, append_state or load_state.
+    :param query_genes: [list] A list of query genes, empty to preprocess without query genes.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param precision: [str] 'double' or 'single' float precision of expression values, default: double.
+    :param svd_params: [dict] engine, n_components and time_budget of svd_filter, default: None, full PCA.
+    :return: profiles_svd [pd.DataFrame], gene_counts [pd.DataFrame]
+    
+    '''
+    svd_params = svd_params if svd_params else {}
+    with stage('quantile_normalized', from_state = True):
+        profiles_norm = state_normalized(state, PRECISIONS[precision])
+    with stage('filter_lowexps') as record:
+        profiles_sub = filter_lowexps(profiles_norm, query_genes, percentile = PREPROCESS_PARAMS['percentile'])
+        record.update(frame_infos(profiles_sub))
+    del profiles_norm
+    show_msg('>> {0} genes and {1} samples entering downstream analysis'.format(*profiles_sub.shape), LOGS.info, verbose)
+    profiles_svd = reduce_profiles(profiles_sub, verbose, state['basis'], **svd_params)
+    gene_counts  = rank_profiles(profiles_sub, verbose, profiles_svd)
+    return profiles_svd if profiles_sub.shape[1] > 50 else None, gene_counts # profiles of K <= 50 samples are not reduced
+
+def state_counts(state_dir, query_genes, profile_fil = None, append_fil = None, verbose = True, precision = 'double', svd_params = None, keep_lowexps = True):
+    '''
+    Load gene counts from an incremental preprocessing state, built from the profile when missing and updated with appended samples.
+    Only gene counts preprocessed without query genes are stored in the state, they are the same for every query. Query genes
+    below their expression cutoff would keep more genes, so such queries are preprocessed again without storing their counts.
+    :param state_dir: [str] Directory of the state.
+    :param query_genes: [list] A list of query genes, empty to preprocess without query genes.
+    :param profile_fil: [str] Gene expression profile file the state is built from, default: None.
+    :param append_fil: [str] Profile of new samples of the same genes appended to the state, default: None.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param precision: [str] 'double' or 'single' float precision of expression values, default: double.
+    :param svd_params: [dict] engine, n_components and time_budget of svd_filter, default: None, full PCA.
+    :param keep_lowexps: [bool] Keep query genes below the expression cutoff, False to preprocess without them and return all query genes of the state, default: True.
+    :return: query_genes [list], gene_counts [pd.DataFrame]
+    
+    '''
+    svd_params = svd_params if svd_params else {}
+    with stage('load_state') as record:
+        state = load_state(state_dir)
+        record['samples'] = len(state['samples']) if state else 0
+    if state is None:
+        if not profile_fil: show_msg('>> No preprocessing state in {0}, --profile is needed to build it, exit...'.format(state_dir), LOGS.error, verbose)
+        show_msg('>> Building preprocessing state {0}'.format(state_dir), LOGS.info, verbose)
+        with stage('read_profiles') as record:
+            profiles = read_profiles(profile_fil, PRECISIONS[precision])
+            record.update(frame_infos(profiles))
+        with stage('build_state', **frame_infos(profiles)):
+            state = build_state(profiles)
+        del profiles
+    if keep_lowexps:
+        query_genes = chk_quries(pd.DataFrame(index = state['genes']), query_genes, verbose) if query_genes else query_genes
+    else:
+        query_pass, query_genes = [ gene for gene in query_genes if gene in state['genes'] ], []
+    
+    if append_fil:
+        with stage('read_profiles', appended = True) as record:
+            profiles = read_profiles(append_fil, PRECISIONS[precision])
+            record.update(frame_infos(profiles))
+        show_msg('>> Appending {0} samples to {1} samples of the state'.format(profiles.shape[1], len(state['samples'])), LOGS.info, verbose)
+        with stage('append_state', **frame_infos(profiles)):
+            state = append_state(state, profiles)
+        del profiles
+    if state['counts'] is None:
+        basis, gene_counts = state_profile_counts(state, [], verbose, precision, svd_params)
+        state.update(basis = basis, counts = gene_counts)
+        with stage('save_state', **frame_infos(state['rank_idx'])):
+            save_state(state_dir, state)
+    else:
+        show_msg('>> Loading gene counts of {0} samples from state {1}'.format(len(state['samples']), state_dir), LOGS.info, verbose)
+    
+    if not keep_lowexps: return query_pass, state['counts']
+    lowexps = [ gene for gene in query_genes if gene not in state['counts'].index ]
+    if not lowexps: return query_genes, state['counts']
+    show_msg('>> Query genes below the expression cutoff, preprocessed again without storing them in the state: {0}'.format(', '.join(lowexps)), LOGS.info, verbose)
+    return query_genes, state_profile_counts(state, query_genes, verbose, precision, svd_params)[1]
+
+def open_index(gene_counts, index_dir, top_k = CANDIDATE_NUM, nthreads = None, backend = 'process', verbose = True):
+    '''
+    Open the similarity index of gene counts, it is built once per preprocessed profile.
+    :param gene_counts: [pd.DataFrame] Gene counts returned by rank_profiles, N genes x K samples.
+    :param index_dir: [str] Directory of the similarity index.
+    :param top_k: [int] Number of neighbors of each gene, default: CANDIDATE_NUM.
+    :param nthreads: [int] Number of workers used to build the index, default: None, all cpus.
+    :param backend: [str] 'process' or 'thread' worker pool, default: process.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :return: index [SimilarityIndex]
+    
+    '''
+    show_msg('>> Opening similarity index {0}'.format(index_dir), LOGS.info, verbose)
+    with stage('similarity_index', top_k = top_k) as record:
+        index, built = load_index(gene_counts, index_dir, top_k, nthreads, backend)
+        record['built'] = built
+    if built: show_msg('>> Built top {0} similarity index of {1} genes'.format(index.top_k, gene_counts.shape[0]), LOGS.info, verbose)
+    return index
+
+def split_modules(query_sets, gene_counts, min_size = 3, verbose = True):
+    '''
+    Split query sets into coherent modules of query genes, searched together as one batch.
+    :param query_sets: [OrderedDict] Query genes of each named query set, an empty name for a single query set.
+    :param gene_counts: [pd.DataFrame] Gene counts returned by rank_profiles, N genes x K samples.
+    :param min_size: [int] Smaller modules are dropped, default: 3.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :return: modules [OrderedDict] Query genes of each module, named NAME-moduleN.
+    
+    '''
+    modules = __import__('collections').OrderedDict()
+    for name, query_genes in query_sets.items():
+        query_genes = [ gene for gene in query_genes if gene in gene_counts.index ]
+        with stage('query_modules', queries = len(query_genes)) as record:
+            found = query_modules(gene_counts, query_genes, gene_counts.shape[0], MODULE_CUTOFF, min_size)
+            record['modules'] = len(found)
+        show_msg('>> {0} query genes{1} split into {2} modules: {3}'.format(len(query_genes), ' of ' + name if name else '', len(found), 
+            ', '.join(str(len(module)) for module in found)), LOGS.info, verbose)
+        for idx, module in enumerate(found): modules['{0}module{1}'.format(name + '-' if name else '', idx + 1)] = module
+    if not modules: show_msg('>> No query module of at least {0} genes, exit...'.format(min_size), LOGS.error, verbose)
+    return modules
+
+def candidate_recall(query_gene, gene_counts, cand_scores, stride = CANDIDATE_STRIDE):
+    '''
+    Recall of approximate candidates against the exact top genes of the first query gene, estimated from the exact scores of every stride-th gene.
+    :param query_gene: [str] First query gene passed the quality evaluation, which ranks the candidates.
+    :param gene_counts: [pd.DataFrame] Gene counts returned by rank_profiles, N genes x K samples.
+    :param cand_scores: [pd.Series] Similarity scores of the candidates with the first query gene.
+    :param stride: [int] Every stride-th gene is scored exactly, default: CANDIDATE_STRIDE.
+    :return: recall [float]
+    
+    '''
+    sample = gene_counts.iloc[::stride]
+    sample = sample.loc[~sample.index.isin(cand_scores.index)]
+    scores = score_block(gene_counts.loc[[query_gene]].values, sample.values, gene_counts.shape[0])[0]
+    misses = np.sum(scores > cand_scores.min()) * stride # genes outside the candidates displacing one of them
+    return max(0.0, 1 - misses / float(len(cand_scores)))
+
+def score_queries(query_genes, gene_counts, verbose = True, scores_cache = None, approx = 1.0, index = None):
+    '''
+    Score all genes against the query genes and keep the top CANDIDATE_NUM candidates of the first query gene.
+    :param query_genes: [list] A list of query genes.
+    :param gene_counts: [pd.DataFrame] Gene counts returned by rank_profiles, N genes x K samples.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param scores_cache: [dict] Similarity scores of query genes already calculated, default: None.
+    :param approx: [float] Fraction of leading components scored to find candidates of the first query gene, 1 is exact, default: 1.0.
+    :param index: [SimilarityIndex] Read candidates of the first query gene from the similarity index, default: None.
+    :return: query_genes_remained [np.array], scores_actual [pd.Series] mean similarity of the candidates
+    
+    '''
+    use_index = index is not None and index.top_k >= min(CANDIDATE_NUM, gene_counts.shape[0])
+    scores_cache = {} if scores_cache is None or approx < 1 or use_index else scores_cache
+    with stage('chk_queries_quality', queries = len(query_genes)):
+        query_genes_remained = chk_queries_quality(gene_counts, query_genes, gene_counts.shape[0], LOGS, cutoff = 0.6, verbose = verbose)
+    
+    with stage('similarity', queries = len(query_genes_remained), **frame_infos(gene_counts)) as record:
+        cand_counts = gene_counts
+        if use_index: # exact scores of the indexed top candidates only
+            cand_counts = gene_counts.loc[index.top(query_genes_remained[0], CANDIDATE_NUM).index]
+        elif approx < 1: # exact scores of the approximate top candidates only
+            counts_ary  = np.asarray(gene_counts, dtype = diff_dtype(gene_counts.shape[0]))
+            query_idxes = [ gene_counts.index.get_loc(query_genes_remained[0]) ]
+            cand_masks  = approx_top_masks(counts_ary[query_idxes], counts_ary, similarity_lut(gene_counts.shape[0]), CANDIDATE_NUM, approx)[0]
+            cand_counts = gene_counts.loc[cand_masks]
+    
+        missing = [ query for query in query_genes_remained if query not in scores_cache ]
+        if missing: # scored together, in blocks of queries bounded in memory
+            show_msg('>> Calculating similarity score of {0} query genes: {1}...'.format(len(missing), ', '.join(missing[0 : 10])), LOGS.info, verbose)
+            scores_cache.update(zip(missing, score_block(gene_counts.loc[missing].values, cand_counts.values, gene_counts.shape[0])))
+        scores_df = np.vstack([ scores_cache[query] for query in query_genes_remained ])
+    
+        scores_sorted = pd.DataFrame( # candidates are ranked by the first query gene, and reported by the mean of all query genes
+                scores_df.T, 
+                index = cand_counts.index
+            ).sort_values(by = 0, ascending = False).iloc[0 : CANDIDATE_NUM]
+        scores_actual = scores_sorted.mean(axis = 1) / (max_score(gene_counts.shape[0], gene_counts.shape[1]) * gene_counts.shape[1])
+        if approx < 1 and not use_index and verbose:
+            record['candidate_recall'] = candidate_recall(query_genes_remained[0], gene_counts, scores_sorted[0])
+            show_msg('>> Approximate candidates recall {0:.2%}, estimated on every {1}th gene.'.format(record['candidate_recall'], CANDIDATE_STRIDE), LOGS.info, verbose)
+    return query_genes_remained, scores_actual
+
+def screen_markers(scores_actual, pvalues, query_genes_remained):
+    '''
+    Assemble and sort the search results of one query set.
+    :param scores_actual: [pd.Series] Similarity scores returned by score_queries.
+    :param pvalues: [pd.DataFrame] P values returned by estimate_FDR.
+    :param query_genes_remained: [np.array] Query genes passed the quality evaluation.
+    :return: search_res [pd.DataFrame]
+    
+    '''
     search_res = pd.DataFrame(scores_actual).assign(
             Pvalue  = pvalues.values[:, 0],
             FDR     = pvalues.values[:, 4],
@@ -100,15 +484,263 @@ def search_markers(query_genes, profiles_sub, outfile = None, verbose = True):
             nCount  = pvalues.values[:, 3]
         )
     search_res.rename(columns = {0 : 'Similarity'}, inplace = True)
+    if 'Evaluated' in pvalues.columns: search_res['Evaluated'] = pvalues['Evaluated'].values # --fdr, skipped candidates have no statistics
     search_res = search_res.drop(query_genes_remained).sort_values(
             by = ['FDR', 'Pvalue', 'Jaccard', 'ORScore', 'Similarity'], 
             ascending = [True, True, False, False, False]
         )
-    show_msg('>> Writing searched results to {0} file.'.format(outfile + '.xls'), LOGS.info, verbose)
     search_res.index.name = 'GeneSymbol'
-    search_res.to_csv(outfile + '.xls', sep = '\t', index = True, header = True)
+    return search_res
+
+def report_recall(cand_counts, approx = 1.0, verbose = True, index = None):
+    '''
+    Report the recall of the approximate or indexed top genes of decoys, measured on a sample of candidates.
+    :param cand_counts: [pd.DataFrame] Gene counts of the candidates.
+    :param approx: [float] Fraction of leading components scored to generate candidates, 1 is exact, default: 1.0.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param index: [SimilarityIndex] Similarity index providing candidates of decoy tops, default: None.
+    :return: 0
+    
+    '''
+    if (approx >= 1 and index is None) or not verbose: return 0
+    cand_idxes  = None if index is None else index.candidates(cand_counts.index, 20 * APPROX_EXPAND)
+    cand_counts = (cand_counts.rank(axis = 0, method = 'min') - 1).astype(rank_dtype(cand_counts.shape[0]))
+    recall = measure_recall(cand_counts, approx = approx, cand_idxes = cand_idxes)
+    source = 'the similarity index' if index is not None else '{0:.0%} of the components'.format(approx)
+    show_msg('>> Approximate top genes recall {0:.2%} with {1}.'.format(recall, source), LOGS.info, verbose)
     return 0
 
+def search_markers(query_genes, gene_counts, outfile = None, verbose = True, nthreads = None, backend = 'process', fdr = None, approx = 1.0, index = None, index_decoys = False, checkpoint = None):
+    '''
+    Search marker genes on the basis of query gene.
+    :param query_gene: [list] A list of query genes.
+    :param gene_counts: [pd.DataFrame] Gene counts returned by rank_profiles, N genes x K samples.
+    :param outfile: [str] The file used to save search results.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param nthreads: [int] Number of workers used to estimate FDR, default: None, all cpus.
+    :param backend: [str] 'process' or 'thread' worker pool, default: process.
+    :param fdr: [float] Evaluate candidates in similarity order and stop after two batches without any P-value under this FDR, default: None, all candidates.
+    :param approx: [float] Fraction of leading components scored to generate candidates of top genes, 1 is exact, default: 1.0.
+    :param index: [SimilarityIndex] Similarity index of gene_counts, default: None.
+    :param index_decoys: [bool] Read candidates of decoy tops from the index too, default: False.
+    :param checkpoint: [str] Checkpoint directory of the run, similarity scores and finished decoy blocks are resumed from it, default: None.
+    :return: search_res [pd.DataFrame] Searched genes, written to outfile + '.xls' unless outfile is None.
+    
+    '''
+    show_msg('>> Searching cell type-specific genes on the basis of query genes.', LOGS.info, verbose)
+    scored = load_stage(checkpoint, stage_name('scores', query_genes))
+    if scored is None: scored = save_stage(checkpoint, stage_name('scores', query_genes), score_queries(query_genes, gene_counts, verbose, approx = approx, index = index))
+    query_genes_remained, scores_actual = scored
+    show_msg('>> Estimating P-value to screen significant genes.', LOGS.info, verbose)
+    decoy_index = index if index_decoys else None
+    report_recall(gene_counts.loc[scores_actual.index, : ], approx, verbose, decoy_index)
+    with stage('estimate_FDR', candidates = len(scores_actual)):
+        pvalues = estimate_FDR(scores_actual, gene_counts.loc[scores_actual.index, : ], scores_actual.index, ncpus = nthreads, backend = backend, fdr = fdr, approx = approx, index = decoy_index,
+            checkpoint = stage_dir(checkpoint, stage_name('decoys', query_genes)))
+    if fdr is not None: show_msg('>> {0} of {1} candidates evaluated.'.format(pvalues[0].notna().sum(), pvalues.shape[0]), LOGS.info, verbose)
+    search_res = screen_markers(scores_actual, pvalues, query_genes_remained)
+    if outfile is None: return search_res
+    show_msg('>> Writing searched results to {0} file.'.format(outfile + '.xls'), LOGS.info, verbose)
+    with stage('write_results', rows = len(search_res)):
+        search_res.to_csv(outfile + '.xls', sep = '\t', index = True, header = True)
+    return search_res
+
+def search_batch(query_sets, gene_counts, outfile = None, verbose = True, nthreads = None, backend = 'process', combined = False, fdr = None, approx = 1.0, index = None, index_decoys = False, checkpoint = None, query_pass = None):
+    '''
+    Search marker genes for many query sets against one preprocessed profile. Similarity scores of
+    query genes are shared across sets, and decoys are scored once for sets with the same candidates.
+    :param query_sets: [OrderedDict] Query genes of each named query set.
+    :param gene_counts: [pd.DataFrame] Gene counts returned by rank_profiles, N genes x K samples.
+    :param outfile: [str] The prefix of files used to save search results.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param nthreads: [int] Number of workers used to estimate FDR, default: None, all cpus.
+    :param backend: [str] 'process' or 'thread' worker pool, default: process.
+    :param combined: [bool] Write one long-format table instead of one table per set, default: False.
+    :param fdr: [float] Evaluate candidates in similarity order and stop after two batches without any P-value under this FDR, default: None, all candidates.
+    :param approx: [float] Fraction of leading components scored to generate candidates of top genes, 1 is exact, default: 1.0.
+    :param index: [SimilarityIndex] Similarity index of gene_counts, default: None.
+    :param index_decoys: [bool] Read candidates of decoy tops from the index too, default: False.
+    :param checkpoint: [str] Checkpoint directory of the run, similarity scores and finished decoy blocks are resumed from it, default: None.
+    :param query_pass: [list] Query genes of all sets present in the profile, those filtered out of gene_counts are reported per set, default: None.
+    :return: search_res [OrderedDict] Searched genes of each passed query set, or [pd.DataFrame] one long-format table if combined.
+    
+    '''
+    scores_cache, scored, groups = {}, {}, {}
+    decoy_index = index if index_decoys else None
+    query_pass = set(query_pass) if query_pass is not None else set()
+    for name, query_genes in query_sets.items():
+        # the profile is preprocessed once for all sets, low-expressed query genes are not kept as a single search keeps them
+        lowexps = [ gene for gene in query_genes if gene in query_pass and gene not in gene_counts.index ]
+        if lowexps:
+            show_msg('>> Query genes of {0} below the expression cutoff are dropped, search them alone to keep them: {1}'.format(name, ', '.join(lowexps)), LOGS.warn, verbose)
+        query_genes = [ gene for gene in query_genes if gene in gene_counts.index ]
+        show_msg('>> Searching cell type-specific genes for query set {0}.'.format(name), LOGS.info, verbose)
+        if not query_genes:
+            show_msg('>> Query genes of {0} are not in the gene set of profiles, skip...'.format(name), LOGS.warn, verbose)
+            continue
+        try:
+            resumed = load_stage(checkpoint, stage_name('scores', query_genes))
+            scored[name] = resumed if resumed is not None else save_stage(checkpoint, stage_name('scores', query_genes), score_queries(query_genes, gene_counts, verbose, scores_cache, approx, index))
+        except SystemExit:
+            show_msg('>> Query set {0} failed the quality evaluation, skip...'.format(name), LOGS.warn, verbose)
+            continue
+        groups.setdefault(frozenset(scored[name][1].index), []).append(name)
+    
+    search_lst, search_sets = [], __import__('collections').OrderedDict()
+    for candidates, names in groups.items():
+        show_msg('>> Estimating P-value to screen significant genes: {0}.'.format(', '.join(names)), LOGS.info, verbose)
+        report_recall(gene_counts.loc[scored[names[0]][1].index, : ], approx, verbose, decoy_index)
+        masks = None
+        if len(names) > 1:
+            with stage('decoy_null', query_sets = len(names)):
+                masks = decoy_null(gene_counts.loc[scored[names[0]][1].index, : ], ncpus = nthreads, backend = backend, approx = approx, index = decoy_index,
+                    checkpoint = stage_dir(checkpoint, stage_name('null', scored[names[0]][1].index)))
+        for name in names:
+            query_genes_remained, scores_actual = scored[name]
+            with stage('estimate_FDR', query_set = name, candidates = len(scores_actual)):
+                pvalues = estimate_FDR(scores_actual, gene_counts.loc[scores_actual.index, : ], scores_actual.index, ncpus = nthreads, backend = backend, masks = masks, fdr = fdr, approx = approx, index = decoy_index,
+                    checkpoint = stage_dir(checkpoint, stage_name('decoys', query_genes_remained)))
+            if fdr is not None and masks is None:
+                show_msg('>> {0}: {1} of {2} candidates evaluated.'.format(name, pvalues[0].notna().sum(), pvalues.shape[0]), LOGS.info, verbose)
+            search_res = screen_markers(scores_actual, pvalues, query_genes_remained)
+            search_sets[name] = search_res
+            if combined:
+                search_lst.append(search_res.reset_index().assign(QuerySet = name))
+            elif outfile is not None:
+                show_msg('>> Writing searched results to {0} file.'.format('{0}-{1}.xls'.format(outfile, name)), LOGS.info, verbose)
+                with stage('write_results', query_set = name, rows = len(search_res)):
+                    search_res.to_csv('{0}-{1}.xls'.format(outfile, name), sep = '\t', index = True, header = True)
+    
+    search_sets = __import__('collections').OrderedDict((name, search_sets[name]) for name in query_sets if name in search_sets)
+    if not combined: return search_sets
+    search_res = pd.concat(search_lst, axis = 0) if search_lst else pd.DataFrame(columns = ['QuerySet'])
+    search_res = search_res[['QuerySet'] + [ col for col in search_res.columns if col != 'QuerySet' ]]
+    if outfile is not None and search_lst:
+        show_msg('>> Writing searched results to {0} file.'.format(outfile + '.xls'), LOGS.info, verbose)
+        with stage('write_results', rows = len(search_res)):
+            search_res.to_csv(outfile + '.xls', sep = '\t', index = False, header = True)
+    return search_res
+
+def search_dataset(profile_fil, query_genes, outfile, verbose = True, nthreads = 1, params = None):
+    '''
+    Preprocess and search one dataset of a meta-search, run inside a worker of the dataset pool.
+    :param profile_fil: [str] Gene expression profile file.
+    :param query_genes: [list] A list of query genes.
+    :param outfile: [str] The file used to save search results of the dataset.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param nthreads: [int] Number of threads used to estimate FDR, default: 1.
+    :param params: [dict] precision, out_of_core, svd_params, max_memory, cache_dir, cache_size, fdr and approx, default: None.
+    :return: search_res [pd.DataFrame], None if the query genes are missing or failed the quality evaluation.
+    
+    '''
+    params = params if params else {}
+    try:
+        query_genes, gene_counts = load_counts(profile_fil, query_genes, params.get('cache_dir'), params.get('cache_size'), verbose, 
+            params.get('precision', 'double'), params.get('out_of_core', False), params.get('svd_params'), max_memory = params.get('max_memory'), nthreads = nthreads)
+        # worker pools cannot be nested inside the dataset pool, decoys are scored by threads
+        return search_markers(query_genes, gene_counts, outfile, verbose, nthreads, 'thread', params.get('fdr'), params.get('approx', 1.0))
+    except SystemExit:
+        return None
+
+def meta_search(datasets, query_genes, outfile, verbose = True, nthreads = None, jobs = None, memory_budget = None, params = None):
+    '''
+    Search marker genes in many datasets concurrently and rank them by their consensus across datasets.
+    :param datasets: [OrderedDict] Profile file of each dataset name.
+    :param query_genes: [list] A list of query genes.
+    :param outfile: [str] The prefix of files used to save search results, PREFIX-NAME.xls per dataset and PREFIX.xls for the consensus.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param nthreads: [int] Number of cpus shared by all datasets, default: None, all cpus.
+    :param jobs: [int] Number of datasets searched at once, default: None, one per cpu.
+    :param memory_budget: [int] Maximum estimated bytes of datasets searched at once, default: None, unbounded.
+    :param params: [dict] precision, out_of_core, svd_params, max_memory, cache_dir, cache_size, fdr and approx, default: None.
+    :return: consensus [pd.DataFrame]
+    
+    '''
+    nthreads = nthreads if nthreads else __import__('multiprocessing').cpu_count()
+    jobs = max(1, min(len(datasets), jobs if jobs else nthreads))
+    show_msg('>> Searching {0} datasets, {1} at once'.format(len(datasets), jobs), LOGS.info, verbose)
+    job_lst = [ (name, profile_cost(profile_fil), (profile_fil, query_genes, '{0}-{1}'.format(outfile, name), verbose, max(1, nthreads // jobs), params))
+        for name, profile_fil in datasets.items() ]
+    with stage('meta_search', datasets = len(datasets), jobs = jobs):
+        search_sets = schedule(job_lst, search_dataset, jobs, memory_budget, LOGS, verbose)
+    
+    for name in [ name for name, search_res in search_sets.items() if search_res is None ]:
+        show_msg('>> Dataset {0} has no query genes passing the quality evaluation, skip...'.format(name), LOGS.warn, verbose)
+        search_sets.pop(name)
+    if not search_sets:
+        show_msg('>> No dataset can be searched with the query genes, exit...', LOGS.error, verbose)
+    consensus = consensus_ranking(search_sets)
+    show_msg('>> Writing consensus of {0} datasets to {1} file.'.format(len(search_sets), outfile + '.xls'), LOGS.info, verbose)
+    consensus.to_csv(outfile + '.xls', sep = '\t', index = True, header = True)
+    return consensus
+
+class Searcher(object):
+    '''
+    Search marker genes from Python, the profile is preprocessed once and kept in memory for all searches.
+    
+    '''
+    def __init__(self, profile, precision = 'double', out_of_core = False, svd_params = None, cache_dir = None, cache_size = None, 
+            index = None, index_k = CANDIDATE_NUM, nthreads = None, backend = 'process', verbose = False):
+        '''
+        :param profile: [str/pd.DataFrame] Gene expression profile file, or the profile itself, N genes x K samples.
+        :param precision: [str] 'double' or 'single' float precision of expression values, default: double.
+        :param out_of_core: [bool] Stream a profile file column by column from memory-mapped files, default: False.
+        :param svd_params: [dict] engine, n_components and time_budget of svd_filter, default: None, full PCA.
+        :param cache_dir: [str] Directory of cached profiles, only used for profile files, default: None, no cache.
+        :param cache_size: [int] Maximum bytes of the cache, default: None, unbounded.
+        :param index: [str] Directory of the similarity index, default: None, no index.
+        :param index_k: [int] Number of neighbors of each gene in the index, default: CANDIDATE_NUM.
+        :param nthreads: [int] Number of workers, default: None, all cpus.
+        :param backend: [str] 'process' or 'thread' worker pool, default: process.
+        :param verbose: [bool] verbose logical, to print the detailed information, default: False.
+        
+        '''
+        self.nthreads, self.backend, self.verbose = nthreads, backend, verbose
+        svd_params = svd_params if svd_params else {}
+        if isinstance(profile, pd.DataFrame):
+            profiles = profile.astype(PRECISIONS[precision], copy = False)
+            profiles = profiles.loc[~profiles.index.duplicated(keep = 'first')] if profiles.index.has_duplicates else profiles
+            self.gene_counts = rank_profiles(preprocess(profiles, [], verbose), verbose, **svd_params)
+        else:
+            self.gene_counts = load_counts(profile, [], cache_dir, cache_size, verbose, precision, out_of_core, svd_params, nthreads = nthreads)[1]
+        self.index = open_index(self.gene_counts, index, index_k, nthreads, backend, verbose) if index else None
+    
+    @property
+    def genes(self):
+        return self.gene_counts.index
+    
+    def search(self, query_genes, fdr = None, approx = 1.0, index_decoys = False):
+        '''
+        Search marker genes on the basis of query genes.
+        :param query_genes: [str/list] A query gene or a list of query genes.
+        :param fdr: [float] Evaluate candidates in similarity order and stop after two batches without any P-value under this FDR, default: None, all candidates.
+        :param approx: [float] Fraction of leading components scored to generate candidates of top genes, 1 is exact, default: 1.0.
+        :param index_decoys: [bool] Read candidates of decoy tops from the index too, default: False.
+        :return: search_res [pd.DataFrame] Searched genes, as written to PREFIX.xls by the command line.
+        
+        '''
+        query_genes = [query_genes] if isinstance(query_genes, str) else list(query_genes)
+        query_pass  = [ gene for gene in query_genes if gene in self.gene_counts.index ]
+        if not query_pass:
+            raise ValueError('Query genes are not in the gene set of profiles: {0}'.format(', '.join(query_genes)))
+        try:
+            return search_markers(query_pass, self.gene_counts, None, self.verbose, self.nthreads, self.backend, fdr, approx, self.index, index_decoys)
+        except SystemExit:
+            raise ValueError('Query genes failed the quality evaluation: {0}'.format(', '.join(query_pass)))
+    
+    def search_batch(self, query_sets, combined = False, fdr = None, approx = 1.0, index_decoys = False):
+        '''
+        Search marker genes for many named query sets, sets failed the quality evaluation are skipped.
+        :param query_sets: [dict] Query genes of each named query set.
+        :param combined: [bool] Return one long-format table instead of one table per set, default: False.
+        :param fdr: [float] Evaluate candidates in similarity order and stop after two batches without any P-value under this FDR, default: None, all candidates.
+        :param approx: [float] Fraction of leading components scored to generate candidates of top genes, 1 is exact, default: 1.0.
+        :param index_decoys: [bool] Read candidates of decoy tops from the index too, default: False.
+        :return: search_res [OrderedDict] Searched genes of each passed query set, or [pd.DataFrame] if combined.
+        
+        '''
+        return search_batch(query_sets, self.gene_counts, None, self.verbose, self.nthreads, self.backend, combined, fdr, approx, self.index, index_decoys)
+
 def run():
     '''
     The main function for SearchMarker tool.
@@ -116,15 +748,75 @@ def run():
     
     '''
     global ARGS
+    ARGS, profiler, start, status = None, None, time(), 0
     try:
-        ARGS, start, status  = parse_opts(LOGS), time(), 0
-        ARGS.query_genes = chk_quries(ARGS.profiles, ARGS.query_genes, ARGS.verbose)
-        profiles_sub = preprocess(ARGS.profiles, ARGS.query_genes, ARGS.verbose)
-        search_markers(ARGS.query_genes, profiles_sub, ARGS.outfile, ARGS.verbose)
+        ARGS = parse_opts(LOGS)
+        profiler = start_profiler(ARGS.profiler)
+        if ARGS.clear_cache and ARGS.cache_dir:
+            show_msg('>> Clearing cached profiles in {0}'.format(ARGS.cache_dir), LOGS.info, ARGS.verbose)
+            clear_cache(ARGS.cache_dir)
+            if not ARGS.profile: return status
+        
+        if ARGS.backend not in ['process', 'thread'] and ARGS.backend.split(':', 1)[0] not in ['dir', 'tcp']:
+            show_msg('>> --backend must be process, thread, dir:PATH or tcp:[HOST:]PORT, exit...', LOGS.error, ARGS.verbose)
+        
+        if ARGS.worker:
+            show_msg('>> Working for queue {0}'.format(ARGS.worker), LOGS.info, ARGS.verbose)
+            return work(ARGS.worker)
+        
+        if ARGS.serve:
+            factory = lambda profile: Searcher(profile, ARGS.precision, ARGS.out_of_core, ARGS.svd_params, ARGS.cache_dir, ARGS.cache_size, 
+                nthreads = ARGS.nthreads, backend = ARGS.backend, verbose = ARGS.verbose)
+            nth = ARGS.nthreads if ARGS.nthreads else __import__('multiprocessing').cpu_count()
+            workers = [ (nth, backend) for backend in ['thread', ARGS.backend] if nth > 1 or backend not in ['process', 'thread'] ]
+            return serve(ARGS.serve, ProfilePool(ARGS.atlases, factory, ARGS.memory_cap), LOGS, ARGS.verbose, workers)
+        
+        if ARGS.datasets:
+            if not ARGS.query_genes: show_msg('>> --query-genes must be specified with --datasets, exit...', LOGS.error, ARGS.verbose)
+            params = {'precision' : ARGS.precision, 'out_of_core' : ARGS.out_of_core, 'svd_params' : ARGS.svd_params, 'max_memory' : ARGS.max_memory, 
+                'cache_dir' : ARGS.cache_dir, 'cache_size' : ARGS.cache_size, 'fdr' : ARGS.fdr, 'approx' : ARGS.approx}
+            meta_search(ARGS.datasets, ARGS.query_genes, ARGS.outfile, ARGS.verbose, ARGS.nthreads, ARGS.meta_jobs, ARGS.meta_memory, params)
+            show_msg('>> Elapsed time is {} seconds'.format(time() - start), LOGS.info, ARGS.verbose)
+            return status
+        
+        if not (ARGS.query_sets or ARGS.query_genes or ARGS.index or ARGS.state):
+            show_msg('>> Either --query-genes, --manifest, --index or --state must be specified, exit...', LOGS.error, ARGS.verbose)
+        
+        ckpt_dir = None
+        if ARGS.checkpoint:
+            # the state is keyed by its path, its content changes once the appended samples are stored
+            key = checkpoint_key([ARGS.profile, ARGS.cell_labels, ARGS.append], state = ARGS.state, query_genes = ARGS.query_genes, query_sets = ARGS.query_sets and list(ARGS.query_sets.items()), precision = ARGS.precision, 
+                svd = sorted(ARGS.svd_params.items()), preprocess = sorted(PREPROCESS_PARAMS.items()), fdr = ARGS.fdr, approx = ARGS.approx, index_decoys = ARGS.index_decoys, query_modules = ARGS.query_modules)
+            ckpt_dir = open_checkpoint(ARGS.checkpoint, key, LOGS, ARGS.verbose)
+        
+        query_genes, gene_counts = ARGS.query_genes, load_stage(ckpt_dir, 'counts')
+        if ARGS.query_sets: query_genes = list(__import__('collections').OrderedDict.fromkeys(gene for genes in ARGS.query_sets.values() for gene in genes))
+        if gene_counts is not None:
+            show_msg('>> Loading preprocessed profile from checkpoint {0}'.format(ckpt_dir), LOGS.info, ARGS.verbose)
+            ARGS.query_genes = load_stage(ckpt_dir, 'query_genes')
+        elif ARGS.state:
+            ARGS.query_genes, gene_counts = state_counts(ARGS.state, query_genes, ARGS.profile, ARGS.append, ARGS.verbose, ARGS.precision, ARGS.svd_params, not ARGS.query_sets)
+        else:
+            ARGS.query_genes, gene_counts = load_counts(ARGS.profile, query_genes, ARGS.cache_dir, ARGS.cache_size, ARGS.verbose, ARGS.precision, ARGS.out_of_core, ARGS.svd_params, ARGS.cell_labels, ARGS.max_memory, ARGS.nthreads, 
+                keep_lowexps = not ARGS.query_sets)
+        if ckpt_dir and not os.path.exists(os.path.join(ckpt_dir, 'counts')): # query genes first, counts mark the stage as finished
+            save_stage(ckpt_dir, 'query_genes', ARGS.query_genes)
+            save_stage(ckpt_dir, 'counts', gene_counts)
+        index = open_index(gene_counts, ARGS.index, ARGS.index_k, ARGS.nthreads, ARGS.backend, ARGS.verbose) if ARGS.index else None
+        if ARGS.query_modules:
+            ARGS.query_sets = split_modules(ARGS.query_sets or {'' : ARGS.query_genes}, gene_counts, ARGS.query_modules, ARGS.verbose)
+        if ARGS.query_sets:
+            search_batch(ARGS.query_sets, gene_counts, ARGS.outfile, ARGS.verbose, ARGS.nthreads, ARGS.backend, ARGS.combined, ARGS.fdr, ARGS.approx, index, ARGS.index_decoys, ckpt_dir, ARGS.query_genes)
+        elif ARGS.query_genes:
+            search_markers(ARGS.query_genes, gene_counts, ARGS.outfile, ARGS.verbose, ARGS.nthreads, ARGS.backend, ARGS.fdr, ARGS.approx, index, ARGS.index_decoys, ckpt_dir)
         show_msg('>> Elapsed time is {} seconds'.format(time() - start), LOGS.info, ARGS.verbose)
     except Exception:
         __import__('traceback').print_exc()
         status = 1
+    finally:
+        if ARGS is not None:
+            stop_profiler(profiler, ARGS.outfile + '.prof')
+            if ARGS.report: write_report(ARGS.outfile + '.report.json', status = status, elapsed = time() - start, argv = sys.argv)
     return status
 
 if __name__ == '__main__':
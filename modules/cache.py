@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+#title       : cache.py
+#description : Content-addressed on-disk cache of preprocessed profiles.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : module
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load own and python modules
+
+import hashlib
+from modules.utils import *
+
+#-----------------------------------------------------
+# Bump to invalidate caches written by an older preprocessing pipeline
+
+CACHE_VERSION = 4
+
+#-----------------------------------------------------
+
+def file_digest(profile_fil, block_size = 2 ** 20):
+    '''
+    SHA1 digest of the content of a file.
+    :param profile_fil: [str] File to be hashed.
+    :param block_size: [int] Bytes read at once, default: 1MB.
+    :return: digest [str]
+
+    '''
+    sha = hashlib.sha1()
+    with open(profile_fil, 'rb') as fp:
+        for block in iter(lambda: fp.read(block_size), b''): sha.update(block)
+    return sha.hexdigest()
+
+def cache_key(profile_fil, **params):
+    '''
+    Cache key of a profile, made of the content of the file and the preprocessing parameters.
+    :param profile_fil: [str] Gene expression profile file.
+    :param params: [dict] Preprocessing parameters.
+    :return: key [str]
+
+    '''
+    key_infos = (CACHE_VERSION, file_digest(profile_fil), sorted(params.items()))
+    return hashlib.sha1(repr(key_infos).encode()).hexdigest()
+
+def entry_size(entry):
+    '''
+    Bytes used by a cache entry.
+    :param entry: [str] Directory of the cache entry.
+    :return: size [int]
+
+    '''
+    return sum(os.path.getsize(os.path.join(entry, fil)) for fil in os.listdir(entry))
+
+def cache_entries(cache_dir):
+    '''
+    Cache entries sorted from the most to the least recently used.
+    :param cache_dir: [str] Cache directory.
+    :return: entries [list]
+
+    '''
+    if not os.path.isdir(cache_dir): return []
+    entries = [ os.path.join(cache_dir, key) for key in os.listdir(cache_dir) if not key.startswith('.') ]
+    return sorted([ entry for entry in entries if os.path.isdir(entry) ], key = os.path.getmtime, reverse = True)
+
+def load_cache(cache_dir, key):
+    '''
+    Load a cached frame, memory-mapped from disk, an unreadable entry is removed to be cached again.
+    :param cache_dir: [str] Cache directory.
+    :param key: [str] Cache key returned by cache_key.
+    :return: frame [pd.DataFrame] or None if not cached.
+
+    '''
+    entry = os.path.join(cache_dir, key)
+    if not os.path.exists(os.path.join(entry, 'values.npy')): return None
+    try:
+        frame = SharedFrame(path = entry).attach()
+    except (EOFError, ValueError, OSError, pickle.UnpicklingError):
+        shutil.rmtree(entry, ignore_errors = True)
+        return None
+    os.utime(entry, None) # mark as recently used
+    return frame
+
+def cached_genes(cache_dir, key):
+    '''
+    All genes of the profile a cached frame was preprocessed from, before low-expression genes were filtered out.
+    :param cache_dir: [str] Cache directory.
+    :param key: [str] Cache key returned by cache_key.
+    :return: genes [pd.Index] or None if not cached or unreadable.
+
+    '''
+    return load_block(os.path.join(cache_dir, key, 'genes.pkl'))
+
+def save_cache(cache_dir, key, frame, max_size = None, genes = None):
+    '''
+    Save a frame into the cache and evict the least recently used entries beyond max_size.
+    :param cache_dir: [str] Cache directory.
+    :param key: [str] Cache key returned by cache_key.
+    :param frame: [pd.DataFrame] Numeric frame to be cached.
+    :param max_size: [int] Maximum bytes of the cache, default: None, unbounded.
+    :param genes: [pd.Index] All genes of the profile, read back by cached_genes, default: None.
+    :return: 0
+
+    '''
+    if not os.path.isdir(cache_dir): os.makedirs(cache_dir)
+    tmp_entry = tempfile.mkdtemp(prefix = '.tmp-', dir = cache_dir)
+    SharedFrame(frame, path = tmp_entry)
+    if genes is not None:
+        with open(os.path.join(tmp_entry, 'genes.pkl'), 'wb') as fp: pickle.dump(pd.Index(genes), fp, protocol = pickle.HIGHEST_PROTOCOL)
+    try:
+        os.rename(tmp_entry, os.path.join(cache_dir, key))
+    except OSError: # stored by a concurrent run
+        shutil.rmtree(tmp_entry, ignore_errors = True)
+    if max_size is not None: evict_cache(cache_dir, max_size)
+    return 0
+
+def evict_cache(cache_dir, max_size):
+    '''
+    Remove the least recently used entries until the cache fits in max_size, the latest entry is always kept.
+    :param cache_dir: [str] Cache directory.
+    :param max_size: [int] Maximum bytes of the cache.
+    :return: 0
+
+    '''
+    total_size = 0
+    for idx, entry in enumerate(cache_entries(cache_dir)):
+        total_size += entry_size(entry)
+        if idx and total_size > max_size: shutil.rmtree(entry, ignore_errors = True)
+    return 0
+
+def clear_cache(cache_dir):
+    '''
+    Invalidate all cached profiles.
+    :param cache_dir: [str] Cache directory.
+    :return: 0
+
+    '''
+    for entry in cache_entries(cache_dir): shutil.rmtree(entry, ignore_errors = True)
+    return 0
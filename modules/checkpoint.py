@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#title       : checkpoint.py
+#description : Checkpoints of finished stages of a run, validated against the hashes of its inputs.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : module
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load own and python modules
+
+import hashlib
+from modules.utils import *
+
+#-----------------------------------------------------
+# Bump to invalidate checkpoints written by an older pipeline
+
+CHECKPOINT_VERSION = 4
+
+#-----------------------------------------------------
+
+def checkpoint_key(input_fils, **params):
+    '''
+    key of a run, made of the content of its input files and of its parameters
+    :param input_fils: [list] input files, None entries are skipped
+    :param params: [dict] parameters changing the results
+    :return: key [str]
+
+    '''
+    file_digest = __import__('modules.cache', fromlist = ['file_digest']).file_digest
+    key_infos = (CHECKPOINT_VERSION, [ file_digest(fil) for fil in input_fils if fil ], sorted(params.items()))
+    return hashlib.sha1(repr(key_infos).encode()).hexdigest()
+
+def open_checkpoint(ckpt_dir, key, LOGS = None, verbose = True):
+    '''
+    open the checkpoint directory of a run, checkpoints of other inputs are removed
+    :param ckpt_dir: [str] checkpoint directory
+    :param key: [str] key returned by checkpoint_key
+    :param LOGS: [obj] Log object, default: None
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True
+    :return: ckpt_dir [str]
+
+    '''
+    key_fil = os.path.join(ckpt_dir, 'KEY')
+    if os.path.exists(key_fil):
+        with open(key_fil) as fp: stored = fp.read().strip()
+        if stored == key:
+            if LOGS: show_msg('>> Resuming from checkpoint {0}'.format(ckpt_dir), LOGS.info, verbose)
+            return ckpt_dir
+        if LOGS: show_msg('>> Inputs changed since checkpoint {0}, starting over'.format(ckpt_dir), LOGS.warn, verbose)
+        shutil.rmtree(ckpt_dir, ignore_errors = True)
+    if not os.path.isdir(ckpt_dir): os.makedirs(ckpt_dir)
+    with open(key_fil, 'w') as fp: fp.write(key + '\n')
+    return ckpt_dir
+
+def load_stage(ckpt_dir, name):
+    '''
+    result of a finished stage, frames are memory-mapped
+    :param ckpt_dir: [str] checkpoint directory, None for no checkpoint
+    :param name: [str] stage name
+    :return: result of the stage, or None if not finished or unreadable
+
+    '''
+    if not ckpt_dir: return None
+    path = os.path.join(ckpt_dir, name)
+    if os.path.exists(os.path.join(path, 'values.npy')): return SharedFrame(path = path).attach()
+    return load_block(path + '.pkl')
+
+def save_stage(ckpt_dir, name, result):
+    '''
+    persist the result of a finished stage, numeric frames as memory-mappable arrays and anything else pickled,
+    written aside first so an interrupted write is never taken as finished
+    :param ckpt_dir: [str] checkpoint directory, None for no checkpoint
+    :param name: [str] stage name
+    :param result: result of the stage
+    :return: result
+
+    '''
+    if not ckpt_dir: return result
+    path = os.path.join(ckpt_dir, name)
+    if isinstance(result, pd.DataFrame) and result.values.dtype.kind in 'biuf':
+        tmp_dir = tempfile.mkdtemp(prefix = '.tmp-', dir = ckpt_dir)
+        SharedFrame(result, path = tmp_dir)
+        shutil.rmtree(path, ignore_errors = True)
+        os.rename(tmp_dir, path)
+    else:
+        with open(path + '.tmp', 'wb') as fp: pickle.dump(result, fp, protocol = pickle.HIGHEST_PROTOCOL)
+        os.rename(path + '.tmp', path + '.pkl')
+    return result
+
+def stage_name(name, genes):
+    '''
+    name of a stage depending on a gene list, e.g. the query genes of a set
+    :param name: [str] stage name
+    :param genes: [list] gene names
+    :return: name [str]
+
+    '''
+    return '{0}-{1}'.format(name, hashlib.sha1(repr(list(genes)).encode()).hexdigest()[0 : 16])
+
+def stage_dir(ckpt_dir, name):
+    '''
+    directory of the finished blocks of a stage run by multi_process
+    :param ckpt_dir: [str] checkpoint directory, None for no checkpoint
+    :param name: [str] stage name
+    :return: path [str] or None
+
+    '''
+    return os.path.join(ckpt_dir, name) if ckpt_dir else None
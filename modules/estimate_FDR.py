@@ -9,7 +9,22 @@
 # load own and python modules
  
 from modules.utils   import *
-from modules.models  import measure_similarity
+from modules.models  import similarity_lut, measure_similarity_block
+
+#-----------------------------------------------------
+# Upper bound of decoys x genes x samples cells scored at once
+
+BLOCK_CELLS = 2 ** 20
+
+#-----------------------------------------------------
+# Candidates per batch of the incremental mode, and batches without any passable candidate before stopping
+
+FDR_BATCH, FDR_PATIENCE = 200, 2
+
+#-----------------------------------------------------
+# Candidates per top gene kept by the approximate search, and genes sampled to measure its recall
+
+APPROX_EXPAND, RECALL_SAMPLE = 4, 100
 
 #-----------------------------------------------------
 
@@ -35,51 +50,318 @@ def multipletests(pvals):
     pvals_corrected_[pvals_sortind] = pvals_corrected
     return pvals_corrected_
 
-def phyper_test(decoy_counts, gene_counts, tar_genes, top_num = 20):
+def phyper_table(gene_num, tar_len, sel_num):
+    '''
+    Upper tail of the hypergeometric distribution for every possible overlap size.
+    :param gene_num: [int] Number of genes.
+    :param tar_len: [int] Number of target genes.
+    :param sel_num: [int] Number of genes selected for each decoy.
+    :return: pval_tab [np.array] P(X >= common_len) for common_len in [0, sel_num].
+    
+    '''
+    hypergeom = __import__('scipy.stats').stats.hypergeom
+    pval_tab = np.array([
+            1 - hypergeom.cdf(common_len - 1, gene_num, tar_len, sel_num) for common_len in range(sel_num + 1)
+        ])
+    return pval_tab
+
+def top_masks(scores_decoy, top_num):
+    '''
+    Mark the top N scored genes of each decoy by partial selection.
+    :param scores_decoy: [np.array] Similarity scores, B decoys x N genes.
+    :param top_num: [int] Top N genes.
+    :return: masks [np.array] Boolean B x N, True for the selected genes.
+    
+    '''
+    gene_num = scores_decoy.shape[1]
+    if top_num >= gene_num: return np.ones(scores_decoy.shape, dtype = bool)
+    kth_scores = np.partition(scores_decoy, gene_num - top_num, axis = 1)[:, gene_num - top_num]
+    masks = scores_decoy >= kth_scores[:, np.newaxis]
+    for idx in np.where(masks.sum(axis = 1) != top_num)[0]: # ties at the boundary, keep the full sort order
+        masks[idx] = False
+        masks[idx, scores_decoy[idx].argsort()[::-1][0 : top_num]] = True
+    return masks
+
+def rerank_masks(query_block, gene_counts, lut, top_num, cand_idxes):
+    '''
+    Mark the top N genes of each query among its candidates by their exact scores, queries with less than 
+    top_num candidates are scored over all genes.
+    :param query_block: [np.array] Integer counts of B query genes, B x K.
+    :param gene_counts: [np.array] Integer counts of N genes, N x K.
+    :param lut: [np.array] Lookup table returned by similarity_lut.
+    :param top_num: [int] Top N genes.
+    :param cand_idxes: [np.array] B x M candidate positions in gene_counts, -1 for missing candidates.
+    :return: masks [np.array] Boolean B x N, True for the selected genes.
+    
+    '''
+    valid = cand_idxes >= 0
+    diff_cnts    = np.abs(gene_counts[np.maximum(cand_idxes, 0)] - query_block[:, np.newaxis, :])
+    scores_cand  = np.where(valid, np.take(lut, diff_cnts).sum(axis = 2), -np.inf)
+    cand_masks   = top_masks(scores_cand, top_num) & valid
+    
+    masks = np.zeros((query_block.shape[0], gene_counts.shape[0]), dtype = bool)
+    masks[np.nonzero(cand_masks)[0], cand_idxes[cand_masks]] = True
+    short = valid.sum(axis = 1) < min(top_num, gene_counts.shape[0])
+    if short.any(): masks[short] = top_masks(measure_similarity_block(query_block[short], gene_counts, lut), top_num)
+    return masks
+
+def approx_top_masks(query_block, gene_counts, lut, top_num, approx = 1.0, expand = APPROX_EXPAND):
+    '''
+    Mark the top N genes of each query, candidates are generated from partial scores over the leading components 
+    and re-ranked by their exact scores.
+    :param query_block: [np.array] Integer counts of B query genes, B x K.
+    :param gene_counts: [np.array] Integer counts of N genes, N x K.
+    :param lut: [np.array] Lookup table returned by similarity_lut.
+    :param top_num: [int] Top N genes.
+    :param approx: [float] Fraction of leading components scored to generate candidates, 1 is exact, default: 1.0.
+    :param expand: [int] Candidates kept per top gene, default: APPROX_EXPAND.
+    :return: masks [np.array] Boolean B x N, True for the selected genes.
+    
+    '''
+    gene_num, ncols = gene_counts.shape
+    sub_cols, cand_num = max(1, int(np.ceil(approx * ncols))), min(gene_num, top_num * expand)
+    if sub_cols >= ncols or cand_num >= gene_num:
+        return top_masks(measure_similarity_block(query_block, gene_counts, lut), top_num)
+    
+    scores_part = measure_similarity_block(query_block[:, 0 : sub_cols], gene_counts[:, 0 : sub_cols], lut)
+    cand_idxes  = np.argpartition(-scores_part, cand_num - 1, axis = 1)[:, 0 : cand_num]
+    return rerank_masks(query_block, gene_counts, lut, top_num, cand_idxes)
+
+def block_top_masks(query_block, gene_counts, lut, top_num, approx = 1.0, cand_idxes = None):
     '''
-    Hypergeometric test for each gene.
-    :param decoy_counts: [np.array] Decoy gene counts data.
+    Mark the top N genes of each query, from candidates of the similarity index if given, otherwise by approx_top_masks.
+    :param query_block: [np.array] Integer counts of B query genes, B x K.
+    :param gene_counts: [np.array] Integer counts of N genes, N x K.
+    :param lut: [np.array] Lookup table returned by similarity_lut.
+    :param top_num: [int] Top N genes.
+    :param approx: [float] Fraction of leading components scored to generate candidates, 1 is exact, default: 1.0.
+    :param cand_idxes: [np.array] B x M candidate positions read from the similarity index, default: None.
+    :return: masks [np.array] Boolean B x N, True for the selected genes.
+    
+    '''
+    if cand_idxes is not None: return rerank_masks(query_block, gene_counts, lut, top_num, cand_idxes)
+    return approx_top_masks(query_block, gene_counts, lut, top_num, approx)
+
+def measure_recall(gene_counts, top_num = 20, approx = 1.0, sample = RECALL_SAMPLE, cand_idxes = None):
+    '''
+    Recall of the approximate top N genes against the exact ones, measured on evenly spaced genes used as queries.
+    :param gene_counts: [pd.DataFrame] Gene counts data.
+    :param top_num: [int] Top N genes, default: 20.
+    :param approx: [float] Fraction of leading components scored to generate candidates, default: 1.0.
+    :param sample: [int] Number of genes used as queries, default: RECALL_SAMPLE.
+    :param cand_idxes: [np.array] Candidate positions of each gene read from the similarity index, default: None.
+    :return: recall [float]
+    
+    '''
+    counts_ary = np.asarray(gene_counts, dtype = diff_dtype(gene_counts.shape[0]))
+    rows = np.linspace(0, counts_ary.shape[0] - 1, min(sample, counts_ary.shape[0])).astype(int)
+    query_ary, lut = counts_ary[rows], similarity_lut(counts_ary.shape[0])
+    exact_masks  = top_masks(measure_similarity_block(query_ary, counts_ary, lut), top_num)
+    approx_masks = block_top_masks(query_ary, counts_ary, lut, top_num, approx, None if cand_idxes is None else cand_idxes[rows])
+    recall = (exact_masks & approx_masks).sum() / exact_masks.sum()
+    return recall
+
+def overlap_stats(ovp_idxes, pval_tab, upst_idxes, top_num):
+    '''
+    Hypergeometric p value, jaccard, ORscore and count from the overlaps between decoy tops and target genes.
+    :param ovp_idxes: [np.array] Boolean B decoys x T target genes, True if the target gene is in the decoy top.
+    :param pval_tab: [np.array] Table returned by phyper_table.
+    :param upst_idxes: [np.array] Boolean T, True for the upstream target genes.
+    :param top_num: [int] Top N genes.
+    :return: p values [np.array] pvalue, jaccard, ORscore and count of each decoy.
+
+    '''
+    common_len = ovp_idxes.sum(axis = 1)
+    upst_genes = ovp_idxes[:, upst_idxes].sum(axis = 1)
+    pvals = np.column_stack([
+            pval_tab[common_len], 
+            common_len / (top_num * 2 - common_len), 
+            upst_genes / (common_len - upst_genes + 1), 
+            common_len
+        ])
+    return pvals
+
+def decoy_tops(decoy_counts, gene_counts, top_num = 20, block_cells = BLOCK_CELLS, approx = 1.0, cand_idxes = None):
+    '''
+    Mark the top N genes of each decoy, decoys are scored block by block.
+    :param decoy_counts: [pd.DataFrame] Decoy gene counts data.
+    :param gene_counts: [pd.DataFrame] Gene counts data.
+    :param top_num: [int] Top N genes, default: 20.
+    :param block_cells: [int] Maximum number of decoys x genes x samples cells scored at once, default: BLOCK_CELLS.
+    :param approx: [float] Fraction of leading components scored to generate candidates, 1 is exact, default: 1.0.
+    :param cand_idxes: [np.array] Candidate positions of each gene read from the similarity index, default: None.
+    :return: masks [np.array] Boolean B decoys x N genes.
+    
+    '''
+    decoy_counts = decoy_counts[0] if isinstance(decoy_counts, list) else decoy_counts
+    gene_num, ncols = gene_counts.shape
+    counts_ary = np.asarray(gene_counts, dtype = diff_dtype(gene_num))
+    decoy_ary  = np.asarray(decoy_counts, dtype = diff_dtype(gene_num))
+    lut, block_size = similarity_lut(gene_num), max(1, block_cells // (gene_num * ncols))
+    cand_idxes = None if cand_idxes is None else cand_idxes[gene_counts.index.get_indexer(decoy_counts.index)]
+    
+    masks = np.zeros((decoy_ary.shape[0], gene_num), dtype = bool)
+    for start in range(0, decoy_ary.shape[0], block_size):
+        block_cands = None if cand_idxes is None else cand_idxes[start : start + block_size]
+        masks[start : start + block_size] = block_top_masks(decoy_ary[start : start + block_size], counts_ary, lut, top_num, approx, block_cands)
+    return masks
+
+def phyper_test(decoy_counts, gene_counts, tar_genes, top_num = 20, block_cells = BLOCK_CELLS, approx = 1.0, cand_idxes = None):
+    '''
+    Hypergeometric test for each gene, decoys are scored block by block.
+    :param decoy_counts: [pd.DataFrame] Decoy gene counts data.
     :param gene_counts: [pd.DataFrame] Gene counts data.
     :param tar_genes: [np.array] Target gene count data.
     :param top_num: [int] Top N genes, default: 20.
-    :return: p values
+    :param block_cells: [int] Maximum number of decoys x genes x samples cells scored at once, default: BLOCK_CELLS.
+    :param approx: [float] Fraction of leading components scored to generate candidates, 1 is exact, default: 1.0.
+    :param cand_idxes: [np.array] Candidate positions of each gene read from the similarity index, default: None.
+    :return: p values [np.array] pvalue, jaccard, ORscore and count of each decoy.
     
     '''
-    idx_ary, half_num = np.arange(1, top_num + 1), top_num / 2
-    gene_num, gene_names, pvals, tar_len = gene_counts.shape[0], gene_counts.index.values, [], len(tar_genes)
     decoy_counts = decoy_counts[0] if isinstance(decoy_counts, list) else decoy_counts
-    for idx, decoy in enumerate(decoy_counts.values):
-        scores_decoy = measure_similarity(decoy, gene_counts, gene_num, axis = 1)
-        decoy_genes  = gene_names[scores_decoy.argsort()[::-1][0 : top_num]]
-        ovp_idxes    = np.in1d(tar_genes, decoy_genes)
-        common_len   = np.sum(ovp_idxes)
-        idx_ovp      = idx_ary[ovp_idxes]
-        upst_genes   = np.sum(idx_ovp <= half_num)
-        pval = 1 - stats.hypergeom.cdf(common_len - 1, gene_num, tar_len, len(decoy_genes))
-        pvals.append([pval, common_len / (top_num * 2 - common_len), upst_genes / (common_len - upst_genes + 1), common_len])
+    gene_num, ncols = gene_counts.shape
+    sel_num, tar_len = min(top_num, gene_num), len(tar_genes)
+    counts_ary = np.asarray(gene_counts, dtype = diff_dtype(gene_num))
+    decoy_ary  = np.asarray(decoy_counts, dtype = diff_dtype(gene_num))
+    tar_idxes  = gene_counts.index.get_indexer(tar_genes)
+    upst_idxes = np.arange(1, tar_len + 1) <= top_num / 2
+    lut, pval_tab = similarity_lut(gene_num), phyper_table(gene_num, tar_len, sel_num)
+    block_size = max(1, block_cells // (gene_num * ncols))
+    cand_idxes = None if cand_idxes is None else cand_idxes[gene_counts.index.get_indexer(decoy_counts.index)]
+    
+    pvals = np.zeros((decoy_ary.shape[0], 4))
+    for start in range(0, decoy_ary.shape[0], block_size):
+        block_cands = None if cand_idxes is None else cand_idxes[start : start + block_size]
+        ovp_idxes = block_top_masks(decoy_ary[start : start + block_size], counts_ary, lut, top_num, approx, block_cands)[:, tar_idxes]
+        pvals[start : start + block_size] = overlap_stats(ovp_idxes, pval_tab, upst_idxes, top_num)
     return pvals
+
+def decoy_null(gene_counts, top_num = 20, ncpus = None, backend = 'process', approx = 1.0, index = None, checkpoint = None):
+    '''
+    Decoy tops of a candidate gene set, shared by every query set whose candidates are the same genes.
+    :param gene_counts: [pd.DataFrame] Gene counts data of the candidate genes.
+    :param top_num: [int] Top N genes, default: 20.
+    :param ncpus: [int] Number of workers, default: None, all cpus.
+    :param backend: [str] 'process' or 'thread' worker pool, default: process.
+    :param approx: [float] Fraction of leading components scored to generate candidates, 1 is exact, default: 1.0.
+    :param index: [SimilarityIndex] Read candidates of decoy tops from the similarity index, default: None.
+    :param checkpoint: [str] Directory where finished blocks of decoys are kept, default: None.
+    :return: masks [pd.DataFrame] Boolean decoys x genes, indexed by the candidate genes.
     
-def estimate_FDR(scores_actual, gene_counts, genes_names, top_num = 20):
+    '''
+    gene_counts = (gene_counts.rank(axis = 0, method = 'min') - 1).astype(rank_dtype(gene_counts.shape[0])).sort_index() # ties broken as estimate_FDR does
+    ncpus       = ncpus if ncpus else __import__('multiprocessing').cpu_count()
+    masks       = multi_process(
+            gene_counts,
+            decoy_tops,
+            ncpus,
+            True,
+            backend = backend,
+            checkpoint = checkpoint,
+            gene_counts = gene_counts,
+            top_num = top_num,
+            approx = approx,
+            cand_idxes = None if index is None else index.candidates(gene_counts.index, top_num * APPROX_EXPAND)
+        )
+    masks.index, masks.columns = gene_counts.index, gene_counts.index
+    return masks
+    
+def estimate_FDR_lazy(scores_actual, gene_counts, tar_genes, fdr, top_num = 20, ncpus = None, backend = 'process', batch_size = FDR_BATCH, patience = FDR_PATIENCE, approx = 1.0, cand_idxes = None, checkpoint = None):
+    '''
+    Calculate P value of candidates in similarity order batch by batch, and stop after patience batches without any 
+    p-value under fdr. This is a heuristic, not a bound: a skipped candidate of lower similarity may still pass. Skipped 
+    candidates count as p = 1 in the q-values, so an evaluated candidate passing fdr also passes over all candidates. 
+    They are reported as NaN with Evaluated False.
+    :param scores_actual: [pd.Series] Similarity score of each gene between query genes.
+    :param gene_counts: [pd.DataFrame] Gene counts data, ranked within candidates.
+    :param tar_genes: [np.array] Target genes.
+    :param fdr: [float] FDR threshold.
+    :param top_num: [int] Top N genes, default: 20.
+    :param ncpus: [int] Number of workers, default: None, all cpus.
+    :param backend: [str] 'process' or 'thread' worker pool, default: process.
+    :param batch_size: [int] Candidates per batch, default: FDR_BATCH.
+    :param patience: [int] Batches without any p-value under fdr before stopping, default: FDR_PATIENCE.
+    :param approx: [float] Fraction of leading components scored to generate candidates, 1 is exact, default: 1.0.
+    :param cand_idxes: [np.array] Candidate positions of each gene among the genes sorted by name, read from the similarity index, default: None.
+    :param checkpoint: [str] Directory where finished blocks of decoys are kept, one sub-directory per batch, default: None.
+    :return: pvalues, jaccard, ORscore, Count, qvalues and Evaluated [pd.DataFrame]
+    
+    '''
+    order, misses = np.argsort(-scores_actual.values, kind = 'stable'), 0
+    pvals, qvals  = np.full((len(order), 4), np.nan), np.full(len(order), np.nan)
+    universe      = gene_counts.sort_index()
+    for start in range(0, len(order), batch_size):
+        rows = order[start : start + batch_size]
+        pvals[rows] = multi_process(
+                gene_counts.iloc[rows],
+                phyper_test,
+                ncpus,
+                True,
+                backend = backend,
+                checkpoint = os.path.join(checkpoint, 'batch-{0}'.format(start)) if checkpoint else None,
+                gene_counts = universe,
+                tar_genes = tar_genes,
+                top_num = top_num,
+                approx = approx,
+                cand_idxes = cand_idxes
+            ).values
+        misses = 0 if np.any(pvals[rows, 0] <= fdr) else misses + 1
+        if misses >= patience: break
+    
+    evaluated = ~np.isnan(pvals[:, 0])
+    qvals[evaluated] = multipletests(np.where(evaluated, pvals[:, 0], 1))[evaluated]
+    pvalues = pd.DataFrame(pvals)
+    pvalues['FDR'] = qvals
+    pvalues['Evaluated'] = evaluated
+    return pvalues
+
+def estimate_FDR(scores_actual, gene_counts, genes_names, top_num = 20, ncpus = None, backend = 'process', masks = None, fdr = None, approx = 1.0, index = None, checkpoint = None):
     '''
     Calculate P value of each score between query and target genes.
     :param scores_res: [pd.DataFrame] Similarity score of each gene between query genes.
     :param gene_counts: [pd.DataFrame] Gene counts data.
     :param genes_names: [np.array] A list of gene names.
     :param top_num: [int] Top N genes, default: 20.
+    :param ncpus: [int] Number of workers, default: None, all cpus.
+    :param backend: [str] 'process' or 'thread' worker pool, default: process.
+    :param masks: [pd.DataFrame] Decoy tops returned by decoy_null for the same genes, default: None, scored here.
+    :param fdr: [float] Evaluate candidates incrementally and stop after FDR_PATIENCE batches without any p-value under fdr, default: None, all candidates.
+    :param approx: [float] Fraction of leading components scored to generate candidates of decoy tops, 1 is exact, default: 1.0.
+    :param index: [SimilarityIndex] Read candidates of decoy tops from the similarity index, default: None.
+    :param checkpoint: [str] Directory where finished blocks of decoys are kept, a restarted run skips them, default: None.
     :return: pvalues, qvalues, jaccard, ORscore, Count [pd.DataFrame]
     
     '''
-    gene_counts = gene_counts.rank(axis = 0, method = 'min') - 1
-    tar_genes   = genes_names[scores_actual.argsort()[::-1][0 : top_num]]
-    ncpus       = __import__('multiprocessing').cpu_count()
+    tar_genes = genes_names[scores_actual.argsort()[::-1][0 : top_num]]
+    if masks is not None:
+        gene_num, tar_len = masks.shape[1], len(tar_genes)
+        masks     = masks.loc[gene_counts.index, gene_counts.index]
+        pval_tab  = phyper_table(gene_num, tar_len, min(top_num, gene_num))
+        ovp_idxes = masks.values[:, masks.columns.get_indexer(tar_genes)]
+        pvalues   = pd.DataFrame(overlap_stats(ovp_idxes, pval_tab, np.arange(1, tar_len + 1) <= top_num / 2, top_num))
+        pvalues['FDR'] = multipletests(pvalues.values[:, 0])
+        return pvalues
+    
+    gene_counts = (gene_counts.rank(axis = 0, method = 'min') - 1).astype(rank_dtype(gene_counts.shape[0]))
+    universe    = gene_counts.sort_index() # decoy tops break ties by gene name, so query sets of the same candidates in another order share them
+    ncpus       = ncpus if ncpus else __import__('multiprocessing').cpu_count()
+    cand_idxes  = None if index is None else index.candidates(universe.index, top_num * APPROX_EXPAND)
+    if fdr is not None:
+        return estimate_FDR_lazy(scores_actual, gene_counts, tar_genes.values, fdr, top_num, ncpus, backend, approx = approx, cand_idxes = cand_idxes, checkpoint = checkpoint)
+    
     pvalues     = multi_process(
             gene_counts,
             phyper_test,
             ncpus,
             True,
-            gene_counts = gene_counts,
+            backend = backend,
+            checkpoint = checkpoint,
+            gene_counts = universe,
             tar_genes = tar_genes.values,
-            top_num = top_num
+            top_num = top_num,
+            approx = approx,
+            cand_idxes = cand_idxes
         )
     pvalues['FDR'] = multipletests(pvalues.values[:, 0])
     return pvalues
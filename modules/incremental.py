@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#title       : incremental.py
+#description : Preprocessing state of a profile updated in place when samples are appended.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : module
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load own and python modules
+
+from modules.utils import *
+
+#-----------------------------------------------------
+# Bump to invalidate states written by an older preprocessing pipeline
+
+STATE_VERSION = 2
+
+#-----------------------------------------------------
+
+def column_ranks(values):
+    '''
+    quantile positions of every value within its column, as quantile_normalized indexes the reference
+    :param values: [np.array] N genes x K samples
+    :return: rank_idx [np.array] N x K positions in the smallest unsigned dtype, sorted_sum [np.array] sum of the sorted columns
+
+    '''
+    rankdata = __import__('scipy.stats').stats.rankdata
+    rank_idx = np.empty(values.shape, dtype = rank_dtype(values.shape[0]), order = 'F')
+    sorted_sum = np.zeros(values.shape[0])
+    for idx in range(values.shape[1]):
+        rank_idx[:, idx] = rankdata(values[:, idx]).astype(int) - 1
+        sorted_sum += np.sort(values[:, idx])
+    return rank_idx, sorted_sum
+
+def build_state(profiles):
+    '''
+    preprocessing state of a profile, only the quantile positions of samples and the running quantile reference are kept
+    :param profiles: [pd.DataFrame] gene expression profile, N genes x K samples
+    :return: state [dict]
+
+    '''
+    logc = bool(is_logscale(profiles))
+    values = 2 ** profiles.values if logc else profiles.values
+    rank_idx, sorted_sum = column_ranks(values)
+    return {
+            'version'    : STATE_VERSION,
+            'genes'      : profiles.index,
+            'samples'    : profiles.columns,
+            'logc'       : logc,
+            'rank_idx'   : rank_idx,
+            'sorted_sum' : sorted_sum,
+            'basis'      : None,
+            'counts'     : None
+        }
+
+def append_state(state, profiles):
+    '''
+    append samples to a state, only the new columns are ranked and sorted, the log scale of the first profile is kept
+    :param state: [dict] state returned by build_state or load_state
+    :param profiles: [pd.DataFrame] new samples, the genes of the state must all be present
+    :return: state [dict] updated state, the cached counts are dropped
+
+    '''
+    missing = state['genes'].difference(profiles.index)
+    if len(missing): raise ValueError('{0} genes of the state are missing from the appended samples, e.g. {1}'.format(len(missing), missing[0]))
+    duplicated = state['samples'].intersection(profiles.columns)
+    if len(duplicated): raise ValueError('Samples already in the state: {0}'.format(', '.join(map(str, duplicated[0 : 5]))))
+
+    values = profiles.loc[state['genes']].values
+    values = 2 ** values if state['logc'] else values
+    rank_idx, sorted_sum = column_ranks(values)
+    return dict(state,
+            samples    = state['samples'].append(profiles.columns),
+            rank_idx   = np.hstack([state['rank_idx'], rank_idx]),
+            sorted_sum = state['sorted_sum'] + sorted_sum,
+            counts     = None
+        )
+
+def state_normalized(state, dtype = np.float64):
+    '''
+    quantile normalized profile of a state, every sample is looked up in the current reference
+    :param state: [dict] state returned by build_state, append_state or load_state
+    :param dtype: [np.dtype] data type of normalized values, default: np.float64
+    :return: profiles_norm [pd.DataFrame]
+
+    '''
+    quantiles = (state['sorted_sum'] / state['rank_idx'].shape[1]).astype(dtype)
+    return pd.DataFrame(quantiles[state['rank_idx']], index = state['genes'])
+
+def save_state(state_dir, state):
+    '''
+    write a state, the previous one is replaced only once the new one is complete
+    :param state_dir: [str] directory of the state
+    :param state: [dict] state to be saved
+    :return: 0
+
+    '''
+    parent = os.path.dirname(os.path.abspath(state_dir))
+    if not os.path.isdir(parent): os.makedirs(parent)
+    tmp_dir = tempfile.mkdtemp(prefix = '.tmp-state-', dir = parent)
+    np.save(os.path.join(tmp_dir, 'rank_idx.npy'), state['rank_idx'])
+    np.save(os.path.join(tmp_dir, 'sorted_sum.npy'), state['sorted_sum'])
+    with open(os.path.join(tmp_dir, 'meta.pkl'), 'wb') as fp:
+        pickle.dump((state['version'], state['genes'], state['samples'], state['logc']), fp, protocol = pickle.HIGHEST_PROTOCOL)
+    for key in [ key for key in ['basis', 'counts'] if state[key] is not None ]:
+        os.makedirs(os.path.join(tmp_dir, key))
+        SharedFrame(state[key], path = os.path.join(tmp_dir, key))
+
+    old_dir = state_dir + '.old'
+    if os.path.exists(state_dir): os.rename(state_dir, old_dir)
+    os.rename(tmp_dir, state_dir)
+    shutil.rmtree(old_dir, ignore_errors = True)
+    for key in ['basis', 'counts']: ATTACHED.pop(os.path.join(state_dir, key), None) # frames attached from the replaced state
+    return 0
+
+def load_state(state_dir):
+    '''
+    read a state, quantile positions, basis and gene counts are memory-mapped
+    :param state_dir: [str] directory of the state
+    :return: state [dict] or None if missing or written by an older pipeline
+
+    '''
+    if not os.path.exists(os.path.join(state_dir, 'meta.pkl')): return None
+    with open(os.path.join(state_dir, 'meta.pkl'), 'rb') as fp:
+        version, genes, samples, logc = pickle.load(fp)
+    if version != STATE_VERSION: return None
+    attach = lambda key: SharedFrame(path = os.path.join(state_dir, key)).attach() if os.path.isdir(os.path.join(state_dir, key)) else None
+    return {
+            'version'    : version,
+            'genes'      : genes,
+            'samples'    : samples,
+            'logc'       : logc,
+            'rank_idx'   : np.load(os.path.join(state_dir, 'rank_idx.npy'), mmap_mode = 'r'),
+            'sorted_sum' : np.load(os.path.join(state_dir, 'sorted_sum.npy')),
+            'basis'      : attach('basis'),
+            'counts'     : attach('counts')
+        }
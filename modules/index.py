@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+#title       : index.py
+#description : Persistent top-k similarity graph of a preprocessed profile.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : module
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load own and python modules
+
+import hashlib
+from modules.utils  import *
+from modules.models import similarity_lut, measure_similarity_block
+
+#-----------------------------------------------------
+# Genes per tile scored against a block of genes, and upper bound of genes x tile x samples cells scored at once
+
+TILE_GENES, TILE_CELLS = 4096, 2 ** 22
+
+#-----------------------------------------------------
+
+class SimilarityIndex(object):
+    '''
+    top-k most similar genes of every gene, neighbor ids and scores are memory-mapped from the index directory
+
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.pkl'), 'rb') as fp:
+            self.genes, self.fingerprint = pickle.load(fp)
+        self.neighbors = np.load(os.path.join(path, 'neighbors.npy'), mmap_mode = 'r')
+        self.scores    = np.load(os.path.join(path, 'scores.npy'), mmap_mode = 'r')
+        self.top_k     = self.neighbors.shape[1]
+
+    def top(self, gene, top_num = None):
+        '''
+        top genes most similar to a gene, read from the index
+        :param gene: [str] gene name
+        :param top_num: [int] number of genes, default: None, all top_k genes
+        :return: scores [pd.Series] similarity scores indexed by gene names, sorted decreasingly
+
+        '''
+        row = self.genes.get_loc(gene)
+        neighbors = self.neighbors[row, 0 : top_num]
+        return pd.Series(np.asarray(self.scores[row, 0 : top_num]), index = self.genes[neighbors])
+
+    def candidates(self, genes, cand_num):
+        '''
+        neighbors of genes restricted to the same genes, as positions in genes
+        :param genes: [pd.Index] genes, e.g. the candidates of a search
+        :param cand_num: [int] maximum number of neighbors kept for each gene
+        :return: cand_idxes [np.array] len(genes) x cand_num positions, -1 for missing neighbors
+
+        '''
+        positions = np.full(len(self.genes), -1)
+        positions[self.genes.get_indexer(genes)] = np.arange(len(genes))
+        cand_idxes = np.full((len(genes), cand_num), -1)
+        for idx, row in enumerate(self.genes.get_indexer(genes)):
+            neighbors = positions[self.neighbors[row]]
+            neighbors = neighbors[neighbors >= 0][0 : cand_num]
+            cand_idxes[idx, 0 : len(neighbors)] = neighbors
+        return cand_idxes
+
+def counts_fingerprint(gene_counts):
+    '''
+    fingerprint of gene counts, an index only serves the counts it was built from
+    :param gene_counts: [pd.DataFrame] gene counts
+    :return: fingerprint [str]
+
+    '''
+    sha = hashlib.sha1(np.ascontiguousarray(gene_counts.values).tobytes())
+    sha.update(repr(list(gene_counts.index)).encode())
+    return sha.hexdigest()
+
+def index_block(query_counts, gene_counts, top_k, tile_cells = TILE_CELLS):
+    '''
+    top-k most similar genes of a block of genes, scored tile by tile over all genes
+    :param query_counts: [pd.DataFrame] counts of the block of genes
+    :param gene_counts: [pd.DataFrame] counts of all genes
+    :param top_k: [int] number of neighbors
+    :param tile_cells: [int] maximum number of genes x tile x samples cells scored at once, default: TILE_CELLS
+    :return: neighbors_scores [np.array] B x 2 top_k, neighbor ids followed by their scores, sorted decreasingly
+
+    '''
+    query_counts = query_counts[0] if isinstance(query_counts, list) else query_counts
+    gene_num, ncols = gene_counts.shape
+    counts_ary = np.asarray(gene_counts, dtype = diff_dtype(gene_num))
+    query_ary  = np.asarray(query_counts, dtype = diff_dtype(gene_num))
+    lut, top_k = similarity_lut(gene_num), min(top_k, gene_num)
+    block_size = max(1, tile_cells // (TILE_GENES * ncols))
+
+    neighbors_scores = np.zeros((query_ary.shape[0], 2 * top_k))
+    for start in range(0, query_ary.shape[0], block_size):
+        best_ids, best_scores = np.zeros((0, 0), dtype = int), None
+        for tile in range(0, gene_num, TILE_GENES):
+            scores = measure_similarity_block(query_ary[start : start + block_size], counts_ary[tile : tile + TILE_GENES], lut)
+            ids = np.broadcast_to(np.arange(tile, tile + scores.shape[1]), scores.shape)
+            if best_scores is not None: # merge the tile with the running top-k
+                scores, ids = np.hstack([best_scores, scores]), np.hstack([best_ids, ids])
+            keep = np.argpartition(-scores, min(top_k, scores.shape[1]) - 1, axis = 1)[:, 0 : top_k]
+            best_scores, best_ids = np.take_along_axis(scores, keep, axis = 1), np.take_along_axis(ids, keep, axis = 1)
+
+        order = np.argsort(-best_scores, axis = 1, kind = 'stable')
+        neighbors_scores[start : start + block_size] = np.hstack([
+                np.take_along_axis(best_ids, order, axis = 1),
+                np.take_along_axis(best_scores, order, axis = 1)
+            ])
+    return neighbors_scores
+
+def build_index(gene_counts, index_dir, top_k, ncpus = None, backend = 'process'):
+    '''
+    build the top-k similarity graph of gene counts across all cores and persist it
+    :param gene_counts: [pd.DataFrame] gene counts returned by rank_profiles
+    :param index_dir: [str] directory of the index
+    :param top_k: [int] number of neighbors of each gene
+    :param ncpus: [int] number of workers, default: None, all cpus
+    :param backend: [str] 'process' or 'thread' worker pool, default: process
+    :return: index [SimilarityIndex]
+
+    '''
+    ncpus = ncpus if ncpus else __import__('multiprocessing').cpu_count()
+    neighbors_scores = multi_process(gene_counts, index_block, ncpus, True, backend = backend, gene_counts = gene_counts, top_k = top_k).values
+    top_k = neighbors_scores.shape[1] // 2
+
+    if not os.path.isdir(index_dir): os.makedirs(index_dir)
+    meta_fil = os.path.join(index_dir, 'meta.pkl')
+    if os.path.exists(meta_fil): os.remove(meta_fil) # written last, an interrupted build leaves no index next to the old fingerprint
+    np.save(os.path.join(index_dir, 'neighbors.npy'), neighbors_scores[:, 0 : top_k].astype(np.int32))
+    np.save(os.path.join(index_dir, 'scores.npy'), neighbors_scores[:, top_k : ].astype(np.float32))
+    with open(meta_fil, 'wb') as fp:
+        pickle.dump((gene_counts.index, counts_fingerprint(gene_counts)), fp, protocol = pickle.HIGHEST_PROTOCOL)
+    return SimilarityIndex(index_dir)
+
+def load_index(gene_counts, index_dir, top_k, ncpus = None, backend = 'process'):
+    '''
+    load the index of gene counts, it is (re)built when missing, unreadable, built from other counts or holding less than top_k neighbors
+    :param gene_counts: [pd.DataFrame] gene counts returned by rank_profiles
+    :param index_dir: [str] directory of the index
+    :param top_k: [int] number of neighbors of each gene
+    :param ncpus: [int] number of workers, default: None, all cpus
+    :param backend: [str] 'process' or 'thread' worker pool, default: process
+    :return: index [SimilarityIndex], built [bool]
+
+    '''
+    if os.path.exists(os.path.join(index_dir, 'meta.pkl')):
+        try:
+            index = SimilarityIndex(index_dir)
+        except (EOFError, ValueError, OSError, pickle.UnpicklingError):
+            index = None
+        if index is not None and index.fingerprint == counts_fingerprint(gene_counts) and index.top_k >= min(top_k, gene_counts.shape[0]):
+            return index, False
+    return build_index(gene_counts, index_dir, top_k, ncpus, backend), True
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#title       : meta.py
+#description : Concurrent search across datasets and consensus ranking of their results.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : module
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load own and python modules
+
+import concurrent.futures
+from modules.utils        import *
+from modules.estimate_FDR import multipletests
+
+#-----------------------------------------------------
+# Peak memory of a search relative to the size of its profile file
+
+MEMORY_FACTOR = 4
+
+#-----------------------------------------------------
+
+def profile_cost(profile_fil):
+    '''
+    estimated peak memory of searching a profile, used to schedule datasets under a memory budget
+    :param profile_fil: [str] profile file
+    :return: nbytes [int]
+
+    '''
+    return int(os.path.getsize(profile_fil) * MEMORY_FACTOR)
+
+def schedule(jobs, func, workers, memory_budget = None, LOGS = None, verbose = True):
+    '''
+    run jobs across a process pool, the largest first so small ones fill the other workers instead of waiting behind it,
+    a job only starts while the estimated memory of running jobs stays within the budget
+    :param jobs: [list] (name, cost, args) of each job, func(*args) is run for each
+    :param func: [callable] picklable function
+    :param workers: [int] maximum number of concurrent jobs
+    :param memory_budget: [int] maximum estimated bytes of running jobs, default: None, unbounded
+    :param LOGS: [obj] Log object, default: None
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True
+    :return: results [OrderedDict] result of each job in the order of jobs, None for failed jobs
+
+    '''
+    pending = sorted(jobs, key = lambda job: job[1], reverse = True)
+    running, results = {}, dict((job[0], None) for job in jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers = max(1, workers)) as executor:
+        while pending or running:
+            while pending and len(running) < workers:
+                used = sum(cost for name, cost in running.values())
+                fits = [ job for job in pending if not running or memory_budget is None or used + job[1] <= memory_budget ]
+                if not fits: break
+                pending.remove(fits[0])
+                running[executor.submit(func, *fits[0][2])] = fits[0][0 : 2]
+            done = concurrent.futures.wait(list(running), return_when = concurrent.futures.FIRST_COMPLETED)[0]
+            for future in done:
+                name = running.pop(future)[0]
+                try:
+                    results[name] = future.result()
+                except Exception as err:
+                    if LOGS: show_msg('>> Dataset {0} failed: {1!r}'.format(name, err), LOGS.warn, verbose)
+    return __import__('collections').OrderedDict((job[0], results[job[0]]) for job in jobs)
+
+def consensus_ranking(search_sets):
+    '''
+    combine the results of datasets, P-values by Fisher's method and similarity scores by their mean,
+    a gene missing from the candidates of a dataset, or left unevaluated there, counts as P-value 1
+    :param search_sets: [OrderedDict] search results of each dataset
+    :return: consensus [pd.DataFrame] sorted by combined FDR
+
+    '''
+    pvals = pd.DataFrame(dict((name, search_res['Pvalue']) for name, search_res in search_sets.items()), columns = list(search_sets))
+    sims  = pd.DataFrame(dict((name, search_res['Similarity']) for name, search_res in search_sets.items()), columns = list(search_sets))
+    fisher = -2 * np.log(pvals.fillna(1).clip(lower = np.finfo(float).tiny)).sum(axis = 1)
+    combined = __import__('scipy.stats').stats.chi2.sf(fisher.values, 2 * pvals.shape[1])
+
+    consensus = pd.DataFrame({
+            'Similarity' : sims.mean(axis = 1),
+            'Pvalue'     : combined,
+            'FDR'        : multipletests(combined),
+            'nDatasets'  : sims.notna().sum(axis = 1)
+        }, index = pvals.index, columns = ['Similarity', 'Pvalue', 'FDR', 'nDatasets'])
+    consensus = consensus.join(pvals.add_prefix('Pvalue.')).sort_values(
+            by = ['FDR', 'Pvalue', 'nDatasets', 'Similarity'],
+            ascending = [True, True, False, False]
+        )
+    consensus.index.name = 'GeneSymbol'
+    return consensus
@@ -9,34 +9,252 @@
 # load own and python module
 
 from modules.utils import *
-from sklearn.decomposition import PCA
+from time import time
 
 #-----------------------------------------------------
+# Variance kept by svd_filter, first components tried by the randomized engine and genes per batch of the incremental engine
 
-def svd_filter(profiles_sub, renorm = ['row-norm', 'zscore']):
+PCA_VARIANCE, RANDOM_COMPONENTS, PCA_BATCH = 0.99, 32, 1024
+SPARSE_COMPONENTS = 1024 # components grown by the sparse engine at most, cells of single-cell data rarely need more
+RENORM_ROWS = 4096       # rows renormalized at once in place
+SCORE_CELLS = 2 ** 23    # upper bound of queries x genes x samples cells scored at once
+WARM_ITERS, WARM_TOL = 4, 1e-3 # subspace iterations of a warm start at most, and the gain of captured variance it settles under
+
+#-----------------------------------------------------
+
+def variance_cutoff(ratio_cumsum, variance = PCA_VARIANCE):
+    '''
+    Number of components explaining more than the variance, as PCA(n_components = variance) selects them.
+    :param ratio_cumsum: [np.array] Cumulative explained variance ratio of the components.
+    :param variance: [float] Variance to be explained, default: PCA_VARIANCE.
+    :return: ncomps [int]
+    
+    '''
+    return min(int(np.searchsorted(ratio_cumsum, variance, side = 'right')) + 1, len(ratio_cumsum))
+
+def randomized_pca(values, n_components = None, time_budget = None, variance = PCA_VARIANCE):
+    '''
+    PCA by randomized SVD, the number of components is doubled until the variance is explained or the time budget is used up.
+    :param values: [np.array] N genes x K samples.
+    :param n_components: [int] Number of components, default: None, estimated from the variance.
+    :param time_budget: [float] Seconds spent on growing the number of components, default: None, unlimited.
+    :param variance: [float] Variance to be explained, default: PCA_VARIANCE.
+    :return: scores [np.array] N genes x components, captured [float] explained variance ratio
+    
+    '''
+    values = values - values.mean(axis = 0)
+    total_var, max_comps = np.einsum('ij,ij->', values, values), min(values.shape)
+    ncomps, start = min(n_components or RANDOM_COMPONENTS, max_comps), time()
+    while True:
+        if ncomps * 2 > max_comps: # randomized SVD gains nothing close to the full rank
+            U, S, Vt = np.linalg.svd(values, full_matrices = False)
+            ncomps = ncomps if n_components else max_comps
+            U, S = U[:, 0 : ncomps], S[0 : ncomps]
+        else:
+            U, S, Vt = __import__('sklearn.utils.extmath', fromlist = ['randomized_svd']).randomized_svd(values, ncomps, random_state = 0)
+        ratio_cumsum = np.cumsum(S ** 2) / total_var
+        if n_components or ratio_cumsum[-1] > variance or ncomps >= max_comps: break
+        if time_budget and time() - start > time_budget: break
+        ncomps = min(ncomps * 2, max_comps)
+    
+    ncomps = ncomps if n_components else variance_cutoff(ratio_cumsum, variance)
+    return U[:, 0 : ncomps] * S[0 : ncomps], ratio_cumsum[ncomps - 1]
+
+def incremental_pca(values, n_components = None, time_budget = None, batch_size = PCA_BATCH, variance = PCA_VARIANCE):
+    '''
+    PCA fitted and applied in fixed-size batches of genes, fitting stops early once the time budget is used up.
+    :param values: [np.array] N genes x K samples, may be backed by a memory-mapped file.
+    :param n_components: [int] Number of components, default: None, estimated from the variance.
+    :param time_budget: [float] Seconds spent on fitting, default: None, unlimited.
+    :param batch_size: [int] Genes per batch, default: PCA_BATCH.
+    :param variance: [float] Variance to be explained, default: PCA_VARIANCE.
+    :return: scores [np.array] N genes x components, captured [float] explained variance ratio
+    
+    '''
+    ncomps = min(n_components or batch_size, values.shape[1], values.shape[0])
+    batch_size = max(batch_size, ncomps)
+    bounds = list(range(0, values.shape[0], batch_size))
+    if len(bounds) > 1 and values.shape[0] - bounds[-1] < ncomps: bounds.pop() # the last batch must hold ncomps genes
+    bounds.append(values.shape[0])
+    
+    pca_model, start = __import__('sklearn.decomposition', fromlist = ['IncrementalPCA']).IncrementalPCA(n_components = ncomps), time()
+    for begin, end in zip(bounds[:-1], bounds[1:]):
+        pca_model.partial_fit(values[begin : end])
+        if time_budget and time() - start > time_budget: break
+    
+    ratio_cumsum = np.cumsum(pca_model.explained_variance_ratio_)
+    ncomps = ncomps if n_components else variance_cutoff(ratio_cumsum, variance)
+    scores = np.vstack([ pca_model.transform(values[begin : end])[:, 0 : ncomps] for begin, end in zip(bounds[:-1], bounds[1:]) ])
+    return scores, ratio_cumsum[ncomps - 1]
+
+def warm_pca(values, basis, n_components = None, iters = WARM_ITERS, oversample = 10, variance = PCA_VARIANCE, tol = WARM_TOL):
+    '''
+    PCA by subspace iteration started from the gene scores of an earlier fit, iterated until the captured variance settles,
+    which takes a few iterations when the profile changed a little.
+    :param values: [np.array] N genes x K samples.
+    :param basis: [np.array] N genes x components, scores of the earlier fit aligned on the same genes.
+    :param n_components: [int] Number of components, default: None, estimated from the variance.
+    :param iters: [int] Maximum number of subspace iterations, default: WARM_ITERS.
+    :param oversample: [int] Random directions added to the basis, default: 10.
+    :param variance: [float] Variance to be explained, default: PCA_VARIANCE.
+    :param tol: [float] Relative gain of the captured variance under which an iteration is the last, default: WARM_TOL.
+    :return: scores [np.array] N genes x components or None if the subspace has not settled within iters or explains less than the variance, 
+        captured [float] explained variance ratio
+    
+    '''
+    values = values - values.mean(axis = 0)
+    total_var, max_comps = np.einsum('ij,ij->', values, values), min(values.shape)
+    width = min((n_components or basis.shape[1]) + oversample, max_comps)
+    start = np.hstack([basis[:, 0 : width], np.random.RandomState(0).normal(size = (values.shape[0], max(0, width - basis.shape[1])))])
+    Q, captured, gain = np.linalg.qr(start)[0], 0, np.inf
+    for idx in range(iters + 1):
+        proj = Q.T.dot(values)
+        Ub, S, Vt = np.linalg.svd(proj, full_matrices = False)
+        ratio_cumsum = np.cumsum(S ** 2) / total_var
+        tracked = ratio_cumsum[min(n_components, len(S)) - 1] if n_components else ratio_cumsum[-1]
+        gain, captured = tracked / captured - 1 if captured else np.inf, tracked
+        if gain < tol or idx == iters: break
+        Q = np.linalg.qr(values.dot(proj.T))[0]
+    if gain >= tol: return None, captured
+    if not n_components and ratio_cumsum[-1] <= variance and width < max_comps: return None, ratio_cumsum[-1]
+    
+    ncomps = min(n_components, len(S)) if n_components else variance_cutoff(ratio_cumsum, variance)
+    return Q.dot(Ub[:, 0 : ncomps]) * S[0 : ncomps], ratio_cumsum[ncomps - 1]
+
+def renorm_inplace(values, renorm = 'zscore'):
+    '''
+    renormalize rows block by block into the values themselves, no full-size temporary is created
+    :param values: [np.array] writeable N genes x K samples
+    :param renorm: [str] 'row-norm' or 'zscore'
+    :return: values [np.array]
+
+    '''
+    for start in range(0, values.shape[0], RENORM_ROWS):
+        block = values[start : start + RENORM_ROWS]
+        if renorm == 'row-norm':
+            block /= block.sum(axis = 1, keepdims = True)
+        else:
+            block -= block.mean(axis = 1, keepdims = True)
+            block /= block.std(axis = 1, ddof = 1, keepdims = True)
+    return values
+
+def svd_filter(profiles_sub, renorm = ['row-norm', 'zscore'], engine = 'full', n_components = None, time_budget = None, basis = None, LOGS = None, verbose = True, values = None):
     '''
     SVD decomposition and return reduction profile.
     :param profiles_sub: [pd.DataFrame] Gene expression profile, N genes x K samples.
     :param renorm: [str] Renormalized the gene expression profile using 'row-norm' or 'zscore' method, default: row-norm, 
-    :param return: profiles_svd [pd.DataFrame]
+    :param engine: [str] 'full' PCA, 'randomized' SVD or 'incremental' PCA in batches of genes, default: full.
+    :param n_components: [int] Number of components, default: None, components explaining PCA_VARIANCE.
+    :param time_budget: [float] Seconds spent by the randomized or incremental engine, default: None, unlimited.
+    :param basis: [np.array] Gene scores of an earlier fit to warm start from, the engine is used if they do not settle or no longer explain the variance, default: None.
+    :param LOGS: [obj] Log object to report the captured variance, default: None.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param values: [np.array] Writable values of profiles_sub owned by the caller, renormalized in place and reused by PCA, default: None.
+    :param return: profiles_svd [pd.DataFrame], reduced in double precision whatever the dtype of profiles_sub
  
     '''
     if isinstance(renorm, list): renorm = 'row-norm'
-    if renorm == 'row-norm':
+    upcast = profiles_sub.shape[1] > 50 and profiles_sub.values.dtype != np.float64 # single precision components reorder the ranks of many genes
+    if upcast and values is not None:
+        values = values.astype(np.float64)
+    elif upcast:
+        profiles_sub = profiles_sub.astype(np.float64)
+    if values is not None:
+        profiles_sub = pd.DataFrame(renorm_inplace(values, renorm), index = profiles_sub.index, copy = False)
+    elif renorm == 'row-norm':
         profiles_sub = profiles_sub.divide(profiles_sub.sum(axis = 1), axis = 0)
     else:
         avg_exp, std_exp = profiles_sub.mean(axis = 1), profiles_sub.std(axis = 1)
         profiles_sub  = profiles_sub.sub(avg_exp, axis = 0).divide(std_exp, axis = 0)
     
     if profiles_sub.shape[1] > 50:
-        pca_model = PCA(n_components = 0.99)
-        pca_model.fit(profiles_sub)
-        profiles_svd = pca_model.transform(profiles_sub)
+        profiles_svd, captured = warm_pca(profiles_sub.values, basis, n_components) if basis is not None else (None, None)
+        if profiles_svd is None and engine == 'randomized':
+            profiles_svd, captured = randomized_pca(profiles_sub.values, n_components, time_budget)
+        elif profiles_svd is None and engine == 'incremental':
+            profiles_svd, captured = incremental_pca(profiles_sub.values, n_components, time_budget)
+        elif profiles_svd is None:
+            pca_model = __import__('sklearn.decomposition', fromlist = ['PCA']).PCA(n_components = n_components or PCA_VARIANCE, copy = values is None, random_state = 0)
+            if values is not None: # fit centers the values themselves, which transform would center again
+                profiles_svd = pca_model.fit_transform(profiles_sub.values)
+            else:
+                pca_model.fit(profiles_sub)
+                profiles_svd = pca_model.transform(profiles_sub)
+            captured = np.sum(pca_model.explained_variance_ratio_)
         profiles_svd = pd.DataFrame(profiles_svd, index = profiles_sub.index)
+        if LOGS: show_msg('>> {0} components capture {1:.2%} of the variance'.format(profiles_svd.shape[1], captured), LOGS.info, verbose)
     else:
         profiles_svd = profiles_sub
     return profiles_svd
 
+def sparse_pca(values, shift, scale, n_components = None, time_budget = None, iters = 4, variance = PCA_VARIANCE):
+    '''
+    PCA of the rows of a sparse profile shifted and scaled, diag(scale) (values - shift), with columns centered as PCA does.
+    Shifting and centering are applied implicitly inside products with the sparse values, which are never densified.
+    :param values: [scipy.sparse.csr_matrix] N genes x K cells.
+    :param shift: [np.array] Value subtracted from each row.
+    :param scale: [np.array] Factor of each row after shifting.
+    :param n_components: [int] Number of components, default: None, grown until the variance is explained.
+    :param time_budget: [float] Seconds spent on growing the number of components, default: None, unlimited.
+    :param iters: [int] Number of power iterations, default: 4.
+    :param variance: [float] Variance to be explained, default: PCA_VARIANCE.
+    :return: scores [np.array] N genes x components, captured [float] explained variance ratio
+    
+    '''
+    values_t = values.T.tocsr()
+    nrows, ncols = values.shape
+    col_mean = (values_t.dot(scale) - scale.dot(shift)) / nrows
+    shift_scale = shift * scale
+    matvec  = lambda Q: scale[:, None] * values.dot(Q) - np.outer(shift_scale, Q.sum(axis = 0)) - col_mean.dot(Q)[None, :]
+    rmatvec = lambda P: values_t.dot(scale[:, None] * P) - shift_scale.dot(P)[None, :] - np.outer(col_mean, P.sum(axis = 0))
+    
+    row_sum, row_sq = np.asarray(values.sum(axis = 1)).ravel(), np.asarray(values.multiply(values).sum(axis = 1)).ravel()
+    total_var = np.sum(scale ** 2 * (row_sq - 2 * shift * row_sum + ncols * shift ** 2)) - nrows * np.sum(col_mean ** 2)
+    max_comps = min(nrows, ncols) if n_components else min(nrows, ncols, SPARSE_COMPONENTS)
+    ncomps, start, rng = min(n_components or RANDOM_COMPONENTS, max_comps), time(), np.random.RandomState(0)
+    while True:
+        width = min(ncomps + 10, min(nrows, ncols))
+        Q = np.linalg.qr(matvec(rng.normal(size = (ncols, width))))[0]
+        for idx in range(iters):
+            Q = np.linalg.qr(matvec(np.linalg.qr(rmatvec(Q))[0]))[0]
+        Ub, S, Vt = np.linalg.svd(rmatvec(Q).T, full_matrices = False)
+        ratio_cumsum = np.cumsum(S[0 : ncomps] ** 2) / total_var
+        if n_components or ratio_cumsum[-1] > variance or ncomps >= max_comps: break
+        if time_budget and time() - start > time_budget: break
+        ncomps = min(ncomps * 2, max_comps)
+    
+    ncomps = min(ncomps, len(S)) if n_components else variance_cutoff(ratio_cumsum, variance)
+    return Q.dot(Ub[:, 0 : ncomps]) * S[0 : ncomps], ratio_cumsum[ncomps - 1]
+
+def svd_filter_sparse(values, genes, renorm = ['row-norm', 'zscore'], n_components = None, time_budget = None, LOGS = None, verbose = True, **kargs):
+    '''
+    svd_filter of a sparse profile, rows are renormalized and reduced by sparse_pca without densifying.
+    :param values: [scipy.sparse.csr_matrix] Sparse gene expression profile, N genes x K cells.
+    :param genes: [pd.Index] Genes of rows.
+    :param renorm: [str] Renormalized the gene expression profile using 'row-norm' or 'zscore' method, default: row-norm.
+    :param n_components: [int] Number of components, default: None, components explaining PCA_VARIANCE.
+    :param time_budget: [float] Seconds spent on growing the number of components, default: None, unlimited.
+    :param LOGS: [obj] Log object to report the captured variance, default: None.
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True.
+    :param kargs: [dict] Other svd_filter parameters, the sparse engine is always used.
+    :return: profiles_svd [pd.DataFrame]
+    
+    '''
+    if isinstance(renorm, list): renorm = 'row-norm'
+    ncols = values.shape[1]
+    row_sum = np.asarray(values.sum(axis = 1)).ravel()
+    if renorm == 'row-norm':
+        shift, spread = np.zeros(len(row_sum)), row_sum
+    else:
+        row_sq = np.asarray(values.multiply(values).sum(axis = 1)).ravel()
+        shift  = row_sum / ncols
+        spread = np.sqrt(np.maximum(row_sq - ncols * shift ** 2, 0) / max(ncols - 1, 1))
+    scale = np.divide(1.0, spread, out = np.zeros(len(spread)), where = spread > 0) # constant genes are zeroed
+    
+    profiles_svd, captured = sparse_pca(values, shift, scale, n_components, time_budget)
+    if LOGS: show_msg('>> {0} components capture {1:.2%} of the variance'.format(profiles_svd.shape[1], captured), LOGS.info, verbose)
+    return pd.DataFrame(profiles_svd, index = genes)
+
 def measure_similarity(query_cnts, gene_counts, ngenes, axis = 1):
     '''
     Measure similarity between target genes and query gene based on the empirical frequency.
@@ -46,11 +264,41 @@ def measure_similarity(query_cnts, gene_counts, ngenes, axis = 1):
     :return: sim_scores [np.array] 
     
     '''
-    diff_cnts = np.abs(np.subtract(np.array(gene_counts), np.array(query_cnts)))
+    gene_counts, query_cnts = np.asarray(gene_counts), np.asarray(query_cnts)
+    if np.issubdtype(gene_counts.dtype, np.integer) and np.issubdtype(query_cnts.dtype, np.integer): # unsigned counts, same scores through the lookup table
+        diff_cnts = np.maximum(gene_counts, query_cnts) - np.minimum(gene_counts, query_cnts)
+        return np.take(similarity_lut(ngenes), diff_cnts).sum(axis = axis)
+    
+    diff_cnts = np.abs(np.subtract(gene_counts, query_cnts))
     probs = (diff_cnts + 1) / (ngenes + 1)
     sim_scores = -np.sum(np.log10(probs), axis = axis)
     return sim_scores
 
+def similarity_lut(ngenes):
+    '''
+    Lookup table of the per-sample similarity contribution, indexed by the absolute rank difference.
+    :param ngenes: [int] Number of genes, rank differences are integers in [0, ngenes].
+    :return: lut [np.array] -log10((diff + 1) / (ngenes + 1)) for each diff in [0, ngenes].
+    
+    '''
+    diff_cnts = np.arange(ngenes + 1, dtype = float)
+    probs = (diff_cnts + 1) / (ngenes + 1)
+    lut = -np.log10(probs)
+    return lut
+
+def measure_similarity_block(query_block, gene_counts, lut):
+    '''
+    Measure similarity between a block of query genes and all genes through the lookup table, same scores as measure_similarity.
+    :param query_block: [np.array] Integer counts of B query genes, B x K.
+    :param gene_counts: [np.array] Integer counts of N genes, N x K.
+    :param lut: [np.array] Lookup table returned by similarity_lut.
+    :return: sim_scores [np.array] B x N
+    
+    '''
+    diff_cnts  = np.abs(gene_counts[np.newaxis, :, :] - query_block[:, np.newaxis, :])
+    sim_scores = np.take(lut, diff_cnts).sum(axis = 2)
+    return sim_scores
+
 def max_score(ngenes, nsamples):
     '''
     The maximun score fo similarity.
@@ -63,6 +311,37 @@ def max_score(ngenes, nsamples):
     max_score = -np.sum(np.log10(probs)) / nsamples
     return max_score
 
+def score_block(query_cnts, gene_counts, ngenes, max_cells = SCORE_CELLS):
+    '''
+    Similarity scores of many query genes against genes, scored in blocks of queries bounded by max_cells, same scores as measure_similarity.
+    :param query_cnts: [np.array] Integer counts of Q query genes, Q x K.
+    :param gene_counts: [np.array] Integer counts of N genes, N x K.
+    :param ngenes: [int] Number of genes.
+    :param max_cells: [int] Upper bound of queries x genes x samples cells scored at once, default: SCORE_CELLS.
+    :return: sim_scores [np.array] Q x N
+
+    '''
+    dtype = diff_dtype(ngenes)
+    query_cnts, gene_counts = np.asarray(query_cnts, dtype = dtype), np.asarray(gene_counts, dtype = dtype)
+    lut, block = similarity_lut(ngenes), max(1, max_cells // max(1, gene_counts.size))
+    sim_scores = np.empty((query_cnts.shape[0], gene_counts.shape[0]))
+    for start in range(0, query_cnts.shape[0], block):
+        sim_scores[start : start + block] = measure_similarity_block(query_cnts[start : start + block], gene_counts, lut)
+    return sim_scores
+
+def query_similarity(gene_counts, query_genes, ngenes):
+    '''
+    Pairwise similarity of query genes, each pair scored once, scaled to [0, 1].
+    :param gene_counts: [pd.DataFrame] Gene count data.
+    :param query_genes: [list] A list of query genes.
+    :param ngenes: [int] Number of genes.
+    :return: sim_matrix [np.array] Q x Q
+
+    '''
+    query_cnts = gene_counts.loc[query_genes].values
+    sim_matrix = score_block(query_cnts, query_cnts, ngenes) / gene_counts.shape[1]
+    return sim_matrix / max_score(gene_counts.shape[0], gene_counts.shape[1])
+
 def chk_queries_quality(gene_counts, query_genes, ngenes, LOGS, cutoff = 0.8, verbose = True):
     '''
     Ensure query genes have high similarity scores or not.
@@ -75,22 +354,30 @@ def chk_queries_quality(gene_counts, query_genes, ngenes, LOGS, cutoff = 0.8, ve
     :return: query_genes_remained [list]
 
     '''
-    num_queries = len(query_genes)
-    sim_matrix  = np.zeros((num_queries, num_queries))
-    for idx in range(num_queries):
-        for jdx in range(num_queries):
-            sim_matrix[idx, :] = measure_similarity(
-                gene_counts.loc[query_genes], 
-                gene_counts.loc[query_genes[idx]], 
-                ngenes, 
-                axis = 1
-            ) / gene_counts.shape[1]
-    
-    sim_matrix = sim_matrix / max_score(gene_counts.shape[0], gene_counts.shape[1])
-    sim_avg = np.mean(sim_matrix, axis = 1)
+    sim_avg = np.mean(query_similarity(gene_counts, query_genes, ngenes), axis = 1)
     query_genes_remained = np.array(query_genes)[np.where(sim_avg > cutoff)]
-    if (not query_genes_remained):
+    if not len(query_genes_remained):
         show_msg('>> The query genes failed the quality evaluation, and the average similarity was less than {}'.format(cutoff), LOGS.error, verbose)
     else:
         show_msg('>> {} genes passed the quality evaluation.'.format(', '.join(query_genes_remained.tolist())), LOGS.info, verbose)
     return query_genes_remained
+
+def query_modules(gene_counts, query_genes, ngenes, cutoff = 0.6, min_size = 3):
+    '''
+    Split query genes into coherent modules, average linkage clusters whose genes are on average more similar than cutoff.
+    :param gene_counts: [pd.DataFrame] Gene count data.
+    :param query_genes: [list] A list of query genes.
+    :param ngenes: [int] Number of genes.
+    :param cutoff: [float] Similarity within a module, default: 0.6.
+    :param min_size: [int] Smaller modules are dropped, default: 3.
+    :return: modules [list] query genes of each module, the largest first
+
+    '''
+    if len(query_genes) < 2: return [ list(query_genes) ] if len(query_genes) >= min_size else []
+    hierarchy  = __import__('scipy.cluster.hierarchy', fromlist = ['linkage'])
+    sim_matrix = query_similarity(gene_counts, query_genes, ngenes)
+    distance   = np.clip(1 - (sim_matrix + sim_matrix.T) / 2, 0, None)
+    np.fill_diagonal(distance, 0)
+    labels  = hierarchy.fcluster(hierarchy.linkage(__import__('scipy.spatial').spatial.distance.squareform(distance, checks = False), 'average'), 1 - cutoff, 'distance')
+    modules = [ [ gene for gene, label in zip(query_genes, labels) if label == cluster ] for cluster in np.unique(labels) ]
+    return sorted([ module for module in modules if len(module) >= min_size ], key = len, reverse = True)
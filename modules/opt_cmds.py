@@ -33,6 +33,29 @@ def opts():
             metavar = 'QUERY'
         )
     
+    parser.add_argument(
+            '--manifest',
+            '-m',
+            help = 'Batch mode, a file of named query sets, one set per line: name TAB genes separated by commas.',
+            type = str,
+            metavar = 'MANIFEST',
+            default = None
+        )
+
+    parser.add_argument(
+            '--query-modules',
+            help = 'Split the query genes, or every query set, into coherent modules of at least SIZE genes, all searched in one batch as PREFIX-moduleN.',
+            type = int,
+            metavar = 'SIZE',
+            default = None
+        )
+
+    parser.add_argument(
+            '--combined',
+            help = 'Batch mode, write one long-format table of all query sets instead of one table per set.',
+            action = 'store_true'
+        )
+
     parser.add_argument(
             '--prefix',
             help = 'Prefix name of preprocessed results. DEFAULT: MSearcher-Results.',
@@ -50,6 +73,230 @@ def opts():
             default = './'
         )
 
+    parser.add_argument(
+            '--fdr',
+            help = 'Evaluate candidates in similarity order, batch by batch, and stop after two batches without any P-value under this FDR. A heuristic: skipped candidates may still pass, they are marked Evaluated False. DEFAULT: evaluate all candidates.',
+            type = float,
+            metavar = 'FDR',
+            default = None
+        )
+
+    parser.add_argument(
+            '--approx',
+            help = 'Fraction of leading components scored to find candidates of top genes, of the first query gene and of decoys, which are re-ranked by exact scores. Lower is faster with lower recall, which is reported for both steps. DEFAULT: 1, exact.',
+            type = float,
+            metavar = 'FRACTION',
+            default = 1.0
+        )
+
+    parser.add_argument(
+            '--index',
+            help = 'Directory of the top-k similarity index of the preprocessed profile, built when missing or stale. Candidates of query genes are read from it.',
+            type = str,
+            metavar = 'INDEX',
+            default = None
+        )
+
+    parser.add_argument(
+            '--index-k',
+            help = 'Number of neighbors of each gene kept in the similarity index. DEFAULT: 2000.',
+            type = int,
+            metavar = 'TOPK',
+            default = 2000
+        )
+
+    parser.add_argument(
+            '--index-decoys',
+            help = 'Also read candidates of decoy top genes from the similarity index, re-ranked by exact scores. The recall is reported.',
+            action = 'store_true'
+        )
+
+    parser.add_argument(
+            '--nthreads',
+            '-t',
+            help = 'Number of workers used to estimate FDR, and of threads sorting and ranking blocks of columns in preprocessing. DEFAULT: all available cpus.',
+            type = int,
+            metavar = 'NTHREADS',
+            default = None
+        )
+
+    parser.add_argument(
+            '--backend',
+            help = 'Worker pool used to estimate FDR, process or thread, or a work queue shared with workers on other hosts, ' +
+                   'dir:PATH on a shared filesystem or tcp:[HOST:]PORT served by this run, on localhost without HOST. ' +
+                   'A TCP queue beyond localhost requires the MSEARCHER_AUTHKEY key. DEFAULT: process.',
+            type = str,
+            metavar = 'BACKEND',
+            default = 'process'
+        )
+
+    parser.add_argument(
+            '--worker',
+            help = 'Run as a worker of a work queue, dir:PATH or tcp:[HOST:]PORT with the MSEARCHER_AUTHKEY key, chunks of decoy scoring are taken until interrupted.',
+            type = str,
+            metavar = 'QUEUE',
+            default = None
+        )
+
+    parser.add_argument(
+            '--precision',
+            help = 'Float precision of expression values, single halves the memory of reading and normalization, PCA always runs in double. DEFAULT: double.',
+            choices = ['double', 'single'],
+            default = 'double'
+        )
+
+    parser.add_argument(
+            '--out-of-core',
+            help = 'Stream the profile column by column from memory-mapped files under TMPDIR, for profiles larger than RAM.',
+            action = 'store_true'
+        )
+
+    parser.add_argument(
+            '--max-memory',
+            help = 'Memory budget in GB, intermediates are transformed in place, and profiles not fitting the budget are processed out of core. DEFAULT: unlimited.',
+            type = float,
+            metavar = 'SIZE',
+            default = None
+        )
+
+    parser.add_argument(
+            '--cell-labels',
+            help = 'Cell labels of a single-cell profile, one per line: cell TAB label. Cells of a label are summed into a pseudo-bulk sample in one streaming pass.',
+            type = str,
+            metavar = 'LABELS',
+            default = None
+        )
+
+    parser.add_argument(
+            '--svd-engine',
+            help = 'Reduction engine for profiles with more than 50 samples, full PCA, randomized SVD or incremental PCA. DEFAULT: full.',
+            choices = ['full', 'randomized', 'incremental'],
+            default = 'full'
+        )
+
+    parser.add_argument(
+            '--svd-components',
+            help = 'Number of components kept by the reduction engine. DEFAULT: components explaining 99%% of the variance.',
+            type = int,
+            metavar = 'NCOMPS',
+            default = None
+        )
+
+    parser.add_argument(
+            '--svd-time',
+            help = 'Time budget in seconds of the randomized or incremental engine. DEFAULT: unlimited.',
+            type = float,
+            metavar = 'SECONDS',
+            default = None
+        )
+
+    parser.add_argument(
+            '--checkpoint',
+            help = 'Directory keeping the preprocessed profile, similarity scores and finished decoy blocks, a restarted run with the same inputs resumes from it.',
+            type = str,
+            metavar = 'CHECKPOINT',
+            default = None
+        )
+
+    parser.add_argument(
+            '--cache-dir',
+            help = 'Directory used to cache preprocessed profiles, keyed by the content of the profile. Query genes below the expression cutoff bypass it. DEFAULT: no cache.',
+            type = str,
+            metavar = 'CACHE',
+            default = None
+        )
+
+    parser.add_argument(
+            '--cache-size',
+            help = 'Maximum size of the cache in GB, least recently used profiles are evicted. DEFAULT: 10.',
+            type = float,
+            metavar = 'SIZE',
+            default = 10
+        )
+
+    parser.add_argument(
+            '--clear-cache',
+            help = 'Invalidate all cached profiles before running.',
+            action = 'store_true'
+        )
+
+    parser.add_argument(
+            '--state',
+            help = 'Directory of the incremental preprocessing state of the profile, built from --profile when missing. Gene counts are reused from it, query genes below the expression cutoff are preprocessed again.',
+            type = str,
+            metavar = 'STATE',
+            default = None
+        )
+
+    parser.add_argument(
+            '--append',
+            help = 'Profile of new samples of the same genes appended to --state, only the new samples are read and ranked.',
+            type = str,
+            metavar = 'PROFILE',
+            default = None
+        )
+
+    parser.add_argument(
+            '--datasets',
+            help = 'Meta-search mode, profiles searched concurrently with the query genes, one per line: name TAB profile file. A consensus ranking is written to PREFIX.xls.',
+            type = str,
+            metavar = 'DATASETS',
+            default = None
+        )
+
+    parser.add_argument(
+            '--meta-jobs',
+            help = 'Meta-search mode, number of datasets searched at once, sharing --nthreads cpus. DEFAULT: one per cpu.',
+            type = int,
+            metavar = 'JOBS',
+            default = None
+        )
+
+    parser.add_argument(
+            '--meta-memory',
+            help = 'Meta-search mode, memory budget in GB of datasets searched at once, estimated from their file sizes. DEFAULT: unlimited.',
+            type = float,
+            metavar = 'SIZE',
+            default = None
+        )
+
+    parser.add_argument(
+            '--serve',
+            help = 'Run as a query server on HOST:PORT or unix:PATH, answering JSON requests on POST /search.',
+            type = str,
+            metavar = 'ADDRESS',
+            default = None
+        )
+
+    parser.add_argument(
+            '--atlases',
+            help = 'Server mode, profiles served by name, one per line: name TAB profile file. --profile is served too.',
+            type = str,
+            metavar = 'ATLASES',
+            default = None
+        )
+
+    parser.add_argument(
+            '--memory-cap',
+            help = 'Server mode, maximum size in GB of preprocessed profiles kept in memory, least recently used ones are evicted. DEFAULT: 8.',
+            type = float,
+            metavar = 'SIZE',
+            default = 8
+        )
+
+    parser.add_argument(
+            '--report',
+            help = 'Write wall time, cpu time and peak memory of each stage and worker chunk to PREFIX.report.json.',
+            action = 'store_true'
+        )
+
+    parser.add_argument(
+            '--profiler',
+            help = 'Profile the run with cProfile, stats written to PREFIX.prof, or trace Python allocations with tracemalloc. DEFAULT: none.',
+            choices = ['cprofile', 'tracemalloc'],
+            default = None
+        )
+
     parser.add_argument(
             '--verbose',
             '-v',
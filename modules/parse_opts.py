@@ -13,28 +13,357 @@ from modules.utils    import *
 from modules.opt_cmds import opts
 
 #--------------------------------------------------------
+# Magic bytes of supported binary profile formats, and rows per chunk of text profiles
 
-def read_profiles(profile_fil):
+MAGIC_BYTES = [
+        (b'PAR1', 'parquet'),
+        (b'ARROW1', 'feather'),
+        (b'FEA1', 'feather'),
+        (b'\x93NUMPY', 'npy'),
+        (b'\x89HDF\r\n\x1a\n', 'hdf5'),
+        (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'excel'),
+        (b'PK\x03\x04', 'zip'),
+        (b'%%MatrixMarket', 'mtx'),
+        (b'\x1f\x8b', 'gzip')
+    ]
+CHUNK_ROWS = 2 ** 14
+
+#--------------------------------------------------------
+
+def profile_format(profile_fil):
+    '''
+    Detect the format of a profile by its magic bytes.
+    :param profile_fil: [str/file] Gene expression profile.
+    :return fmt [str] parquet, feather, npy, npz, hdf5, excel or text.
+    
+    '''
+    with open(profile_fil, 'rb') as fp:
+        head = fp.read(16)
+    fmt = next((fmt for magic, fmt in MAGIC_BYTES if head.startswith(magic)), 'text')
+    if fmt == 'zip': # npz, scipy sparse npz and xlsx are all zip archives
+        with __import__('zipfile').ZipFile(profile_fil) as zp:
+            names = zp.namelist()
+        fmt = 'csr' if 'indptr.npy' in names else 'npz' if any(name.endswith('.npy') for name in names) else 'excel'
+    elif fmt == 'gzip': # gzipped Matrix Market of 10x outputs
+        with __import__('gzip').open(profile_fil, 'rb') as fp:
+            fmt = 'mtx' if fp.read(14) == b'%%MatrixMarket' else 'text'
+    return fmt
+
+def is_gzipped(fil):
+    with open(fil, 'rb') as fp: return fp.read(2) == b'\x1f\x8b'
+
+def open_text(fil, mode = 'rt'):
+    return __import__('gzip').open(fil, mode) if is_gzipped(fil) else open(fil, mode)
+
+def mtx_names(profile_fil):
+    '''
+    Gene and cell names of a Matrix Market profile, read from the features/genes and barcodes files next to it as 10x writes them.
+    :param profile_fil: [str] Matrix Market file, e.g. matrix.mtx.gz or PREFIX_matrix.mtx.
+    :return genes [np.array] or None, cells [np.array] or None
+    
+    '''
+    stem = profile_fil[0 : profile_fil.rfind('matrix.mtx')] if 'matrix.mtx' in profile_fil else os.path.splitext(profile_fil)[0] + '.'
+    def names(kinds, column):
+        for fil in [ stem + kind + ext for kind in kinds for ext in ['.tsv.gz', '.tsv'] ]:
+            if not os.path.exists(fil): continue
+            with open_text(fil) as fp:
+                rows = [ line.rstrip('\r\n').split('\t') for line in fp if line.strip() ]
+            return np.array([ row[min(column, len(row) - 1)] for row in rows ], dtype = object)
+        return None
+    return names(['features', 'genes'], 1), names(['barcodes'], 0) # gene symbols are in the second column
+
+def mtx_header(fp):
+    '''
+    Skip the header of a Matrix Market file.
+    :param fp: [file] Opened Matrix Market file.
+    :return shape [tuple] genes x cells, pattern [bool] no values stored
+    
+    '''
+    banner = fp.readline()
+    line = fp.readline()
+    while line.startswith('%'): line = fp.readline()
+    nrows, ncols = [ int(val) for val in line.split()[0 : 2] ]
+    return (nrows, ncols), 'pattern' in banner.lower()
+
+def mtx_chunks(profile_fil, chunk_rows = CHUNK_ROWS * 64):
+    '''
+    Stream the entries of a Matrix Market profile chunk by chunk.
+    :param profile_fil: [str] Matrix Market file, optionally gzipped.
+    :param chunk_rows: [int] Number of entries read at once, default: CHUNK_ROWS * 64.
+    :return rows [np.array], cols [np.array] 0-based, values [np.array] of each chunk
+    
+    '''
+    with open_text(profile_fil) as fp:
+        shape, pattern = mtx_header(fp)
+        for chunk in pd.read_csv(fp, sep = ' ', header = None, chunksize = chunk_rows, skipinitialspace = True):
+            values = np.ones(chunk.shape[0]) if pattern else chunk.values[:, 2]
+            yield chunk.values[:, 0].astype(np.int64) - 1, chunk.values[:, 1].astype(np.int64) - 1, values
+
+def read_sparse(profile_fil, fmt, dtype = np.float32):
     '''
-    Read gene expression profile, which rows genes and columns samples. Each column must be TAB or comma seperated.
+    Read a sparse profile, a 10x-style Matrix Market file or a scipy CSR npz with names in NAME.genes and NAME.samples files.
+    Duplicated genes are dropped, values stay sparse.
+    :param profile_fil: [str] Sparse profile, genes x cells.
+    :param fmt: [str] mtx or csr.
+    :param dtype: [np.dtype] Data type of expression values, default: np.float32.
+    :return values [scipy.sparse.csr_matrix], genes [pd.Index], cells [pd.Index]
+    
+    '''
+    sparse = __import__('scipy.sparse').sparse
+    if fmt == 'mtx':
+        values = __import__('scipy.io').io.mmread(profile_fil)
+        genes, cells = mtx_names(profile_fil)
+    else:
+        values = sparse.load_npz(profile_fil)
+        stem   = os.path.splitext(profile_fil)[0]
+        names  = lambda ext: np.array([ line.strip() for line in open(stem + ext) ], dtype = object) if os.path.exists(stem + ext) else None
+        genes, cells = names('.genes'), names('.samples')
+    values = sparse.csr_matrix(values, dtype = dtype)
+    genes = pd.Index(genes if genes is not None else np.arange(values.shape[0]))
+    cells = pd.Index(cells if cells is not None else np.arange(values.shape[1]))
+    if genes.has_duplicates:
+        keep = ~genes.duplicated(keep = 'first')
+        values, genes = values[np.where(keep)[0]], genes[keep]
+    return values, genes, cells
+
+def read_labels(labels_fil):
+    '''
+    Read cell labels, one per line: cell TAB label.
+    :param labels_fil: [str/file] Cell labels.
+    :return labels [pd.Series] label of each cell
+    
+    '''
+    labels = pd.read_csv(labels_fil, sep = '\t', header = None, index_col = 0, dtype = str, comment = '#').iloc[:, 0]
+    return labels[~labels.index.duplicated(keep = 'first')]
+
+def pseudo_bulk(profile_fil, labels_fil, dtype = np.float32):
+    '''
+    Sum cells sharing a label into pseudo-bulk samples, Matrix Market entries are streamed so cells are never held in memory.
+    :param profile_fil: [str] Profile, genes x cells, sparse or dense.
+    :param labels_fil: [str] Cell labels, cell TAB label, unlabeled cells are dropped.
+    :param dtype: [np.dtype] Data type of expression values, default: np.float32.
+    :return profiles [pd.DataFrame] genes x labels
+    
+    '''
+    labels, fmt = read_labels(labels_fil), profile_format(profile_fil)
+    names = pd.Index(sorted(labels.unique()))
+    if fmt == 'mtx':
+        genes, cells = mtx_names(profile_fil)
+        with open_text(profile_fil) as fp:
+            shape = mtx_header(fp)[0]
+        cells = pd.Index(cells if cells is not None else np.arange(shape[1]).astype(str))
+        cell_labels = names.get_indexer(labels.reindex(cells))
+        bulk = np.zeros(shape[0] * len(names))
+        for rows, cols, values in mtx_chunks(profile_fil):
+            lab = cell_labels[cols]
+            keep = lab >= 0
+            bulk += np.bincount(rows[keep] * len(names) + lab[keep], weights = values[keep], minlength = bulk.size)
+        profiles = pd.DataFrame(bulk.reshape(shape[0], len(names)).astype(dtype), index = genes if genes is not None else np.arange(shape[0]), columns = names)
+    elif fmt == 'csr':
+        values, genes, cells = read_sparse(profile_fil, fmt, dtype)
+        cell_labels = names.get_indexer(labels.reindex(cells.astype(str)))
+        keep = np.where(cell_labels >= 0)[0]
+        indicator = __import__('scipy.sparse').sparse.csr_matrix((np.ones(len(keep)), (keep, cell_labels[keep])), shape = (len(cells), len(names)))
+        profiles = pd.DataFrame(values.dot(indicator).toarray().astype(dtype), index = genes, columns = names)
+    else:
+        profiles = read_profiles(profile_fil, dtype)
+        profiles = profiles.T.groupby(labels.reindex(profiles.columns.astype(str)).values).sum().T.astype(dtype)
+    
+    profiles = profiles.loc[~profiles.index.duplicated(keep = 'first')] if profiles.index.has_duplicates else profiles
+    return profiles
+
+def text_header(profile_fil):
+    '''
+    Separator and columns of a TAB or comma seperated profile.
+    :param profile_fil: [str/file] Gene expression profile.
+    :return sep_sign [str], columns [pd.Index]
+    
+    '''
+    with open_text(profile_fil, 'rb') as fp:
+        header = fp.readline().decode().rstrip('\r\n')
+    sep_sign = '\t' if len(header.split('\t')) > 1 else ','
+    columns  = pd.read_csv(__import__('io').StringIO(header), sep = sep_sign, header = 0).columns
+    return sep_sign, columns
+
+def text_chunks(profile_fil, dtype = np.float32, chunk_rows = CHUNK_ROWS):
+    '''
+    Stream a TAB or comma seperated profile chunk by chunk, duplicated genes are dropped on the fly.
     :param profile_fil: [str/file] Gene expression profile, N genes x K samples
+    :param dtype: [np.dtype] Data type of expression values, default: np.float32.
+    :param chunk_rows: [int] Number of rows read at once, default: CHUNK_ROWS.
+    :return genes [pd.Index], values [np.array] of each chunk
+    
+    '''
+    sep_sign, columns = text_header(profile_fil)
+    genes_seen = set()
+    reader = pd.read_csv(
+            profile_fil, 
+            header = 0, 
+            sep = sep_sign, 
+            index_col = 0, 
+            dtype = dict([(columns[0], str)] + [ (col, dtype) for col in columns[1:] ]),
+            chunksize = chunk_rows,
+            compression = 'gzip' if is_gzipped(profile_fil) else None
+        )
+    for chunk in reader:
+        keep = ~chunk.index.duplicated(keep = 'first') & ~chunk.index.isin(genes_seen)
+        genes_seen.update(chunk.index[keep])
+        yield chunk.index[keep], chunk.values[keep]
+
+def text_values(profile_fil, dtype = np.float32, chunk_rows = CHUNK_ROWS):
+    '''
+    Read values of a TAB or comma seperated profile chunk by chunk into an array preallocated from a first pass counting lines,
+    so chunks are never held next to their concatenation, duplicated genes are dropped while streaming.
+    :param profile_fil: [str/file] Gene expression profile, N genes x K samples
+    :param dtype: [np.dtype] Data type of expression values, default: np.float32.
+    :param chunk_rows: [int] Number of rows read at once, default: CHUNK_ROWS.
+    :return values [np.array] N genes x K samples, genes [pd.Index], samples [list]
+    
+    '''
+    columns = text_header(profile_fil)[1]
+    with open_text(profile_fil, 'rb') as fp:
+        max_rows = sum(1 for line in fp) - 1
+    values = np.empty((max(max_rows, 0), len(columns) - 1), dtype = dtype)
+    
+    genes, nrows = [], 0
+    for chunk_genes, chunk_values in text_chunks(profile_fil, dtype, chunk_rows):
+        values[nrows : nrows + len(chunk_genes)] = chunk_values
+        genes.append(chunk_genes); nrows += len(chunk_genes)
+    
+    index = genes[0].append(genes[1:]) if genes else pd.Index([], name = columns[0])
+    return values[0 : nrows], index, columns[1:]
+
+def read_text(profile_fil, dtype = np.float32, chunk_rows = CHUNK_ROWS):
+    '''
+    Read a TAB or comma seperated profile chunk by chunk, duplicated genes are dropped while streaming.
+    :param profile_fil: [str/file] Gene expression profile, N genes x K samples
+    :param dtype: [np.dtype] Data type of expression values, default: np.float32.
+    :param chunk_rows: [int] Number of rows read at once, default: CHUNK_ROWS.
     :return profiles [pd.DataFrame]
     
     '''
-    try:
-        profiles = pd.read_excel(profile_fil, header = 0)
-    except:
-        with open(profile_fil, 'rb') as fp:
-            for idx, line in enumerate(fp):
-                sep_sign = '\t' if len(line.decode().split('\t')) > 1 else ','
-                break
-        profiles = pd.read_csv(profile_fil, header = 0, sep = sep_sign)
-    
-    profiles = profiles.drop_duplicates(subset = profiles.columns[0], keep = 'first')
-    profiles.index = profiles.iloc[:, 0]
-    profiles = profiles.drop(profiles.columns[0], axis = 1)
+    values, index, columns = text_values(profile_fil, dtype, chunk_rows)
+    profiles = pd.DataFrame(values, index = index, columns = columns, copy = False)
+    return profiles
+
+def read_text_memmap(profile_fil, tmp_dir, dtype = np.float32, chunk_rows = CHUNK_ROWS):
+    '''
+    Read a TAB or comma seperated profile into a column-major memory-mapped file, so profiles larger than RAM can be streamed column by column.
+    :param profile_fil: [str/file] Gene expression profile, N genes x K samples
+    :param tmp_dir: [str] Directory of the memory-mapped file.
+    :param dtype: [np.dtype] Data type of expression values, default: np.float32.
+    :param chunk_rows: [int] Number of rows read at once, default: CHUNK_ROWS.
+    :return profiles [pd.DataFrame] backed by the memory-mapped file
+    
+    '''
+    columns = text_header(profile_fil)[1]
+    with open_text(profile_fil, 'rb') as fp:
+        max_rows = sum(1 for line in fp) - 1
+    values = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, 'profiles.npy'), 
+            mode = 'w+', 
+            dtype = dtype, 
+            shape = (max(max_rows, 0), len(columns) - 1), 
+            fortran_order = True
+        )
+    
+    genes, nrows = [], 0
+    for chunk_genes, chunk_values in text_chunks(profile_fil, dtype, chunk_rows):
+        values[nrows : nrows + len(chunk_genes)] = chunk_values
+        genes.append(chunk_genes); nrows += len(chunk_genes)
+    
+    index = genes[0].append(genes[1:]) if genes else pd.Index([], name = columns[0])
+    profiles = pd.DataFrame(values[0 : nrows], index = index, columns = columns[1:], copy = False)
+    return profiles
+
+def npy_values(profile_fil, fmt, dtype = np.float32, mmap_mode = None):
+    '''
+    Read values of a NPZ profile with values, genes and samples arrays, or of a NPY matrix with names in NAME.genes and NAME.samples files if present.
+    :param profile_fil: [str] Gene expression profile.
+    :param fmt: [str] npy or npz.
+    :param dtype: [np.dtype] Data type of expression values, default: np.float32.
+    :param mmap_mode: [str] Memory-map a NPY matrix of the same dtype instead of loading it, default: None.
+    :return values [np.array] N genes x K samples, genes [list], samples [list]
+    
+    '''
+    if fmt == 'npz':
+        with np.load(profile_fil, allow_pickle = True) as npz:
+            values, genes, samples = npz['values'], npz['genes'], npz['samples']
+    else:
+        values = np.load(profile_fil, mmap_mode = mmap_mode)
+        stem   = os.path.splitext(profile_fil)[0]
+        names  = lambda ext, num: [ line.strip() for line in open(stem + ext) ] if os.path.exists(stem + ext) else np.arange(num)
+        genes, samples = names('.genes', values.shape[0]), names('.samples', values.shape[1])
+    return values.astype(dtype, copy = False), genes, samples
+
+def read_npy(profile_fil, fmt, dtype = np.float32, mmap_mode = None):
+    '''
+    Read a NPZ profile with values, genes and samples arrays, or a NPY matrix with names in NAME.genes and NAME.samples files if present.
+    :param profile_fil: [str] Gene expression profile.
+    :param fmt: [str] npy or npz.
+    :param dtype: [np.dtype] Data type of expression values, default: np.float32.
+    :param mmap_mode: [str] Memory-map a NPY matrix of the same dtype instead of loading it, default: None.
+    :return profiles [pd.DataFrame]
+    
+    '''
+    values, genes, samples = npy_values(profile_fil, fmt, dtype, mmap_mode)
+    profiles = pd.DataFrame(values, index = genes, columns = samples, copy = False)
     return profiles
 
+def read_profiles(profile_fil, dtype = np.float32, tmp_dir = None):
+    '''
+    Read gene expression profile, which rows genes and columns samples. Text profiles must be TAB or comma seperated, 
+    binary profiles can be Parquet, Feather/Arrow, NPY/NPZ, HDF5, Excel, Matrix Market or scipy CSR npz, detected by their magic bytes.
+    :param profile_fil: [str/file] Gene expression profile, N genes x K samples
+    :param dtype: [np.dtype] Data type of expression values, default: np.float32.
+    :param tmp_dir: [str] Out-of-core mode, text profiles are memory-mapped under this directory and NPY profiles in place, default: None.
+    :return profiles [pd.DataFrame]
+    
+    '''
+    fmt = profile_format(profile_fil)
+    if fmt == 'text':
+        profiles = read_text_memmap(profile_fil, tmp_dir, dtype) if tmp_dir else read_text(profile_fil, dtype)
+    elif fmt in ['npy', 'npz']:
+        profiles = read_npy(profile_fil, fmt, dtype, 'r' if tmp_dir else None)
+    elif fmt in ['mtx', 'csr']: # densified, the sparse path of MSearcher reads them with read_sparse instead
+        values, genes, cells = read_sparse(profile_fil, fmt, dtype)
+        profiles = pd.DataFrame(values.toarray(), index = genes, columns = cells, copy = False)
+    else:
+        reader = {'parquet' : pd.read_parquet, 'feather' : pd.read_feather, 'hdf5' : pd.read_hdf, 'excel' : pd.read_excel}[fmt]
+        profiles = reader(profile_fil)
+        if isinstance(profiles.index, pd.RangeIndex) and not np.issubdtype(profiles.dtypes.iloc[0], np.number): 
+            profiles.index = profiles.iloc[:, 0]
+            profiles = profiles.drop(profiles.columns[0], axis = 1)
+        profiles = profiles.astype(dtype, copy = False)
+    
+    profiles = profiles.loc[~profiles.index.duplicated(keep = 'first')] if profiles.index.has_duplicates else profiles
+    return profiles
+
+def read_values(profile_fil, dtype = np.float32):
+    '''
+    Read gene expression profile as read_profiles does, into values owned by the caller, which can be transformed in place.
+    Data frames share read-only values under copy-on-write, so text and NPY/NPZ values are kept as read, other formats are copied once.
+    :param profile_fil: [str/file] Gene expression profile, N genes x K samples
+    :param dtype: [np.dtype] Data type of expression values, default: np.float32.
+    :return values [np.array] writable N genes x K samples, genes [pd.Index], samples [pd.Index]
+    
+    '''
+    fmt = profile_format(profile_fil)
+    if fmt == 'text':
+        values, genes, samples = text_values(profile_fil, dtype)
+    elif fmt in ['npy', 'npz']:
+        values, genes, samples = npy_values(profile_fil, fmt, dtype)
+    else:
+        profiles = read_profiles(profile_fil, dtype)
+        values, genes, samples = profiles.to_numpy(dtype = dtype, copy = True), profiles.index, profiles.columns
+        del profiles
+    
+    genes, samples = pd.Index(genes), pd.Index(samples)
+    if genes.has_duplicates:
+        keep = ~genes.duplicated(keep = 'first')
+        values, genes = values[keep], genes[keep]
+    return values, genes, samples
+
 def get_query_genes(query_lst):
     '''
     Get query genes from file or strings.
@@ -46,6 +375,46 @@ def get_query_genes(query_lst):
     query_genes = [gene.strip() for gene in open(bl, 'rb')] if bl else [gene.strip() for gene in query_lst.split(',')]
     return query_genes
 
+def get_query_sets(manifest_fil):
+    '''
+    Get named query sets from a manifest file, one set per line: name TAB genes separated by commas.
+    Empty lines and lines started with # are skipped.
+    :param manifest_fil: [str/file] Manifest of query sets.
+    :return query_sets [OrderedDict] Query genes of each named query set, ValueError for a line without genes or a repeated name
+    
+    '''
+    query_sets = __import__('collections').OrderedDict()
+    with open(manifest_fil, 'r') as fp:
+        for num, line in enumerate(fp, 1):
+            if not line.strip() or line.startswith('#'): continue
+            name, genes = (line.rstrip('\r\n').split('\t', 1) + [''])[0 : 2]
+            genes = [ gene.strip() for gene in genes.split(',') if gene.strip() ]
+            if not name.strip() or not genes:
+                raise ValueError('line {0} of manifest {1} is not a name and genes separated by a tab'.format(num, manifest_fil))
+            if name.strip() in query_sets: # results of a query set are written under its name
+                raise ValueError('query set {0} is repeated at line {1} of manifest {2}'.format(name.strip(), num, manifest_fil))
+            query_sets[name.strip()] = genes
+    return query_sets
+
+def get_atlases(atlas_fil, profile_fil = None):
+    '''
+    Get named profiles of the server or meta-search modes, one per line: name TAB profile file.
+    Empty lines and lines started with # are skipped.
+    :param atlas_fil: [str/file] Atlas file, default: None.
+    :param profile_fil: [str] Profile served under its file name as well, default: None.
+    :return atlases [OrderedDict] Profile file of each atlas name
+    
+    '''
+    atlases = __import__('collections').OrderedDict()
+    if profile_fil: atlases[os.path.splitext(os.path.basename(profile_fil))[0]] = profile_fil
+    if not atlas_fil: return atlases
+    with open(atlas_fil, 'r') as fp:
+        for line in fp:
+            if not line.strip() or line.startswith('#'): continue
+            name, profile = line.rstrip('\r\n').split('\t', 1)
+            atlases[name.strip()] = profile.strip()
+    return atlases
+
 def parse_opts(LOGS):
     '''
     Parse all input parameters
@@ -54,8 +423,18 @@ def parse_opts(LOGS):
     
     '''
     ARGS = opts()
-    ARGS.profiles    = read_profiles(ARGS.profile)
-    ARGS.query_genes = get_query_genes(ARGS.query_genes)
+    ARGS.query_genes = get_query_genes(ARGS.query_genes) if ARGS.query_genes else []
+    try:
+        ARGS.query_sets = get_query_sets(ARGS.manifest) if ARGS.manifest else None
+    except ValueError as err:
+        show_msg('>> {0}, exit...'.format(err), LOGS.error)
+    ARGS.svd_params  = {'engine' : ARGS.svd_engine, 'n_components' : ARGS.svd_components, 'time_budget' : ARGS.svd_time}
+    ARGS.cache_size  = int(ARGS.cache_size * 2 ** 30)
+    ARGS.atlases     = get_atlases(ARGS.atlases, ARGS.profile) if ARGS.serve else None
+    ARGS.memory_cap  = int(ARGS.memory_cap * 2 ** 30)
+    ARGS.datasets    = get_atlases(ARGS.datasets) if ARGS.datasets else None
+    ARGS.meta_memory = int(ARGS.meta_memory * 2 ** 30) if ARGS.meta_memory else None
+    ARGS.max_memory  = int(ARGS.max_memory * 2 ** 30) if ARGS.max_memory else None
     ARGS.outfile     = os.path.join(ARGS.outdir, ARGS.prefix)
     ARGS.verbose     = 1 if ARGS.verbose == 'TRUE' else 0
     return ARGS
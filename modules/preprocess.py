@@ -12,35 +12,202 @@
 from modules.utils import *
 
 #-----------------------------------------------------
+# Columns handled by one task, fixed so that results do not depend on the number of threads
 
-def quantile_normalized(profiles):
+COLUMN_BLOCK = 64
+
+#-----------------------------------------------------
+
+def column_map(func, values, nthreads = None):
+    '''
+    Apply a function to blocks of COLUMN_BLOCK columns across a thread pool, numpy sorts and ufuncs release the GIL.
+    :param func: [callable] func(start, end) of a block of columns.
+    :param values: [np.array] N genes x K samples.
+    :param nthreads: [int] Number of threads, default: None, all available cpus.
+    :return: results [list] results of func in block order, which does not depend on the number of threads
+    
+    '''
+    blocks = [ (start, min(start + COLUMN_BLOCK, values.shape[1])) for start in range(0, values.shape[1], COLUMN_BLOCK) ]
+    nthreads = nthreads if nthreads else __import__('multiprocessing').cpu_count()
+    if nthreads <= 1 or len(blocks) <= 1: return [ func(start, end) for start, end in blocks ]
+    return get_pool(nthreads, 'thread').map(lambda block: func(*block), blocks)
+
+def query_rows(genes, query_genes):
     '''
-    Normalize gene expression profile by quantile method.
+    Positions of query genes through the hash index of genes.
+    :param genes: [pd.Index] Genes of rows.
+    :param query_genes: [list] A list of query genes.
+    :return: positions [np.array] of the query genes present
+    
+    '''
+    positions = pd.Index(genes).get_indexer(query_genes) if len(query_genes) else np.array([], dtype = int)
+    return positions[positions >= 0]
+
+def quantile_normalized(profiles, nthreads = None):
+    '''
+    Normalize gene expression profile by quantile method, columns are sorted and ranked block by block across threads.
     :param profiles: [pd.DataFrame] Gene expression profile, N genes x K samples.
+    :param nthreads: [int] Number of threads, default: None, all available cpus.
     :return: profiles_norm [pd.DataFrame] Normalized gene expression profile 
     
     '''
-    quantiles = np.mean(np.sort(profiles, axis = 0), axis = 1)
-    ranks = np.apply_along_axis(stats.rankdata, 0, profiles)
-    rank_indices = ranks.astype(int) - 1
-    profiles = pd.DataFrame(quantiles[rank_indices], index = profiles.index)
+    values, rankdata = np.asarray(profiles), __import__('scipy.stats').stats.rankdata
+    sorted_values = np.empty(values.shape, dtype = values.dtype)
+    def sort_block(start, end):
+        sorted_values[:, start : end] = np.sort(values[:, start : end], axis = 0)
+    column_map(sort_block, values, nthreads)
+    quantiles = np.mean(sorted_values, axis = 1)
+    del sorted_values
+    
+    norm_values = np.empty(values.shape, dtype = quantiles.dtype)
+    def rank_block(start, end):
+        norm_values[:, start : end] = quantiles[rankdata(values[:, start : end], axis = 0).astype(int) - 1]
+    column_map(rank_block, values, nthreads)
+    profiles = pd.DataFrame(norm_values, index = profiles.index)
     return profiles
 
-def filter_lowexps(profiles, query_genes, percentile = 5):
+def filter_lowexps(profiles, query_genes, percentile = 5, nthreads = None):
     '''
     Filter out low-expression genes of profiles.
     :param profiles: [pd.DataFrame] Gene expression profile, which rows genes and columns samples.
     :param query_genes: [list] A list of query genes.
     :param percentile: [int] How many genes include in analysis. Default percentile 5.
+    :param nthreads: [int] Number of threads summing column blocks, default: None, all available cpus.
     :return: profiles_sub [pd.DataFrame]
     
     '''
-    expr_sum = np.log2(profiles + 1).sum(axis = 1).sort_values(ascending = False)
-    profiles = profiles.loc[expr_sum.index, :]
-    expr_sum = expr_sum.loc[expr_sum > np.percentile(expr_sum, 5)]
-    top_num  = expr_sum.shape[0]
+    values   = np.asarray(profiles)
+    expr_sum = np.sum(column_map(lambda start, end: np.log2(values[:, start : end] + 1).sum(axis = 1), values, nthreads), axis = 0)
+    order    = np.argsort(-expr_sum, kind = 'stable')
+    top_num  = int(np.sum(expr_sum > np.percentile(expr_sum, percentile)))
 
-    for idx, query in enumerate(query_genes):
-        top_num = max(np.where(profiles.index == query)[0], top_num)
-    profiles_sub = profiles.iloc[0 : top_num]
+    query_pos = query_rows(profiles.index[order], query_genes)
+    if len(query_pos): top_num = max(int(query_pos.max()) + 1, top_num) # query genes are always kept
+    profiles_sub = profiles.iloc[order[0 : top_num]]
     return profiles_sub
+
+def quantile_normalized_ooc(profiles, norm_fil, logc = False, nthreads = None):
+    '''
+    Normalize gene expression profile by quantile method block by block of columns, normalized values are written to a memory-mapped file.
+    :param profiles: [pd.DataFrame] Gene expression profile, N genes x K samples, may be backed by a memory-mapped file.
+    :param norm_fil: [str] NPY file of normalized values.
+    :param logc: [bool] Values are log2 scaled and transformed back before normalization, default: False.
+    :param nthreads: [int] Number of threads, default: None, all available cpus.
+    :return: profiles_norm [pd.DataFrame] Normalized gene expression profile backed by norm_fil
+    
+    '''
+    values = profiles.values
+    columns = lambda start, end: 2 ** values[:, start : end] if logc else values[:, start : end]
+    sorted_sums = column_map(lambda start, end: np.sort(columns(start, end), axis = 0).sum(axis = 1, dtype = np.float64), values, nthreads)
+    quantiles = (np.sum(sorted_sums, axis = 0) / values.shape[1]).astype(values.dtype)
+    
+    norm_values = np.lib.format.open_memmap(norm_fil, mode = 'w+', dtype = values.dtype, shape = values.shape, fortran_order = True)
+    rankdata = __import__('scipy.stats').stats.rankdata
+    def rank_block(start, end):
+        norm_values[:, start : end] = quantiles[rankdata(columns(start, end), axis = 0).astype(int) - 1]
+    column_map(rank_block, values, nthreads)
+    profiles_norm = pd.DataFrame(norm_values, index = profiles.index, copy = False)
+    return profiles_norm
+
+def quantile_normalized_inplace(values, genes, logc = False, nthreads = None):
+    '''
+    Normalize gene expression profile by quantile method block by block of columns, normalized values overwrite the profile values.
+    :param values: [np.array] Writable values of the gene expression profile owned by the caller, N genes x K samples, see read_values.
+    :param genes: [pd.Index] Genes of rows.
+    :param logc: [bool] Values are log2 scaled and transformed back before normalization, default: False.
+    :param nthreads: [int] Number of threads, default: None, all available cpus.
+    :return: profiles_norm [pd.DataFrame] Normalized gene expression profile sharing values
+    
+    '''
+    def sort_block(start, end):
+        if logc: np.exp2(values[:, start : end], out = values[:, start : end])
+        return np.sort(values[:, start : end], axis = 0).sum(axis = 1, dtype = np.float64)
+    quantiles = (np.sum(column_map(sort_block, values, nthreads), axis = 0) / values.shape[1]).astype(values.dtype)
+    
+    rankdata = __import__('scipy.stats').stats.rankdata
+    def rank_block(start, end): # column by column, ranks of a whole block would take several times its memory
+        for idx in range(start, end):
+            values[:, idx] = quantiles[rankdata(values[:, idx]).astype(int) - 1]
+    column_map(rank_block, values, nthreads)
+    profiles_norm = pd.DataFrame(values, index = genes, copy = False)
+    return profiles_norm
+
+def filter_lowexps_inplace(values, genes, query_genes, percentile = 5, nthreads = None):
+    '''
+    Filter out low-expression genes as filter_lowexps does, the remained rows are moved block by block of columns to the front of values.
+    :param values: [np.array] Writable values of the gene expression profile owned by the caller, N genes x K samples.
+    :param genes: [pd.Index] Genes of rows.
+    :param query_genes: [list] A list of query genes.
+    :param percentile: [int] How many genes include in analysis. Default percentile 5.
+    :param nthreads: [int] Number of threads moving column blocks, default: None, all available cpus.
+    :return: profiles_sub [pd.DataFrame] sharing the first rows of values
+    
+    '''
+    expr_sum = np.sum(column_map(lambda start, end: np.log2(values[:, start : end] + 1).sum(axis = 1), values, nthreads), axis = 0)
+    order    = np.argsort(-expr_sum, kind = 'stable')
+    top_num  = int(np.sum(expr_sum > np.percentile(expr_sum, percentile)))
+
+    query_pos = query_rows(genes[order], query_genes)
+    if len(query_pos): top_num = max(int(query_pos.max()) + 1, top_num) # query genes are always kept
+    rows = order[0 : top_num]
+    def move_block(start, end): # rows are gathered before they are written
+        values[0 : top_num, start : end] = values[rows, start : end]
+    column_map(move_block, values, nthreads)
+    profiles_sub = pd.DataFrame(values[0 : top_num], index = genes[rows], copy = False)
+    return profiles_sub
+
+def filter_lowexps_ooc(profiles, query_genes, percentile = 5):
+    '''
+    Filter out low-expression genes of profiles from per-row summaries accumulated column by column, only the remained rows are loaded.
+    :param profiles: [pd.DataFrame] Gene expression profile, which rows genes and columns samples, may be backed by a memory-mapped file.
+    :param query_genes: [list] A list of query genes.
+    :param percentile: [int] How many genes include in analysis. Default percentile 5.
+    :return: profiles_sub [pd.DataFrame]
+    
+    '''
+    values, expr_sum = profiles.values, np.zeros(profiles.shape[0])
+    for idx in range(values.shape[1]):
+        expr_sum += np.log2(values[:, idx] + 1)
+    
+    order = np.argsort(-expr_sum, kind = 'stable')
+    top_num = int(np.sum(expr_sum > np.percentile(expr_sum, percentile)))
+    query_pos = query_rows(profiles.index[order], query_genes)
+    if len(query_pos): top_num = max(int(query_pos.max()) + 1, top_num) # query genes are always kept
+    
+    rows = order[0 : top_num]
+    profiles_sub = pd.DataFrame(values[rows], index = profiles.index[rows], columns = profiles.columns)
+    return profiles_sub
+
+def library_normalized(values):
+    '''
+    Scale every cell of a sparse profile to the median library size, zeros stay zeros unlike the quantile method.
+    :param values: [scipy.sparse.csr_matrix] Sparse gene expression profile, N genes x K cells.
+    :return: values_norm [scipy.sparse.csr_matrix]
+    
+    '''
+    lib_size = np.asarray(values.sum(axis = 0)).ravel()
+    factors  = np.divide(np.median(lib_size[lib_size > 0]), lib_size, out = np.zeros(lib_size.shape), where = lib_size > 0)
+    return values.dot(__import__('scipy.sparse').sparse.diags(factors.astype(values.dtype))).tocsr()
+
+def filter_lowexps_sparse(values, genes, query_genes, percentile = 5):
+    '''
+    Filter out low-expression genes of a sparse profile, sorted by expression as filter_lowexps does.
+    :param values: [scipy.sparse.csr_matrix] Sparse gene expression profile, N genes x K cells.
+    :param genes: [pd.Index] Genes of rows.
+    :param query_genes: [list] A list of query genes.
+    :param percentile: [int] How many genes include in analysis. Default percentile 5.
+    :return: values_sub [scipy.sparse.csr_matrix], genes_sub [pd.Index]
+    
+    '''
+    logs = values.copy()
+    logs.data = np.log2(logs.data + 1)
+    expr_sum = np.asarray(logs.sum(axis = 1)).ravel()
+    del logs
+    
+    order = np.argsort(-expr_sum, kind = 'stable')
+    top_num = int(np.sum(expr_sum > np.percentile(expr_sum, percentile)))
+    query_pos = query_rows(genes[order], query_genes)
+    if len(query_pos): top_num = max(int(query_pos.max()) + 1, top_num) # query genes are always kept
+    
+    rows = order[0 : top_num]
+    return values[rows], genes[rows]
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#title       : server.py
+#description : Long-running query server keeping preprocessed profiles in memory.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : module
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load own and python modules
+
+import threading
+import socketserver
+from http.server   import BaseHTTPRequestHandler, HTTPServer
+from modules.utils import *
+
+#-----------------------------------------------------
+# Largest request body accepted, in bytes
+
+MAX_REQUEST = 2 ** 24
+
+#-----------------------------------------------------
+
+class ProfilePool(object):
+    '''
+    preprocessed profiles kept in memory, the least recently used ones are evicted beyond the memory cap
+
+    '''
+    def __init__(self, atlases, factory, memory_cap = None):
+        '''
+        :param atlases: [OrderedDict] profile file of each atlas name
+        :param factory: [callable] builds a Searcher from a profile file
+        :param memory_cap: [int] maximum bytes of gene counts kept in memory, default: None, unbounded
+
+        '''
+        self.atlases, self.factory, self.memory_cap = atlases, factory, memory_cap
+        self.searchers, self.lock, self.loading = __import__('collections').OrderedDict(), threading.Lock(), {}
+
+    def get(self, name):
+        '''
+        searcher of an atlas, preprocessed on first use, concurrent requests of a cold atlas wait for one load
+        :param name: [str] atlas name
+        :return: searcher [Searcher]
+
+        '''
+        if name not in self.atlases: raise KeyError('Unknown atlas: {0}'.format(name))
+        with self.lock:
+            if name in self.searchers:
+                self.searchers.move_to_end(name)
+                return self.searchers[name]
+            load_lock = self.loading.setdefault(name, threading.Lock())
+        with load_lock:
+            with self.lock:
+                if name in self.searchers: return self.searchers[name]
+            searcher = self.factory(self.atlases[name])
+            with self.lock:
+                self.searchers[name] = searcher
+                self.loading.pop(name, None)
+                self.evict()
+        return searcher
+
+    def evict(self):
+        '''
+        drop the least recently used searchers until the cap is met, the latest one is always kept, caller holds the lock
+        :return: 0
+
+        '''
+        while self.memory_cap is not None and len(self.searchers) > 1 and self.nbytes() > self.memory_cap:
+            self.searchers.popitem(last = False)
+        return 0
+
+    def nbytes(self):
+        return sum(searcher.gene_counts.values.nbytes for searcher in self.searchers.values())
+
+    def status(self):
+        with self.lock:
+            loaded = dict((name, int(searcher.gene_counts.values.nbytes)) for name, searcher in self.searchers.items())
+        return [ {'atlas' : name, 'loaded' : name in loaded, 'nbytes' : loaded.get(name, 0)} for name in self.atlases ]
+
+def frame_records(frame):
+    '''
+    JSON records of a result table, NaN written as null
+    :param frame: [pd.DataFrame] result table
+    :return: records [list]
+
+    '''
+    return json.loads(frame.reset_index().to_json(orient = 'records'))
+
+def answer(pool, request):
+    '''
+    answer a search request against an atlas
+    :param pool: [ProfilePool] preprocessed profiles
+    :param request: [dict] atlas, query_genes or query_sets, and optional fdr, approx and top
+    :return: response [dict]
+
+    '''
+    if not isinstance(request, dict) or 'atlas' not in request or not (request.get('query_genes') or request.get('query_sets')):
+        raise ValueError('A search request needs an atlas and query_genes or query_sets')
+    start    = perf_counter()
+    searcher = pool.get(request['atlas'])
+    params   = dict((key, request[key]) for key in ['fdr', 'approx'] if request.get(key) is not None)
+    top_num  = request.get('top')
+    if request.get('query_sets'):
+        search_sets = searcher.search_batch(request['query_sets'], **params)
+        results = dict((name, frame_records(search_res.iloc[0 : top_num])) for name, search_res in search_sets.items())
+    else:
+        results = frame_records(searcher.search(request['query_genes'], **params).iloc[0 : top_num])
+    return {'atlas' : request['atlas'], 'elapsed' : perf_counter() - start, 'results' : results}
+
+class SearchHandler(BaseHTTPRequestHandler):
+    '''
+    GET /atlases lists atlases, POST /search answers a JSON search request
+
+    '''
+    def reply(self, code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/atlases':
+            self.reply(200, self.server.pool.status())
+        elif self.path.rstrip('/') == '/health':
+            self.reply(200, {'status' : 'ok'})
+        else:
+            self.reply(404, {'error' : 'Unknown path: {0}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/search':
+            return self.reply(404, {'error' : 'Unknown path: {0}'.format(self.path)})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_REQUEST: return self.reply(413, {'error' : 'Request larger than {0} bytes'.format(MAX_REQUEST)})
+            with report_scope(): # stages of concurrent requests are timed apart
+                response = answer(self.server.pool, json.loads(self.rfile.read(length).decode()))
+        except KeyError as err: # unknown atlas
+            return self.reply(404, {'error' : str(err).strip('\'"')})
+        except (ValueError, TypeError) as err:
+            return self.reply(400, {'error' : str(err)})
+        except Exception as err:
+            __import__('traceback').print_exc()
+            return self.reply(500, {'error' : repr(err)})
+        self.reply(200, response)
+
+    def log_message(self, format, *args):
+        show_msg('>> ' + format % args, self.server.logs.info, self.server.verbose)
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self): # HTTP handlers expect an (host, port) client address
+        request, client_address = self.socket.accept()
+        return request, (client_address or 'unix', 0)
+
+def serve(address, pool, LOGS, verbose = True, workers = None):
+    '''
+    serve search requests until interrupted, each request is answered in its own thread
+    :param address: [str] HOST:PORT, or unix:PATH for a Unix socket
+    :param pool: [ProfilePool] preprocessed profiles
+    :param LOGS: [obj] Log object
+    :param verbose: [bool] verbose logical, to print the detailed information, default: True
+    :param workers: [list] (nth, backend) of worker pools and work queues started before any request thread, processes 
+                    forked later would copy locks held by other threads, default: None
+    :return: 0
+
+    '''
+    for nth, backend in workers if workers else []:
+        get_pool(nth, backend) if backend in ['process', 'thread'] else __import__('modules.workqueue', fromlist = ['coordinator']).coordinator(backend, nth)
+    if address.startswith('unix:'):
+        path = address[len('unix:') : ]
+        if os.path.exists(path): os.remove(path)
+        server = ThreadingUnixServer(path, SearchHandler)
+    else:
+        host, port = address.rsplit(':', 1) if ':' in address else ('127.0.0.1', address)
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), SearchHandler)
+    server.pool, server.logs, server.verbose = pool, LOGS, verbose
+    HWM_PARAMS['reset'] = False # the high-water mark is per process, a request resetting it would cut the stage peaks of the others
+    show_msg('>> Serving {0} atlases on {1}'.format(len(pool.atlases), address), LOGS.info, verbose)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if address.startswith('unix:') and os.path.exists(address[len('unix:') : ]): os.remove(address[len('unix:') : ])
+    return 0
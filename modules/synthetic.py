@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+#title       : synthetic.py
+#description : Seeded synthetic expression profiles with planted marker modules.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : module
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load own and python modules
+
+from modules.utils import *
+
+#-----------------------------------------------------
+# Cell types mixed in each sample, marker genes planted per cell type, and rows generated at once
+# Marker genes follow the fraction of their cell type without noise, even a fixed scale per gene spreads them over
+# consecutive ranks of quantile normalization, which puts 20 of them below the 0.6 cutoff of chk_queries_quality
+
+MODULE_NUM, MODULE_SIZE, GENERATE_ROWS = 5, 50, 4096
+MODULE_PARAMS = {'alpha' : 2, 'floor' : 0.05, 'gain' : 10, 'level' : 5, 'spacing' : 0.5}
+
+#-----------------------------------------------------
+
+def synthetic_profile(ngenes, nsamples, nmodules = MODULE_NUM, module_size = MODULE_SIZE, seed = 0, dtype = np.float32, noise = 0):
+    '''
+    generate a mixture profile, each sample mixes nmodules cell types and the genes of a module follow the fraction of its cell type,
+    at a level of their own module so that modules of absent cell types do not tie
+    :param ngenes: [int] number of genes
+    :param nsamples: [int] number of samples
+    :param nmodules: [int] number of cell types, each with one planted marker module, default: MODULE_NUM
+    :param module_size: [int] number of marker genes in each module, default: MODULE_SIZE
+    :param seed: [int] random seed, the same seed gives the same profile, default: 0
+    :param dtype: [np.dtype] data type of expression values, default: np.float32
+    :param noise: [float] sigma of log-normal noise on every value of marker genes, default: 0, markers follow their cell type exactly
+    :return: profiles [pd.DataFrame] N genes x K samples, modules [OrderedDict] marker genes of each cell type
+
+    '''
+    nmodules = min(nmodules, ngenes // max(module_size, 1))
+    rng = np.random.RandomState(seed)
+    fractions = rng.dirichlet(np.full(max(nmodules, 1), MODULE_PARAMS['alpha']), size = nsamples).T # cell types x samples
+    baseline  = rng.lognormal(mean = 4, sigma = 1.5, size = ngenes)
+
+    values = np.empty((ngenes, nsamples), dtype = dtype)
+    for start in range(0, ngenes, GENERATE_ROWS):
+        end = min(start + GENERATE_ROWS, ngenes)
+        values[start : end] = baseline[start : end, None] * rng.lognormal(0, 0.3, size = (end - start, nsamples))
+
+    genes, modules = np.array([ 'G{0:06d}'.format(idx) for idx in range(ngenes) ], dtype = object), __import__('collections').OrderedDict()
+    for idx in range(nmodules):
+        rows  = np.arange(idx * module_size, (idx + 1) * module_size)
+        level = np.exp(MODULE_PARAMS['level'] + MODULE_PARAMS['spacing'] * idx)
+        values[rows] = level * (MODULE_PARAMS['floor'] + MODULE_PARAMS['gain'] * fractions[idx][None, :])
+        if noise: values[rows] *= rng.lognormal(0, 1, size = (module_size, 1)) * rng.lognormal(0, noise, size = (module_size, nsamples))
+        genes[rows]  = [ 'M{0}_{1:04d}'.format(idx, row) for row in range(module_size) ]
+        modules['M{0}'.format(idx)] = list(genes[rows])
+
+    profiles = pd.DataFrame(values, index = genes, columns = [ 'S{0:05d}'.format(idx) for idx in range(nsamples) ], copy = False)
+    return profiles, modules
+
+def write_synthetic(profiles, profile_fil):
+    '''
+    write a profile as NPY matrix with gene and sample names next to it, read back by read_profiles
+    :param profiles: [pd.DataFrame] profile returned by synthetic_profile
+    :param profile_fil: [str] NPY file
+    :return: profile_fil [str]
+
+    '''
+    stem = os.path.splitext(profile_fil)[0]
+    np.save(stem + '.npy', profiles.values)
+    for ext, names in [('.genes', profiles.index), ('.samples', profiles.columns)]:
+        with open(stem + ext, 'w') as fp: fp.write('\n'.join(names) + '\n')
+    return stem + '.npy'
@@ -11,13 +11,39 @@
 
 import os
 import sys
+import json
+import atexit
+import pickle
+import shutil
 import logging
+import tempfile
+import threading
+import contextlib
+import tracemalloc
 import numpy  as np
 import pandas as pd
-import scipy as sp
-from scipy import stats
+from time  import perf_counter, process_time, thread_time
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
 np.seterr(divide='ignore', invalid='ignore')
 #----------------------------------------------------
+# persistent worker pools, shared frames attached by workers, chunks per worker, and rows of checkpointed chunks,
+# which do not depend on the number of workers so that a run resumed with another --nthreads finds them again
+
+POOLS, ATTACHED, CHUNKS_PER_WORKER, CHECKPOINT_ROWS = {}, {}, 4, 256
+POOLS_LOCK = threading.Lock()
+SHARED_ROOT = '/dev/shm' if os.path.isdir('/dev/shm') else None
+PRECISIONS  = {'double' : np.float64, 'single' : np.float32}
+LOGSCALE_SAMPLE = 10 ** 6 # values sampled by is_logscale, its six percentiles are stable well before
+#----------------------------------------------------
+# run report filled by stage and multi_process, and the stages being timed, replaced in a thread by report_scope,
+# and whether stages reset the memory high-water mark, which is shared by all threads of the process
+
+RUN_REPORT, STAGES, LOCAL_REPORT = {'stages' : [], 'tasks' : []}, [], threading.local()
+HWM_PARAMS = {'reset' : True}
+#----------------------------------------------------
 
 def log_infos():
     '''
@@ -49,6 +75,154 @@ def show_msg(msg, log_func, verbose = True):
         sys.exit(1)
     return 0
 
+def peak_rss():
+    '''
+    peak resident memory of this process and of its finished children
+    :return: peak_rss [dict] in MB, None when not available
+    
+    '''
+    if resource is None: return None
+    scale = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10 # ru_maxrss is in bytes on macOS, KB on Linux
+    return {
+            'self'     : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            'children' : resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+        }
+
+def stage_hwm(reset = False):
+    '''
+    resident memory high-water mark of this process, Linux only, reset at the start of each stage so every stage reports its own peak
+    :param reset: [bool] reset the mark to the current resident memory after reading it, default: False
+    :return: hwm [float] in MB, None when not available
+    
+    '''
+    try:
+        with open('/proc/self/status') as fp:
+            hwm = [ int(line.split()[1]) / 2 ** 10 for line in fp if line.startswith('VmHWM:') ][0]
+        if reset:
+            with open('/proc/self/clear_refs', 'w') as fp: fp.write('5')
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return hwm
+
+def children_cpu():
+    '''
+    cpu time used by finished child processes
+    :return: seconds [float], 0 when not available
+    
+    '''
+    if resource is None: return 0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def frame_infos(frame):
+    '''
+    shape, dtype and size of an array or dataframe for the run report
+    :param frame: [pd.DataFrame/np.array] data
+    :return: infos [dict]
+    
+    '''
+    values = frame.values if isinstance(frame, (pd.DataFrame, pd.Series)) else np.asarray(frame)
+    return {'shape' : list(values.shape), 'dtype' : str(values.dtype), 'nbytes' : int(values.nbytes)}
+
+def current_report():
+    '''
+    run report and stages being timed of the calling thread, those of the process outside report_scope
+    :return: report [dict], stages [list]
+    
+    '''
+    return getattr(LOCAL_REPORT, 'report', RUN_REPORT), getattr(LOCAL_REPORT, 'stages', STAGES)
+
+@contextlib.contextmanager
+def report_scope():
+    '''
+    give the calling thread a report of its own, so that concurrent requests of a server do not mix their stages
+    :return: report [dict] stages and tasks timed in the scope
+    
+    '''
+    LOCAL_REPORT.report, LOCAL_REPORT.stages = {'stages' : [], 'tasks' : []}, []
+    try:
+        yield LOCAL_REPORT.report
+    finally:
+        del LOCAL_REPORT.report, LOCAL_REPORT.stages
+
+@contextlib.contextmanager
+def stage(name, **infos):
+    '''
+    time a pipeline stage into the report of current_report, array sizes can be added to the yielded record
+    :param name: [str] stage name
+    :param infos: [dict] extra information of the stage
+    :return: record [dict] wall time, cpu time, peak rss and traced memory of the stage, the stage peak only if HWM_PARAMS resets the mark
+    
+    '''
+    report, stages = current_report()
+    record = dict(name = name, parent = stages[-1]['name'] if stages else None, **infos)
+    wall, cpu, child_cpu = perf_counter(), process_time(), children_cpu()
+    if tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak'): tracemalloc.reset_peak()
+    hwm = stage_hwm(reset = True) if HWM_PARAMS['reset'] else None # the peak of the enclosing stage so far is carried over to it below
+    if stages and hwm is not None: stages[-1]['stage_peak_mb'] = max(stages[-1].get('stage_peak_mb', 0), hwm)
+    stages.append(record)
+    try:
+        yield record
+    finally:
+        stages.pop()
+        hwm = stage_hwm(reset = True) if HWM_PARAMS['reset'] else None
+        if hwm is not None:
+            record['stage_peak_mb'] = max(record.get('stage_peak_mb', 0), hwm)
+            if stages: stages[-1]['stage_peak_mb'] = max(stages[-1].get('stage_peak_mb', 0), record['stage_peak_mb'])
+        record.update(
+                wall_time = perf_counter() - wall,
+                cpu_time = process_time() - cpu,
+                children_cpu_time = children_cpu() - child_cpu,
+                peak_rss_mb = peak_rss()
+            )
+        if tracemalloc.is_tracing(): record['traced_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        report['stages'].append(record)
+
+def start_profiler(kind = None):
+    '''
+    hook cProfile or tracemalloc into the run
+    :param kind: [str] 'cprofile', 'tracemalloc' or None
+    :return: profiler [cProfile.Profile] or None
+    
+    '''
+    if kind == 'tracemalloc':
+        tracemalloc.start()
+    elif kind == 'cprofile':
+        profiler = __import__('cProfile').Profile()
+        profiler.enable()
+        return profiler
+    return None
+
+def stop_profiler(profiler, prof_fil):
+    '''
+    stop profiling, cProfile stats are dumped to prof_fil
+    :param profiler: [cProfile.Profile] profiler returned by start_profiler
+    :param prof_fil: [str] file of cProfile stats
+    :return: 0
+    
+    '''
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(prof_fil)
+        current_report()[0]['cprofile'] = prof_fil
+    if tracemalloc.is_tracing():
+        current_report()[0]['traced_memory_mb'] = dict(zip(['current', 'peak'], np.array(tracemalloc.get_traced_memory()) / 2 ** 20))
+        tracemalloc.stop()
+    return 0
+
+def write_report(report_fil, **infos):
+    '''
+    write the run report of current_report as JSON
+    :param report_fil: [str] JSON file
+    :param infos: [dict] extra information of the run
+    :return: 0
+    
+    '''
+    report = dict(current_report()[0], **infos)
+    with open(report_fil, 'w') as fp:
+        json.dump(report, fp, indent = 2, default = lambda obj: obj.item() if hasattr(obj, 'item') else str(obj))
+    return 0
+
 def split_bins(tasks, nth):
     '''
     split the size of data into sections for multi-processes
@@ -72,38 +246,208 @@ def split_bins(tasks, nth):
         if end >= length: break
     return sub_tasks
 
-def multi_process(data_lst, func, nth, df, **kargs):
+class SharedFrame(object):
+    '''
+    numeric dataframe placed once in a memory-mapped file (RAM-backed under /dev/shm), workers attach to it without copying
+    
+    '''
+    def __init__(self, frame = None, path = None, root = SHARED_ROOT):
+        self.path = path if path else tempfile.mkdtemp(prefix = 'msearcher-', dir = root)
+        if frame is None: return
+        np.save(os.path.join(self.path, 'values.npy'), np.ascontiguousarray(frame.values))
+        with open(os.path.join(self.path, 'meta.pkl'), 'wb') as fp:
+            pickle.dump((frame.index, frame.columns), fp, protocol = pickle.HIGHEST_PROTOCOL)
+
+    def __getstate__(self):
+        return {'path' : self.path}
+
+    def attach(self):
+        '''
+        attach to the memory-mapped values, the frame is cached per process
+        :return: frame [pd.DataFrame] read-only frame backed by the shared file
+        
+        '''
+        if self.path not in ATTACHED:
+            for path in [ path for path in ATTACHED if not os.path.exists(path) ]: ATTACHED.pop(path)
+            with open(os.path.join(self.path, 'meta.pkl'), 'rb') as fp:
+                index, columns = pickle.load(fp)
+            values = np.load(os.path.join(self.path, 'values.npy'), mmap_mode = 'r')
+            ATTACHED[self.path] = pd.DataFrame(values, index = index, columns = columns, copy = False)
+        return ATTACHED[self.path]
+
+    def release(self):
+        '''
+        remove the shared file once all workers are done
+        :return: 0
+        
+        '''
+        ATTACHED.pop(self.path, None)
+        shutil.rmtree(self.path, ignore_errors = True)
+        return 0
+
+def get_pool(nth, backend = 'process'):
+    '''
+    get a worker pool which stays alive across calls
+    :param nth: [int] number of workers
+    :param backend: [str] 'process' for multiprocessing or 'thread' for numpy sections releasing the GIL
+    :return: pool [multiprocessing.pool.Pool]
+    
+    '''
+    with POOLS_LOCK: # threads of the server may ask for the same pool at once
+        if (backend, nth) not in POOLS:
+            pool_cls = __import__('multiprocessing.pool').pool.ThreadPool if backend == 'thread' else __import__('multiprocessing').Pool
+            POOLS[(backend, nth)] = pool_cls(nth)
+        return POOLS[(backend, nth)]
+
+@atexit.register
+def close_pools():
+    '''
+    close all persistent worker pools
+    :return: 0
+    
+    '''
+    with POOLS_LOCK:
+        pools = [ POOLS.pop(key) for key in list(POOLS.keys()) ]
+    for pool in pools:
+        pool.close(); pool.join()
+    return 0
+
+def run_chunk(task):
+    '''
+    run one chunk of tasks inside a worker, shared frames are attached before calling
+    :param task: [tuple] (func, data_lst, start, end, kargs)
+    :return: returned results of func, timing [dict] of the chunk
+    
+    '''
+    func, data_lst, start, end, kargs = task
+    wall, cpu = perf_counter(), thread_time()
+    data_lst = data_lst.attach() if isinstance(data_lst, SharedFrame) else data_lst
+    kargs = { key : val.attach() if isinstance(val, SharedFrame) else val for key, val in kargs.items() }
+    tag_info = func(data_lst[start : end], **kargs)
+    timing = {'pid' : os.getpid(), 'rows' : end - start, 'wall_time' : perf_counter() - wall, 'cpu_time' : thread_time() - cpu}
+    return tag_info, timing
+
+def block_path(checkpoint, task):
+    return os.path.join(checkpoint, '{0}-{1}-{2}.pkl'.format(task[0].__name__, task[2], task[3]))
+
+def load_block(path):
+    if not os.path.exists(path): return None
+    try:
+        with open(path, 'rb') as fp: return pickle.load(fp)
+    except (EOFError, pickle.UnpicklingError): # truncated by a full disk, run again
+        return None
+
+def save_block(path, tag_info):
+    '''
+    persist the result of a finished chunk, written to a temporary file first so a killed run never leaves a partial block
+    :param path: [str] block file returned by block_path
+    :param tag_info: returned results of the chunk
+    :return: 0
+    
+    '''
+    tmp = '{0}.tmp-{1}'.format(path, os.getpid())
+    with open(tmp, 'wb') as fp: pickle.dump(tag_info, fp, protocol = pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp, path)
+    return 0
+
+def multi_process(data_lst, func, nth, df, backend = 'process', chunks = CHUNKS_PER_WORKER, checkpoint = None, **kargs):
     '''
     multiple processing to handle data list
     :param data_lst: data list
     :param func: unified approach to the processing of various processes
     :param nth: processor number
     :param df: convert dataframe or not
+    :param backend: [str] 'process' or 'thread' pool, or a work queue dir:PATH or tcp:[HOST:]PORT, default: process
+    :param chunks: [int] chunks per worker, idle workers pick the next chunk, default: CHUNKS_PER_WORKER
+    :param checkpoint: [str] directory where finished chunks of CHECKPOINT_ROWS rows are kept, chunks found there are not run again, default: None
     :return: tag_infos [list] returned results for all processors
       
     '''
-    if nth > 1:
-        sub_tasks = split_bins(data_lst, nth)
-        pools = __import__('multiprocessing').Pool(nth)
-        _func = __import__('functools').partial(func, **kargs)
-        tag_infos = pools.map(_func, sub_tasks) # multiple processing
-        pools.close(); pools.join()
+    queued = backend not in ['process', 'thread']
+    if nth > 1 or queued or checkpoint:
+        shared, workqueue = {}, __import__('modules.workqueue', fromlist = ['queue_map']) if queued else None
+        if backend == 'process' or queued: # dataframes are shared once instead of pickled to every worker
+            root = workqueue.coordinator(backend, nth).shared_root if queued else SHARED_ROOT
+            for val in [ data_lst ] + list(kargs.values()):
+                if isinstance(val, pd.DataFrame) and val.values.dtype.kind in 'biuf' and id(val) not in shared: shared[id(val)] = SharedFrame(val, root = root)
+        
+        share = lambda val: shared.get(id(val), val)
+        bins_lst = [ range(start, min(start + CHECKPOINT_ROWS, len(data_lst))) for start in range(0, len(data_lst), CHECKPOINT_ROWS) ] \
+            if checkpoint else split_bins(list(range(len(data_lst))), nth * chunks)
+        sub_tasks = [ (func, share(data_lst), bins[0], bins[-1] + 1, { key : share(val) for key, val in kargs.items() })
+            for bins in bins_lst if len(bins) ]
+        if checkpoint and not os.path.isdir(checkpoint): os.makedirs(checkpoint)
+        paths = [ block_path(checkpoint, task) if checkpoint else None for task in sub_tasks ]
+        tag_infos = [ load_block(path) if path else None for path in paths ]
+        pending = [ idx for idx, tag_info in enumerate(tag_infos) if tag_info is None ]
+        keep = lambda pos, result: save_block(paths[pending[pos]], result[0]) if checkpoint else 0
+        try:
+            wall = perf_counter()
+            if queued: # chunks merged in order, as from a local pool
+                results = workqueue.queue_map(backend, [ sub_tasks[idx] for idx in pending ], nth, done = keep)
+            else:
+                results = []
+                for pos, result in enumerate(get_pool(max(1, nth), backend).imap(run_chunk, [ sub_tasks[idx] for idx in pending ])): # multiple processing
+                    keep(pos, result)
+                    results.append(result)
+        finally:
+            for val in shared.values(): val.release()
+        report, stages = current_report()
+        report['tasks'].append({
+                'func'      : func.__name__,
+                'stage'     : stages[-1]['name'] if stages else None,
+                'backend'   : backend,
+                'workers'   : nth,
+                'wall_time' : perf_counter() - wall,
+                'resumed'   : len(sub_tasks) - len(pending),
+                'chunks'    : [ timing for tag_info, timing in results ]
+            })
+        for idx, result in zip(pending, results): tag_infos[idx] = result[0]
+        
         if df:
             tag_infos = pd.concat([pd.DataFrame(np.array(tag)) for tag in tag_infos], axis = 0)
         else:
             tag_infos = [subline for line in tag_infos for subline in line]
     else:
         tag_infos = func(data_lst, **kargs)
+        if df: tag_infos = pd.DataFrame(np.array(tag_infos))
     return tag_infos
 
-def is_logscale(X):
+def rank_dtype(ngenes):
+    '''
+    smallest unsigned integer dtype holding gene counts in [0, ngenes], uint16 when ngenes < 65536
+    :param ngenes: [int] number of genes
+    :return: dtype [np.dtype]
+    
+    '''
+    return np.min_scalar_type(ngenes)
+
+def diff_dtype(ngenes):
+    '''
+    signed integer dtype holding differences between gene counts
+    :param ngenes: [int] number of genes
+    :return: dtype [np.dtype]
+    
+    '''
+    return np.dtype(np.int32) if ngenes < 2 ** 31 else np.dtype(np.intp)
+
+def is_logscale(X, max_values = LOGSCALE_SAMPLE):
     '''
     check log2 transform or not
-    :param X: [pd.DataFrame] data need to be check
+    :param X: [pd.DataFrame/scipy.sparse matrix] data need to be check, implicit zeros of sparse data are counted without densifying
+    :param max_values: [int] check evenly spaced rows holding about max_values values, None for all values, default: LOGSCALE_SAMPLE
     :return: logc [bool]
     
     '''
-    X = X.values.flatten()
+    if hasattr(X, 'tocsr'): # sparse, stored values are sampled and the zeros added in proportion
+        size, nnz = X.shape[0] * X.shape[1], max(X.nnz, 1)
+        num  = min(size, max_values) if max_values else size
+        data = X.tocsr().data
+        data = data[::max(1, size // num)]
+        X = np.concatenate([data, np.zeros(int(round(data.size * (size - nnz) / float(nnz))), dtype = data.dtype)])
+    else:
+        step = max(1, X.size // max_values) if max_values else 1
+        X = X.values[::step].flatten()
     qx = np.percentile(X, [0, 25, 50, 75, 99, 100])
     logc = qx[4] >= 100 or (qx[5] - qx[0] >= 50 and qx[1] >= 0) or (qx[1] >= 0 and qx[1] <= 1 and qx[3] >= 1 and qx[3] <= 2)
     return (not logc)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+#title       : workqueue.py
+#description : Work queues handing chunks of multi_process to workers on many hosts.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : module
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load own and python modules
+
+import uuid
+import queue
+import threading
+import multiprocessing
+from time import sleep
+from multiprocessing.managers import BaseManager
+from modules.utils import *
+
+#-----------------------------------------------------
+# Seconds without any finished chunk before unfinished chunks are handed out again, and seconds between polls
+
+QUEUE_LEASE, QUEUE_POLL = 600, 0.05
+QUEUES, QUEUES_LOCK = {}, threading.Lock()
+LOCAL_HOSTS = ['localhost', '127.0.0.1', '::1']
+
+#-----------------------------------------------------
+
+class DirQueue(object):
+    '''
+    queue in a directory visible to every worker, e.g. on a shared filesystem, a chunk is claimed by an atomic rename
+
+    '''
+    def __init__(self, root):
+        self.root = root
+        for sub in ['tasks', 'claimed', 'results', 'shared']:
+            if not os.path.isdir(os.path.join(root, sub)): os.makedirs(os.path.join(root, sub))
+        self.shared_root = os.path.join(root, 'shared')
+
+    def write(self, sub, key, obj):
+        path = os.path.join(self.root, sub, key + '.pkl')
+        tmp  = '{0}.tmp-{1}-{2}'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as fp: pickle.dump(obj, fp, protocol = pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+
+    def read(self, path):
+        with open(path, 'rb') as fp: return pickle.load(fp)
+
+    def put(self, key, task):
+        self.write('tasks', key, task)
+
+    def get(self):
+        for name in sorted(os.listdir(os.path.join(self.root, 'tasks'))):
+            if not name.endswith('.pkl'): continue
+            claimed = os.path.join(self.root, 'claimed', name)
+            try:
+                os.rename(os.path.join(self.root, 'tasks', name), claimed)
+            except OSError: # claimed by another worker
+                continue
+            return name[0 : -4], self.read(claimed)
+        return None, None
+
+    def done(self, key, result):
+        self.write('results', key, result)
+        try:
+            os.remove(os.path.join(self.root, 'claimed', key + '.pkl'))
+        except OSError:
+            pass
+
+    def collect(self, keys):
+        results = {}
+        for key in keys:
+            path = os.path.join(self.root, 'results', key + '.pkl')
+            if not os.path.exists(path): continue
+            results[key] = self.read(path)
+            os.remove(path)
+        return results
+
+    def discard(self, keys):
+        for sub in ['tasks', 'claimed', 'results']:
+            for key in keys:
+                try:
+                    os.remove(os.path.join(self.root, sub, key + '.pkl'))
+                except OSError:
+                    pass
+
+class QueueManager(BaseManager):
+    pass
+
+def queue_authkey(host, serve = False):
+    '''
+    key of a TCP queue from MSEARCHER_AUTHKEY, chunks and results travel as pickles that run code when loaded
+    :param host: [str] host of the queue
+    :param serve: [bool] the coordinator draws a random key on a local host and passes it to its workers, default: False
+    :return: authkey [bytes]
+
+    '''
+    authkey = os.environ.get('MSEARCHER_AUTHKEY')
+    if authkey: return authkey.encode()
+    if not serve or host not in LOCAL_HOSTS:
+        raise ValueError('MSEARCHER_AUTHKEY must be set for the TCP queue on {0}, every host of it has to share the key'.format(host))
+    authkey = os.environ['MSEARCHER_AUTHKEY'] = uuid.uuid4().hex # inherited by the local workers
+    show_msg('>> Workers on this host join the TCP queue with MSEARCHER_AUTHKEY={0}'.format(authkey), logging.info)
+    return authkey.encode()
+
+class SocketQueue(object):
+    '''
+    queue served over TCP by the coordinator on localhost unless a host is given, workers connect with the MSEARCHER_AUTHKEY
+    key, shared frames are placed under MSEARCHER_SHARED which must be mounted at the same path on every host
+
+    '''
+    def __init__(self, address, serve = False):
+        host, port = address.rsplit(':', 1) if ':' in address else ('127.0.0.1', address)
+        authkey = queue_authkey(host, serve)
+        self.shared_root = os.environ.get('MSEARCHER_SHARED', SHARED_ROOT)
+        if self.shared_root and not os.path.isdir(self.shared_root): os.makedirs(self.shared_root)
+        self.lock, self.pending = threading.Lock(), {}
+        if serve:
+            self.tasks, self.results = queue.Queue(), queue.Queue()
+            QueueManager.register('tasks', callable = lambda: self.tasks)
+            QueueManager.register('results', callable = lambda: self.results)
+            server = QueueManager(address = (host, int(port)), authkey = authkey).get_server()
+            threading.Thread(target = server.serve_forever, daemon = True).start()
+        else:
+            QueueManager.register('tasks')
+            QueueManager.register('results')
+            manager = QueueManager(address = (host, int(port)), authkey = authkey)
+            manager.connect()
+            self.tasks, self.results = manager.tasks(), manager.results()
+
+    def put(self, key, task):
+        self.tasks.put((key, task))
+
+    def get(self):
+        try:
+            return self.tasks.get(timeout = 1)
+        except queue.Empty:
+            return None, None
+
+    def done(self, key, result):
+        self.results.put((key, result))
+
+    def collect(self, keys): # results of other jobs are kept for the threads waiting on them
+        with self.lock:
+            while True:
+                try:
+                    key, result = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                self.pending[key] = result
+            return dict((key, self.pending.pop(key)) for key in keys if key in self.pending)
+
+    def discard(self, keys): # results of chunks handed out twice are dropped
+        with self.lock:
+            for key in keys: self.pending.pop(key, None)
+
+def open_queue(spec, serve = False):
+    '''
+    open a queue from its address
+    :param spec: [str] dir:PATH or tcp:[HOST:]PORT, HOST defaults to localhost
+    :param serve: [bool] the coordinator serves a TCP queue, workers connect to it, default: False
+    :return: queue [DirQueue/SocketQueue]
+
+    '''
+    kind, address = spec.split(':', 1)
+    if kind == 'dir': return DirQueue(address)
+    if kind == 'tcp': return SocketQueue(address, serve)
+    raise ValueError('Unknown queue: {0}, dir:PATH or tcp:[HOST:]PORT expected'.format(spec))
+
+def work(spec, idle_exit = None):
+    '''
+    worker loop, chunks are run until the queue stays empty for idle_exit seconds
+    :param spec: [str] dir:PATH or tcp:[HOST:]PORT
+    :param idle_exit: [float] seconds without any chunk before exiting, default: None, run forever
+    :return: 0
+
+    '''
+    work_queue, idle = open_queue(spec), perf_counter()
+    while idle_exit is None or perf_counter() - idle < idle_exit:
+        key, task = work_queue.get()
+        if key is None:
+            sleep(QUEUE_POLL * 10)
+            continue
+        try:
+            result = ('ok', run_chunk(task))
+        except Exception:
+            result = ('error', __import__('traceback').format_exc())
+        work_queue.done(key, result)
+        idle = perf_counter()
+    return 0
+
+def coordinator(spec, nth):
+    '''
+    queue of the coordinator with nth local workers, opened once per process
+    :param spec: [str] dir:PATH or tcp:[HOST:]PORT
+    :param nth: [int] number of local workers, remote ones join with MSearcher.py --worker
+    :return: queue [DirQueue/SocketQueue]
+
+    '''
+    with QUEUES_LOCK:
+        if spec not in QUEUES:
+            work_queue = open_queue(spec, serve = True)
+            workers = [ multiprocessing.Process(target = work, args = (spec, ), daemon = True) for idx in range(nth) ]
+            for worker in workers: worker.start()
+            QUEUES[spec] = (work_queue, workers)
+        return QUEUES[spec][0]
+
+def close_queues():
+    for work_queue, workers in QUEUES.values():
+        for worker in workers: worker.terminate()
+    QUEUES.clear()
+
+atexit.register(close_queues)
+
+def queue_map(spec, sub_tasks, nth, lease = QUEUE_LEASE, done = None):
+    '''
+    run chunks through a queue and merge their results in chunk order, so the output matches a single-node run
+    :param spec: [str] dir:PATH or tcp:[HOST:]PORT
+    :param sub_tasks: [list] chunks of multi_process
+    :param nth: [int] number of local workers
+    :param lease: [float] seconds without any finished chunk before unfinished ones are handed out again, default: QUEUE_LEASE
+    :param done: [callable] called with the position and result of every chunk as soon as it finishes, default: None
+    :return: results [list] results of run_chunk in chunk order
+
+    '''
+    work_queue = coordinator(spec, nth)
+    job  = uuid.uuid4().hex[0 : 12]
+    keys = [ '{0}-{1:06d}'.format(job, idx) for idx in range(len(sub_tasks)) ]
+    for key, task in zip(keys, sub_tasks): work_queue.put(key, task)
+
+    tasks, results, last = dict(zip(keys, sub_tasks)), {}, perf_counter()
+    try:
+        while len(results) < len(keys):
+            finished = work_queue.collect([ key for key in keys if key not in results ])
+            results.update(finished)
+            for pos, key in enumerate(keys):
+                if done and key in finished and finished[key][0] == 'ok': done(pos, finished[key][1])
+            if finished:
+                last = perf_counter()
+            elif perf_counter() - last > lease: # workers lost, hand out the unfinished chunks again
+                for key in keys:
+                    if key not in results: work_queue.put(key, tasks[key])
+                last = perf_counter()
+            else:
+                sleep(QUEUE_POLL)
+    finally:
+        work_queue.discard(keys)
+    errors = [ results[key][1] for key in keys if results[key][0] == 'error' ]
+    if errors: raise RuntimeError('A queued chunk failed:\n' + errors[0])
+    return [ results[key][1] for key in keys ]
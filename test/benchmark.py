@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+#title       : benchmark.py
+#description : Benchmark MSearcher on seeded synthetic profiles and compare with a stored baseline.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : script
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import json
+import shlex
+import argparse
+import subprocess
+from time import time
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.utils     import *
+from modules.synthetic import synthetic_profile, write_synthetic, MODULE_SIZE
+
+#-----------------------------------------------------
+# Sweeps of genes, samples and query-set sizes
+
+MSEARCHER = os.path.join(ROOT, 'MSearcher.py')
+GRIDS = {
+        'quick' : {'genes' : [1000, 5000], 'samples' : [10, 100], 'queries' : [1, 5]},
+        'full'  : {'genes' : [1000, 10000, 30000, 60000], 'samples' : [10, 100, 1000, 5000], 'queries' : [1, 5, 20]}
+    }
+LOGS = log_infos()
+
+#-----------------------------------------------------
+
+def case_name(ngenes, nsamples, nquery):
+    return 'G{0}xS{1}xQ{2}'.format(ngenes, nsamples, nquery)
+
+def planted_recall(result_fil, module, query_genes):
+    '''
+    fraction of the planted module, query genes excluded, found among the top ranked genes of a search
+    :param result_fil: [str] result table written by MSearcher
+    :param module: [list] planted marker genes
+    :param query_genes: [list] query genes taken from the module
+    :return: recall [float]
+
+    '''
+    expected = set(module) - set(query_genes)
+    if not expected or not os.path.exists(result_fil): return None
+    top_genes = pd.read_csv(result_fil, sep = '\t', index_col = 0).index[0 : len(expected)]
+    return len(expected & set(top_genes)) / float(len(expected))
+
+def run_case(profile_fil, modules, ngenes, nsamples, nquery, work_dir, msearcher_args):
+    '''
+    search the first genes of the first planted module in a fresh process, timed stage by stage through the run report, a failed search raises
+    :param profile_fil: [str] synthetic profile
+    :param modules: [OrderedDict] planted marker modules
+    :param ngenes: [int] number of genes
+    :param nsamples: [int] number of samples
+    :param nquery: [int] number of query genes
+    :param work_dir: [str] directory of results and reports
+    :param msearcher_args: [list] extra options of MSearcher
+    :return: result [dict]
+
+    '''
+    name = case_name(ngenes, nsamples, nquery)
+    module = list(modules.values())[0]
+    query_genes = module[0 : nquery]
+    cmds = [
+            sys.executable, MSEARCHER, '--profile', profile_fil, '--query-genes', ','.join(query_genes),
+            '--outdir', work_dir, '--prefix', name, '--report', '--verbose', 'FALSE'
+        ] + msearcher_args
+    start = time()
+    status = subprocess.call(cmds)
+    elapsed = time() - start
+    if status: raise RuntimeError('{0} exited with status {1}: {2}'.format(name, status, ' '.join(cmds)))
+
+    with open(os.path.join(work_dir, name + '.report.json')) as fp: report = json.load(fp)
+    stages = {}
+    for record in report['stages']:
+        stages[record['name']] = stages.get(record['name'], 0) + record['wall_time']
+    rss = [ record['peak_rss_mb'] for record in report['stages'] if record.get('peak_rss_mb') ]
+    return {
+            'genes' : ngenes, 'samples' : nsamples, 'queries' : nquery, 'elapsed' : elapsed, 'stages' : stages,
+            'peak_rss_mb' : max([ val['self'] + val['children'] for val in rss ]) if rss else None,
+            'cells_per_second' : ngenes * nsamples / elapsed,
+            'genes_per_second' : ngenes / elapsed,
+            'recall' : planted_recall(os.path.join(work_dir, name + '.xls'), module, query_genes)
+        }
+
+def compare_baseline(results, baseline, tolerance = 0.2, min_seconds = 0.5):
+    '''
+    regressions of stage and end-to-end times, and of the planted module recall, against a baseline
+    :param results: [dict] results of run_case keyed by case name
+    :param baseline: [dict] results of an earlier run
+    :param tolerance: [float] allowed relative slowdown, default: 0.2
+    :param min_seconds: [float] slowdowns below this many seconds are ignored as noise, default: 0.5
+    :return: regressions [list] of (case, metric, baseline, current)
+
+    '''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline: continue
+        base = baseline[name]
+        timings = [('elapsed', base['elapsed'], result['elapsed'])] + [
+            (stage, base.get('stages', {}).get(stage), cur) for stage, cur in result.get('stages', {}).items() ]
+        for metric, base_val, cur_val in timings:
+            if base_val is not None and cur_val > base_val * (1 + tolerance) and cur_val - base_val > min_seconds:
+                regressions.append((name, metric, base_val, cur_val))
+        if base.get('recall') is not None and result.get('recall') is not None and result['recall'] < base['recall'] - 0.1:
+            regressions.append((name, 'recall', base['recall'], result['recall']))
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description = 'Benchmark MSearcher on seeded synthetic profiles with planted marker modules.')
+    parser.add_argument('--grid', help = 'Predefined sweep. DEFAULT: quick.', choices = sorted(GRIDS), default = 'quick')
+    parser.add_argument('--genes', help = 'Comma separated numbers of genes, overrides the grid.', type = str, default = None)
+    parser.add_argument('--samples', help = 'Comma separated numbers of samples, overrides the grid.', type = str, default = None)
+    parser.add_argument('--queries', help = 'Comma separated query-set sizes, overrides the grid.', type = str, default = None)
+    parser.add_argument('--seed', help = 'Seed of synthetic profiles. DEFAULT: 0.', type = int, default = 0)
+    parser.add_argument('--workdir', help = 'Directory of profiles and results. DEFAULT: temporary directory.', type = str, default = None)
+    parser.add_argument('--outfile', help = 'JSON file of results. DEFAULT: benchmark_results.json.', type = str, default = 'benchmark_results.json')
+    parser.add_argument('--baseline', help = 'JSON file of baseline results. DEFAULT: benchmark_baseline.json next to this script.',
+            type = str, default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json'))
+    parser.add_argument('--save-baseline', help = 'Store results as the new baseline instead of comparing.', action = 'store_true')
+    parser.add_argument('--skip-compare', help = 'Only measure, a missing baseline otherwise fails the run.', action = 'store_true')
+    parser.add_argument('--tolerance', help = 'Allowed relative slowdown against the baseline. DEFAULT: 0.2.', type = float, default = 0.2)
+    parser.add_argument('--min-seconds', help = 'Slowdowns below this many seconds are noise. DEFAULT: 0.5.', type = float, default = 0.5)
+    parser.add_argument('--msearcher-args', help = 'Extra options passed to MSearcher, e.g. "--nthreads 4".', type = str, default = '')
+    args = parser.parse_args()
+    for key in ['genes', 'samples', 'queries']:
+        vals = getattr(args, key)
+        setattr(args, key, [ int(val) for val in vals.split(',') ] if vals else GRIDS[args.grid][key])
+    return args
+
+def run():
+    args = parse_args()
+    work_dir = args.workdir if args.workdir else tempfile.mkdtemp(prefix = 'msearcher-bench-')
+    if not os.path.isdir(work_dir): os.makedirs(work_dir)
+    results = {}
+    try:
+        for ngenes in args.genes:
+            for nsamples in args.samples:
+                show_msg('>> Generating {0} genes x {1} samples'.format(ngenes, nsamples), LOGS.info)
+                profiles, modules = synthetic_profile(ngenes, nsamples, seed = args.seed)
+                profile_fil = write_synthetic(profiles, os.path.join(work_dir, 'G{0}xS{1}.npy'.format(ngenes, nsamples)))
+                del profiles
+                for nquery in args.queries:
+                    if nquery > MODULE_SIZE or not modules: continue
+                    result = run_case(profile_fil, modules, ngenes, nsamples, nquery, work_dir, shlex.split(args.msearcher_args))
+                    results[case_name(ngenes, nsamples, nquery)] = result
+                    show_msg('>> {0}: {1:.2f}s, {2} MB peak, recall {3}'.format(
+                        case_name(ngenes, nsamples, nquery), result['elapsed'], result.get('peak_rss_mb'), result.get('recall')), LOGS.info)
+    finally:
+        if not args.workdir: shutil.rmtree(work_dir, ignore_errors = True)
+
+    with open(args.outfile, 'w') as fp: json.dump(results, fp, indent = 2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fp: json.dump(results, fp, indent = 2)
+        show_msg('>> Baseline saved to {0}'.format(args.baseline), LOGS.info)
+        return 0
+    if args.skip_compare: return 0
+    if not os.path.exists(args.baseline):
+        show_msg('>> No baseline {0}, run with --save-baseline first or with --skip-compare'.format(args.baseline), LOGS.error)
+
+    with open(args.baseline) as fp: baseline = json.load(fp)
+    regressions = compare_baseline(results, baseline, args.tolerance, args.min_seconds)
+    for name, metric, base_val, cur_val in regressions:
+        show_msg('>> Regression {0} {1}: {2:.3f} -> {3:.3f}'.format(name, metric, base_val, cur_val), LOGS.warn)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(run())
@@ -10,3 +10,48 @@ python ../MSearcher.py --profile=$GSE19830 -q 1370434_a_at --prefix="GSE19830_Sh
 python ../MSearcher.py --profile=$GSE19830 -q 1370980_at --prefix="GSE19830_Shen_Orr-Lung-MSearcher-Results"
 
 
+# Single precision must match the double precision results within tolerance, compared on the candidates both keep.
+# Rounding the values to float32 moves the trailing PCA components, so gene counts and scores drift as much as for a double
+# profile perturbed by 6e-8. Weak genes with few overlapping markers can flip their P-values, significant genes cannot.
+compare_precision() {
+python - "$1" "$2" <<'PYEOF'
+import sys
+import pandas as pd
+double = pd.read_csv(sys.argv[1], sep = '\t', index_col = 0)
+single = pd.read_csv(sys.argv[2], sep = '\t', index_col = 0)
+common = double.index.intersection(single.index)
+assert len(common) >= 0.99 * len(double), 'Candidates differ: {0} of {1} shared'.format(len(common), len(double))
+sig_double, sig_single = set(double.index[double['FDR'] <= 0.05]), set(single.index[single['FDR'] <= 0.05])
+assert len(sig_double & sig_single) >= 0.9 * len(sig_double | sig_single), 'Significant genes differ: {0} and {1}'.format(len(sig_double), len(sig_single))
+double, single = double.loc[common], single.loc[common]
+rel = abs(single['Similarity'] - double['Similarity']) / abs(double['Similarity'])
+assert (rel <= 1e-2).mean() >= 0.99, 'Similarity differs beyond 1e-2 for {0} of {1} genes'.format((rel > 1e-2).sum(), len(rel))
+assert (rel <= 5e-2).all(), 'Similarity differs beyond 5e-2'
+sig = (double['FDR'] <= 0.05) | (single['FDR'] <= 0.05)
+assert (abs(single['Pvalue'] - double['Pvalue'])[sig] <= 5e-2).all(), 'P-values of significant genes differ beyond 0.05'
+assert len(set(double.sort_values('Similarity', ascending = False).index[0 : 100]) & set(single.sort_values('Similarity', ascending = False).index[0 : 100])) >= 95, 'Top 100 genes differ'
+print('>> Single precision matches double precision within tolerance: {0}'.format(sys.argv[2]))
+PYEOF
+}
+
+echo ">> GSE19830 single precision"
+
+python ../MSearcher.py --profile=$GSE19830 -q 1368161_a_at --precision=single --prefix="GSE19830_Shen_Orr-Liver-MSearcher-Results-single"
+compare_precision GSE19830_Shen_Orr-Liver-MSearcher-Results.xls GSE19830_Shen_Orr-Liver-MSearcher-Results-single.xls
+
+# Profiles of more than 50 samples are reduced by PCA, which runs in double precision for both.
+# Synthetic profiles are written in double precision, float32 values would be read identically by both modes.
+for noise in 0 0.15; do
+echo ">> Synthetic 80 samples single precision, noise $noise"
+
+python - $noise <<'PYEOF'
+import sys; sys.path.insert(0, '..')
+import numpy as np
+from modules.synthetic import synthetic_profile, write_synthetic
+write_synthetic(synthetic_profile(5000, 80, seed = 0, dtype = np.float64, noise = float(sys.argv[1]))[0], 'synthetic-S80.npy')
+PYEOF
+python ../MSearcher.py --profile=synthetic-S80.npy -q M0_0000,M0_0001 --prefix="synthetic-S80-$noise-MSearcher-Results"
+python ../MSearcher.py --profile=synthetic-S80.npy -q M0_0000,M0_0001 --precision=single --prefix="synthetic-S80-$noise-MSearcher-Results-single"
+compare_precision synthetic-S80-$noise-MSearcher-Results.xls synthetic-S80-$noise-MSearcher-Results-single.xls
+rm -f synthetic-S80.npy synthetic-S80.genes synthetic-S80.samples
+done
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#title       : test_approx.py
+#description : Approximate top genes re-ranked by their exact scores recall the exact top genes of reduced profiles.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import numpy as np
+import pytest
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.utils        import diff_dtype
+from modules.models       import similarity_lut, measure_similarity_block
+from modules.estimate_FDR import top_masks, rerank_masks, approx_top_masks, measure_recall
+from modules.synthetic    import synthetic_profile, write_synthetic
+import MSearcher
+
+#-----------------------------------------------------
+
+@pytest.fixture(scope = 'module')
+def reduced(tmpdir_factory):
+    profiles, modules = synthetic_profile(3000, 80, seed = 4, dtype = np.float64, noise = 0.15)
+    profile_fil = write_synthetic(profiles, str(tmpdir_factory.mktemp('approx').join('profile.npy')))
+    return MSearcher.preprocess_counts(profile_fil, ['M0_0000', 'M0_0001'], verbose = False)[0 : 2] + (modules, )
+
+def exact_masks(counts_ary, rows, top_num = 20):
+    return top_masks(measure_similarity_block(counts_ary[rows], counts_ary, similarity_lut(counts_ary.shape[0])), top_num)
+
+def test_rerank_masks(reduced):
+    gene_counts = reduced[1]
+    counts_ary, rows = np.asarray(gene_counts, dtype = diff_dtype(gene_counts.shape[0])), np.arange(0, 300, 30)
+    lut, expected = similarity_lut(counts_ary.shape[0]), exact_masks(counts_ary, rows)
+    cand_idxes = np.vstack([ np.where(mask)[0] for mask in expected ])
+    cand_idxes = np.hstack([cand_idxes, np.full((len(rows), 5), -1)]) # missing candidates of the index
+    assert np.array_equal(rerank_masks(counts_ary[rows], counts_ary, lut, 20, cand_idxes), expected)
+    cand_idxes[0, 3 : ] = -1 # too few candidates, scored over all genes
+    assert np.array_equal(rerank_masks(counts_ary[rows], counts_ary, lut, 20, cand_idxes), expected)
+
+def test_approx_recall(reduced):
+    gene_counts, modules = reduced[1], reduced[2]
+    counts_ary, rows = np.asarray(gene_counts, dtype = diff_dtype(gene_counts.shape[0])), np.arange(0, 2800, 100)
+    lut = similarity_lut(counts_ary.shape[0])
+    assert np.array_equal(approx_top_masks(counts_ary[rows], counts_ary, lut, 20, 1.0), exact_masks(counts_ary, rows))
+    assert measure_recall(gene_counts, approx = 1.0) == 1.0
+    rows = gene_counts.index.get_indexer([ gene for markers in modules.values() for gene in markers[0 : 10] ])
+    expected = exact_masks(counts_ary, rows) # markers lead the components, background genes only share noise
+    assert (approx_top_masks(counts_ary[rows], counts_ary, lut, 20, 0.5) & expected).sum() >= 0.95 * expected.sum()
+
+def test_approx_search_scores_exactly(reduced):
+    query_genes, gene_counts = reduced[0 : 2]
+    exact = MSearcher.score_queries(query_genes, gene_counts, False)[1]
+    approx = MSearcher.score_queries(query_genes, gene_counts, False, approx = 0.5)[1]
+    assert np.allclose(approx.values, exact.loc[approx.index].values) # candidates are re-ranked by their exact scores
+    top = lambda scores: set(scores.sort_values(ascending = False).index[0 : 100])
+    assert len(top(approx) & top(exact)) >= 95
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+#title       : test_batch.py
+#description : Batch mode reads named query sets from a manifest and gives each set the results of its own search.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import collections
+import numpy as np
+import pytest
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.parse_opts import get_query_sets
+from modules.synthetic  import synthetic_profile, write_synthetic
+import MSearcher
+
+#-----------------------------------------------------
+
+def manifest(tmpdir, text):
+    manifest_fil = str(tmpdir.join('query_sets.txt'))
+    with open(manifest_fil, 'w') as fp: fp.write(text)
+    return manifest_fil
+
+def test_get_query_sets(tmpdir):
+    query_sets = get_query_sets(manifest(tmpdir, '# name\tgenes\n\nB cells\tCD19, MS4A1 ,\r\nT cells\tCD3E\n'))
+    assert query_sets == collections.OrderedDict([('B cells', ['CD19', 'MS4A1']), ('T cells', ['CD3E'])])
+
+@pytest.mark.parametrize('text', ['B cells CD19,MS4A1\n', 'B cells\t , \n', 'B cells\tCD19\nB cells\tMS4A1\n'])
+def test_malformed_manifest(tmpdir, text):
+    with pytest.raises(ValueError):
+        get_query_sets(manifest(tmpdir, text))
+
+def test_search_batch_matches_single_searches(tmpdir):
+    profiles, modules = synthetic_profile(2000, 20, seed = 1)
+    gene_counts = MSearcher.preprocess_counts(write_synthetic(profiles, str(tmpdir.join('profile.npy'))), [], False)[1]
+    query_sets = collections.OrderedDict([ (name, genes[0 : 2]) for name, genes in list(modules.items())[0 : 2] ])
+    query_sets['missing'] = ['absent1', 'absent2']
+    search_sets = MSearcher.search_batch(query_sets, gene_counts, verbose = False, nthreads = 2, backend = 'thread')
+    assert list(search_sets) == list(query_sets)[0 : 2] # sets without genes in the profile are skipped
+    for name, search_res in search_sets.items():
+        expected = MSearcher.search_markers(query_sets[name], gene_counts, verbose = False, nthreads = 2, backend = 'thread')
+        assert search_res.equals(expected), name
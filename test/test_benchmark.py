@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#title       : test_benchmark.py
+#description : Synthetic profiles are reproducible per seed and the benchmark flags regressions against its baseline.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import json
+import subprocess
+import numpy  as np
+import pandas as pd
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'test'))
+
+from modules.synthetic  import synthetic_profile, write_synthetic
+from modules.parse_opts import read_profiles
+from benchmark          import compare_baseline, planted_recall
+
+#-----------------------------------------------------
+
+def test_synthetic_profile_seeded(tmpdir):
+    profiles, modules = synthetic_profile(1000, 12, seed = 3, noise = 0.15)
+    again, modules_again = synthetic_profile(1000, 12, seed = 3, noise = 0.15)
+    assert profiles.equals(again) and modules == modules_again
+    assert not profiles.equals(synthetic_profile(1000, 12, seed = 4, noise = 0.15)[0])
+    assert list(modules) == [ 'M{0}'.format(idx) for idx in range(5) ] and all(len(genes) == 50 for genes in modules.values())
+    assert len(synthetic_profile(120, 12, seed = 3)[1]) == 2 # modules fitting in the genes only
+    profile_fil = write_synthetic(profiles, str(tmpdir.join('profile.npy')))
+    assert read_profiles(profile_fil, np.float32).equals(profiles)
+
+def test_compare_baseline():
+    baseline = {'case' : {'elapsed' : 10.0, 'stages' : {'svd_filter' : 4.0, 'similarity' : 0.1}, 'recall' : 1.0}}
+    results = {'case' : {'elapsed' : 11.0, 'stages' : {'svd_filter' : 6.0, 'similarity' : 0.3}, 'recall' : 0.8}, 'new' : {'elapsed' : 99.0}}
+    regressions = compare_baseline(results, baseline, tolerance = 0.2, min_seconds = 0.5)
+    assert sorted(metric for name, metric, base_val, cur_val in regressions) == ['recall', 'svd_filter'] # similarity slowed by less than min_seconds
+
+def test_planted_recall(tmpdir):
+    result_fil = str(tmpdir.join('result.xls'))
+    pd.DataFrame({'Similarity' : [4, 3, 2, 1]}, index = ['M0_0001', 'G000001', 'M0_0002', 'M0_0003']).to_csv(result_fil, sep = '\t')
+    assert planted_recall(result_fil, ['M0_0000', 'M0_0001', 'M0_0002', 'M0_0003'], ['M0_0000']) == 2 / 3.0
+    assert planted_recall(str(tmpdir.join('missing.xls')), ['M0_0000', 'M0_0001'], ['M0_0000']) is None
+
+def test_missing_baseline_fails(tmpdir):
+    cmds = [sys.executable, os.path.join(ROOT, 'test', 'benchmark.py'), '--genes', '1000', '--samples', '10', '--queries', '3',
+        '--outfile', str(tmpdir.join('results.json')), '--baseline', str(tmpdir.join('baseline.json'))]
+    assert subprocess.call(cmds, stderr = subprocess.DEVNULL) == 1
+    assert subprocess.call(cmds + ['--skip-compare']) == 0
+    with open(str(tmpdir.join('results.json'))) as fp: results = json.load(fp)
+    assert results['G1000xS10xQ3']['recall'] == 1.0 and results['G1000xS10xQ3']['stages']
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+#title       : test_cache.py
+#description : Cached gene counts are keyed by the storage of the preprocessing, and unreadable entries are cached again.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import numpy as np
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.cache     import cache_entries, load_cache, save_cache, evict_cache, entry_size
+from modules.synthetic import synthetic_profile, write_synthetic
+import MSearcher
+
+#-----------------------------------------------------
+
+def profile_fil(tmpdir):
+    profiles, modules = synthetic_profile(2000, 20, seed = 3, dtype = np.float64)
+    return write_synthetic(profiles, str(tmpdir.join('profile.npy')))
+
+def test_storage_modes_cached_apart(tmpdir):
+    profile, cache_dir = profile_fil(tmpdir), str(tmpdir.join('cache'))
+    counts = MSearcher.load_counts(profile, [], cache_dir, verbose = False, nthreads = 1)[1]
+    counts_inplace = MSearcher.load_counts(profile, [], cache_dir, verbose = False, max_memory = 2 ** 30, nthreads = 1)[1]
+    assert len(cache_entries(cache_dir)) == 2 and counts_inplace.equals(counts)
+    assert MSearcher.load_counts(profile, [], cache_dir, verbose = False, nthreads = 1)[1].equals(counts)
+    assert len(cache_entries(cache_dir)) == 2
+
+def test_corrupt_entry_cached_again(tmpdir):
+    profile, cache_dir = profile_fil(tmpdir), str(tmpdir.join('cache'))
+    counts = MSearcher.load_counts(profile, [], cache_dir, verbose = False, nthreads = 1)[1].copy()
+    entry = cache_entries(cache_dir)[0]
+    with open(os.path.join(entry, 'values.npy'), 'wb') as fp: fp.write(b'\x93NUMPY')
+    assert load_cache(cache_dir, os.path.basename(entry)) is None and not os.path.exists(entry)
+    assert MSearcher.load_counts(profile, [], cache_dir, verbose = False, nthreads = 1)[1].equals(counts)
+    assert load_cache(cache_dir, os.path.basename(entry)).equals(counts)
+
+def test_eviction_keeps_latest(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    profiles = synthetic_profile(500, 10, seed = 3)[0]
+    for key in ['a', 'b', 'c']:
+        save_cache(cache_dir, key, profiles)
+        os.utime(os.path.join(cache_dir, key), (ord(key), ord(key)))
+    evict_cache(cache_dir, entry_size(os.path.join(cache_dir, 'c')) * 2)
+    assert [ os.path.basename(entry) for entry in cache_entries(cache_dir) ] == ['c', 'b']
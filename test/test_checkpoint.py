@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#title       : test_checkpoint.py
+#description : Checkpointed chunks are found again with another thread count, and unreadable ones are run again.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import numpy  as np
+import pandas as pd
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules            import utils
+from modules.utils      import multi_process, report_scope
+from modules.checkpoint import checkpoint_key, open_checkpoint, load_stage, save_stage
+
+#-----------------------------------------------------
+
+def row_sums(frame):
+    return frame.values.sum(axis = 1, keepdims = True)
+
+def run(frame, nth, checkpoint):
+    with report_scope() as report:
+        sums = multi_process(frame, row_sums, nth, True, backend = 'thread', checkpoint = checkpoint)
+    return sums.values[:, 0], report['tasks'][0]
+
+def test_resume_with_other_nthreads(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, 'CHECKPOINT_ROWS', 10)
+    frame, checkpoint = pd.DataFrame(np.arange(250.0).reshape(50, 5)), str(tmpdir.join('blocks'))
+    sums, task = run(frame, 2, checkpoint)
+    assert np.array_equal(sums, frame.values.sum(axis = 1)) and task['resumed'] == 0
+    assert len(os.listdir(checkpoint)) == 5
+
+    sums, task = run(frame, 3, checkpoint)
+    assert np.array_equal(sums, frame.values.sum(axis = 1)) and task['resumed'] == 5
+
+def test_corrupt_block_runs_again(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, 'CHECKPOINT_ROWS', 10)
+    frame, checkpoint = pd.DataFrame(np.arange(250.0).reshape(50, 5)), str(tmpdir.join('blocks'))
+    run(frame, 2, checkpoint)
+    with open(os.path.join(checkpoint, 'row_sums-20-30.pkl'), 'wb') as fp: fp.write(b'\x80\x05truncated')
+    sums, task = run(frame, 2, checkpoint)
+    assert np.array_equal(sums, frame.values.sum(axis = 1)) and task['resumed'] == 4
+
+def test_corrupt_stage_and_changed_inputs(tmpdir):
+    profile_fil = str(tmpdir.join('profile.txt'))
+    with open(profile_fil, 'w') as fp: fp.write('Gene\ts1\ng1\t1\n')
+    ckpt_dir = open_checkpoint(str(tmpdir.join('ckpt')), checkpoint_key([profile_fil], top = 20))
+    save_stage(ckpt_dir, 'scores', {'g1' : 1.0})
+    assert load_stage(ckpt_dir, 'scores') == {'g1' : 1.0}
+    with open(os.path.join(ckpt_dir, 'scores.pkl'), 'wb') as fp: fp.write(b'')
+    assert load_stage(ckpt_dir, 'scores') is None
+
+    save_stage(ckpt_dir, 'scores', {'g1' : 1.0})
+    with open(profile_fil, 'a') as fp: fp.write('g2\t2\n')
+    ckpt_dir = open_checkpoint(ckpt_dir, checkpoint_key([profile_fil], top = 20))
+    assert load_stage(ckpt_dir, 'scores') is None
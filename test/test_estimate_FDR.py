@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#title       : test_estimate_FDR.py
+#description : Decoys scored in blocks by lookup tables give the P-values of one decoy scored at a time, lazily evaluated candidates those of all candidates.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import numpy  as np
+import pandas as pd
+from scipy import stats
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.estimate_FDR import phyper_test, decoy_tops, top_masks, estimate_FDR
+from modules.synthetic    import synthetic_profile, write_synthetic
+import MSearcher
+
+#-----------------------------------------------------
+
+def ranked_counts(ngenes = 400, nsamples = 12):
+    rng = np.random.RandomState(0)
+    values = np.column_stack([ rng.permutation(ngenes) for idx in range(nsamples) ])
+    return pd.DataFrame(values, index = [ 'g{0:03d}'.format(idx) for idx in range(ngenes) ])
+
+def phyper_reference(gene_counts, tar_genes, top_num = 20):
+    gene_num, names, pvals = gene_counts.shape[0], gene_counts.index.values, []
+    for decoy in gene_counts.values: # one decoy at a time, as estimate_FDR scored them before
+        scores = -np.log10((np.abs(gene_counts.values - decoy) + 1) / (gene_num + 1.0)).sum(axis = 1)
+        ovp = np.isin(tar_genes, names[scores.argsort()[::-1][0 : top_num]])
+        common, upst = ovp.sum(), np.sum(np.arange(1, top_num + 1)[ovp] <= top_num / 2)
+        pval = 1 - stats.hypergeom.cdf(common - 1, gene_num, len(tar_genes), top_num)
+        pvals.append([pval, common / (top_num * 2.0 - common), upst / (common - upst + 1.0), common])
+    return np.array(pvals)
+
+def test_phyper_blocks_match_reference():
+    gene_counts = ranked_counts()
+    tar_genes = gene_counts.index.values[[5, 17, 42, 99, 123, 200, 201, 250, 300, 301, 302, 310, 320, 333, 350, 360, 370, 380, 390, 399]]
+    expected = phyper_reference(gene_counts, tar_genes)
+    for block_cells in [400 * 12, 400 * 12 * 7, 2 ** 22]: # one decoy, uneven and single blocks
+        assert np.allclose(phyper_test(gene_counts, gene_counts, tar_genes, block_cells = block_cells), expected, rtol = 1e-9, atol = 1e-12)
+
+def test_decoy_tops_match_phyper():
+    gene_counts = ranked_counts()
+    tar_genes = gene_counts.index.values[0 : 20]
+    masks = decoy_tops(gene_counts, gene_counts)
+    assert (masks.sum(axis = 1) == 20).all()
+    assert np.array_equal(masks[:, 0 : 20].sum(axis = 1), phyper_test(gene_counts, gene_counts, tar_genes)[:, 3])
+
+def test_top_masks_ties():
+    scores = np.array([[3, 1, 2, 2, 2, 0], [5, 4, 3, 2, 1, 0]], dtype = float)
+    masks = top_masks(scores, 3)
+    assert masks.sum(axis = 1).tolist() == [3, 3] and masks[0, 0] and masks[1, 0 : 3].all()
+
+def test_estimate_FDR_candidate_order():
+    gene_counts = ranked_counts(300)
+    scores = pd.Series(np.linspace(1, 0, 300), index = gene_counts.index)
+    pvalues = estimate_FDR(scores, gene_counts, gene_counts.index, ncpus = 2, backend = 'thread')
+    order = np.random.RandomState(1).permutation(300) # candidates listed in another order get the same rows
+    shuffled = estimate_FDR(scores.iloc[order], gene_counts.iloc[order], gene_counts.index[order], ncpus = 2, backend = 'thread')
+    assert np.allclose(shuffled.values, pvalues.values[order])
+
+def test_lazy_fdr_matches_full(tmpdir):
+    profiles, modules = synthetic_profile(3000, 20, seed = 1)
+    profile_fil = write_synthetic(profiles, str(tmpdir.join('profile.npy')))
+    query_genes, gene_counts = MSearcher.preprocess_counts(profile_fil, list(modules.values())[0][0 : 3], verbose = False)[0 : 2]
+    full = MSearcher.search_markers(query_genes, gene_counts, verbose = False, nthreads = 2, backend = 'thread')
+    lazy = MSearcher.search_markers(query_genes, gene_counts, verbose = False, nthreads = 2, backend = 'thread', fdr = 0.05)
+    evaluated = lazy.index[lazy['Evaluated']]
+    assert 0 < len(evaluated) < len(lazy) and lazy.loc[~lazy['Evaluated'], 'Pvalue'].isna().all()
+    assert np.allclose(lazy.loc[evaluated, 'Pvalue'], full.loc[evaluated, 'Pvalue'])
+    assert (lazy.loc[evaluated, 'FDR'] >= full.loc[evaluated, 'FDR'] - 1e-12).all() # skipped candidates count as p = 1
+    sig_lazy, sig_full = set(lazy.index[lazy['FDR'] <= 0.05]), set(full.index[full['FDR'] <= 0.05])
+    assert sig_lazy <= sig_full and len(sig_lazy) >= 0.9 * len(sig_full)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#title       : test_incremental.py
+#description : Warm-started PCA of appended samples keeps the variance and top genes of a rebuild, or falls back to it.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import numpy  as np
+import pandas as pd
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules             import models
+from modules.synthetic   import synthetic_profile
+from modules.incremental import build_state, append_state, state_normalized
+from modules.preprocess  import filter_lowexps
+import MSearcher
+
+#-----------------------------------------------------
+
+def appended_state(svd_params, monkeypatch, first = 60, step = 15):
+    profiles, modules = synthetic_profile(3000, 150, seed = 5, dtype = np.float64, noise = 0.15, module_size = 120)
+    warm_pca, warm = models.warm_pca, []
+    def traced(*args, **kargs):
+        result = warm_pca(*args, **kargs)
+        warm.append(result[0] is not None)
+        return result
+    monkeypatch.setattr(models, 'warm_pca', traced)
+    state = build_state(profiles.iloc[:, 0 : first])
+    for start in range(first, profiles.shape[1] + 1, step):
+        if start > first: state = append_state(state, profiles.iloc[:, start - step : start])
+        basis, counts = MSearcher.state_profile_counts(state, [], False, svd_params = svd_params)
+        state.update(basis = basis, counts = counts)
+    rebuild = MSearcher.state_profile_counts(dict(state, basis = None), [], False, svd_params = svd_params)
+    return state, rebuild, warm, list(modules.values())[0]
+
+def captured(state, basis):
+    profiles_sub = filter_lowexps(state_normalized(state), [])
+    values = profiles_sub.sub(profiles_sub.mean(axis = 1), axis = 0).divide(profiles_sub.std(axis = 1), axis = 0).values
+    values = values - values.mean(axis = 0)
+    return np.sum(basis.values ** 2) / np.sum(values ** 2)
+
+def top_genes(gene_counts, markers, top = 100):
+    return set(MSearcher.score_queries(markers[0 : 2], gene_counts, False)[1].sort_values(ascending = False).index[0 : top])
+
+def test_warm_pca_matches_rebuild(monkeypatch):
+    state, (basis, gene_counts), warm, markers = appended_state({'n_components' : 5}, monkeypatch)
+    assert all(warm) and len(warm) == 6
+    assert captured(state, state['basis']) >= 0.995 * captured(state, basis)
+    tops, tops_rebuild = top_genes(state['counts'], markers), top_genes(gene_counts, markers)
+    assert tops <= set(markers) and tops_rebuild <= set(markers)
+    assert len(tops & tops_rebuild) >= 90 # markers of a module are alike, their order within it is not meaningful
+
+def test_unsettled_warm_pca_rebuilds():
+    rng = np.random.RandomState(0) # noise has no leading components for a warm start to settle on
+    profiles, basis = pd.DataFrame(rng.lognormal(4, 1, (2000, 80))), rng.normal(size = (2000, 20))
+    assert models.warm_pca(profiles.values, basis, 20)[0] is None
+    rebuild = models.svd_filter(profiles, n_components = 20)
+    assert models.svd_filter(profiles, n_components = 20, basis = basis).equals(rebuild)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+#title       : test_index.py
+#description : The similarity index serves only the counts it was built from, and is rebuilt when stale or unreadable.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import numpy as np
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.index     import load_index
+from modules.models    import similarity_lut, measure_similarity_block
+from modules.synthetic import synthetic_profile, write_synthetic
+import MSearcher
+
+#-----------------------------------------------------
+
+def gene_counts(tmpdir, seed = 1):
+    profiles = synthetic_profile(1500, 20, seed = seed, noise = 0.15)[0]
+    return MSearcher.preprocess_counts(write_synthetic(profiles, str(tmpdir.join('profile-{0}.npy'.format(seed)))), [], False)[1]
+
+def test_index_neighbors_exact(tmpdir):
+    counts = gene_counts(tmpdir)
+    index, built = load_index(counts, str(tmpdir.join('index')), 50, 2, 'thread')
+    assert built and index.top_k == 50
+    lut = similarity_lut(counts.shape[0])
+    for gene in counts.index[0 : 1500 : 300]:
+        scores = measure_similarity_block(counts.loc[[gene]].values.astype(np.int32), counts.values.astype(np.int32), lut)[0]
+        assert np.allclose(np.sort(scores)[::-1][0 : 50], index.top(gene).values, rtol = 1e-6)
+    assert not load_index(counts, str(tmpdir.join('index')), 50, 2, 'thread')[1]
+
+def test_stale_index_rebuilt(tmpdir):
+    index_dir = str(tmpdir.join('index'))
+    load_index(gene_counts(tmpdir), index_dir, 50, 2, 'thread')
+    counts = gene_counts(tmpdir, seed = 2)
+    index, built = load_index(counts, index_dir, 50, 2, 'thread')
+    assert built and index.genes.equals(counts.index)
+    assert load_index(counts, index_dir, 100, 2, 'thread')[1] # more neighbors than kept
+
+def test_corrupt_index_rebuilt(tmpdir):
+    counts, index_dir = gene_counts(tmpdir), str(tmpdir.join('index'))
+    load_index(counts, index_dir, 50, 2, 'thread')
+    with open(os.path.join(index_dir, 'meta.pkl'), 'wb') as fp: fp.write(b'\x80\x05')
+    index, built = load_index(counts, index_dir, 50, 2, 'thread')
+    assert built and index.top_k == 50
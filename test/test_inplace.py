@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#title       : test_inplace.py
+#description : In-place preprocessing within a memory budget shares the values it reads and lowers the stage peaks.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.utils      import report_scope
+from modules.synthetic  import synthetic_profile, write_synthetic
+from modules.parse_opts import read_values
+from modules.preprocess import quantile_normalized, quantile_normalized_inplace, filter_lowexps, filter_lowexps_inplace
+import MSearcher
+
+#-----------------------------------------------------
+
+def profile_fil(tmpdir, ngenes = 3000, nsamples = 60):
+    profiles, modules = synthetic_profile(ngenes, nsamples, seed = 7, dtype = np.float64)
+    return write_synthetic(profiles, str(tmpdir.join('profile.npy'))), list(modules.values())[0][0 : 3]
+
+def traced_peaks(profile, query_genes, max_memory):
+    tracemalloc.start()
+    try:
+        with report_scope() as report:
+            counts = MSearcher.preprocess_counts(profile, query_genes, verbose = False, max_memory = max_memory, nthreads = 1)[1]
+    finally:
+        tracemalloc.stop()
+    return counts, dict((record['name'], record['traced_peak_mb']) for record in report['stages'])
+
+def test_read_values_writable(tmpdir):
+    profile, query_genes = profile_fil(tmpdir)
+    values, genes, samples = read_values(profile)
+    assert values.flags.writeable and values.shape == (len(genes), len(samples))
+
+def test_inplace_shares_values(tmpdir):
+    profile, query_genes = profile_fil(tmpdir)
+    values, genes, samples = read_values(profile, np.float64)
+    expected = quantile_normalized(pd.DataFrame(values.copy(), index = genes))
+    profiles_norm = quantile_normalized_inplace(values, genes)
+    assert np.shares_memory(profiles_norm.values, values)
+    assert np.allclose(profiles_norm.values, expected.values, rtol = 1e-12)
+
+    expected_sub = filter_lowexps(profiles_norm.copy(), query_genes)
+    profiles_sub = filter_lowexps_inplace(values, genes, query_genes)
+    assert np.shares_memory(profiles_sub.values, values)
+    assert profiles_sub.index.equals(expected_sub.index)
+    assert np.array_equal(profiles_sub.values, expected_sub.values)
+
+def test_inplace_lowers_stage_peaks(tmpdir):
+    profile, query_genes = profile_fil(tmpdir)
+    MSearcher.preprocess_counts(profile, query_genes, verbose = False, nthreads = 1) # lazy imports are not traced
+    counts, peaks = traced_peaks(profile, query_genes, None)
+    counts_inplace, peaks_inplace = traced_peaks(profile, query_genes, 2 ** 30)
+    assert counts_inplace.equals(counts)
+    for name in ['quantile_normalized', 'filter_lowexps', 'svd_filter']:
+        assert peaks_inplace[name] < peaks[name], name
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#title       : test_meta.py
+#description : The meta-search runs datasets within a memory budget, skips failed ones and combines their P-values.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import time
+import collections
+import numpy  as np
+import pandas as pd
+from scipy.stats import combine_pvalues
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.meta      import schedule, consensus_ranking
+from modules.synthetic import synthetic_profile, write_synthetic
+import MSearcher
+
+#-----------------------------------------------------
+
+def timed_job(log_dir, name, seconds):
+    if name == 'broken': raise RuntimeError('dataset failed')
+    start = time.time()
+    time.sleep(seconds)
+    with open(os.path.join(log_dir, name), 'w') as fp: fp.write('{0} {1}'.format(start, time.time()))
+    return name
+
+def overlapping(log_dir, first, second):
+    (start1, end1), (start2, end2) = [ map(float, open(os.path.join(log_dir, name)).read().split()) for name in [first, second] ]
+    return start1 < end2 and start2 < end1
+
+def test_schedule_within_memory_budget(tmpdir):
+    log_dir = str(tmpdir)
+    jobs = [ ('small1', 2, (log_dir, 'small1', 0.3)), ('large', 6, (log_dir, 'large', 0.3)), ('small2', 2, (log_dir, 'small2', 0.3)),
+        ('broken', 1, (log_dir, 'broken', 0)) ]
+    results = schedule(jobs, timed_job, 3, memory_budget = 6)
+    assert list(results.items()) == [('small1', 'small1'), ('large', 'large'), ('small2', 'small2'), ('broken', None)]
+    assert not overlapping(log_dir, 'large', 'small1') and not overlapping(log_dir, 'large', 'small2')
+    assert overlapping(log_dir, 'small1', 'small2')
+
+def test_consensus_ranking():
+    search_sets = collections.OrderedDict([
+            ('a', pd.DataFrame({'Similarity' : [0.9, 0.5], 'Pvalue' : [1e-4, 0.2]}, index = ['g1', 'g2'])),
+            ('b', pd.DataFrame({'Similarity' : [0.7, 0.3], 'Pvalue' : [1e-3, np.nan]}, index = ['g1', 'g3']))
+        ])
+    consensus = consensus_ranking(search_sets)
+    assert list(consensus.index) == ['g1', 'g2', 'g3']
+    assert np.isclose(consensus.loc['g1', 'Pvalue'], combine_pvalues([1e-4, 1e-3])[1])
+    assert np.isclose(consensus.loc['g2', 'Pvalue'], combine_pvalues([0.2, 1])[1]) # missing from a dataset counts as P-value 1
+    assert consensus.loc['g3', 'Pvalue'] == 1 and consensus.loc['g1', 'nDatasets'] == 2
+    assert np.isclose(consensus.loc['g1', 'Similarity'], 0.8)
+
+def test_meta_search_skips_datasets_without_queries(tmpdir):
+    datasets = collections.OrderedDict()
+    for seed in [1, 2]:
+        profiles, modules = synthetic_profile(1500, 20, seed = seed)
+        datasets['d{0}'.format(seed)] = write_synthetic(profiles, str(tmpdir.join('d{0}.npy'.format(seed))))
+    profiles.index = [ 'other{0}'.format(idx) for idx in range(profiles.shape[0]) ]
+    datasets['other'] = write_synthetic(profiles, str(tmpdir.join('other.npy')))
+    outfile = str(tmpdir.join('meta'))
+    consensus = MSearcher.meta_search(datasets, list(modules.values())[0][0 : 2], outfile, False, nthreads = 2, jobs = 2)
+    assert [ col for col in consensus.columns if col.startswith('Pvalue.') ] == ['Pvalue.d1', 'Pvalue.d2']
+    assert os.path.exists(outfile + '-d1.xls') and not os.path.exists(outfile + '-other.xls')
+    assert consensus.index[0] in list(modules.values())[0]
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#title       : test_outofcore.py
+#description : Out-of-core preprocessing streams memory-mapped columns to the same gene counts as in memory.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.utils      import report_scope
+from modules.synthetic  import synthetic_profile, write_synthetic
+from modules.parse_opts import read_profiles
+from modules.preprocess import quantile_normalized, quantile_normalized_ooc, filter_lowexps, filter_lowexps_ooc
+import MSearcher
+
+#-----------------------------------------------------
+
+def profile_fil(tmpdir, ngenes = 3000, nsamples = 60):
+    profiles, modules = synthetic_profile(ngenes, nsamples, seed = 3, dtype = np.float64)
+    return write_synthetic(profiles, str(tmpdir.join('profile.npy'))), list(modules.values())[0][0 : 3]
+
+def memory_mapped(values):
+    while values is not None and not isinstance(values, np.memmap): values = values.base
+    return values is not None
+
+def test_ooc_matches_in_memory(tmpdir):
+    profile, query_genes = profile_fil(tmpdir)
+    profiles = read_profiles(profile, np.float64, str(tmpdir)) # memory-mapped
+    assert memory_mapped(profiles.values)
+    expected = quantile_normalized(pd.DataFrame(np.array(profiles.values), index = profiles.index))
+    profiles_norm = quantile_normalized_ooc(profiles, str(tmpdir.join('profiles_norm.npy')))
+    assert memory_mapped(profiles_norm.values) and np.allclose(profiles_norm.values, expected.values, rtol = 1e-12)
+
+    expected_sub = filter_lowexps(expected, query_genes)
+    profiles_sub = filter_lowexps_ooc(profiles_norm, query_genes)
+    assert profiles_sub.index.equals(expected_sub.index)
+    assert np.allclose(profiles_sub.values, expected_sub.values, rtol = 1e-12)
+
+def test_ooc_gene_counts(tmpdir):
+    profile, query_genes = profile_fil(tmpdir)
+    counts = MSearcher.preprocess_counts(profile, query_genes, verbose = False, nthreads = 1)[1]
+    with report_scope() as report:
+        counts_ooc = MSearcher.preprocess_counts(profile, query_genes, verbose = False, out_of_core = True, nthreads = 1)[1]
+    stages = dict((record['name'], record) for record in report['stages'])
+    assert stages['quantile_normalized'].get('out_of_core') and stages['filter_lowexps'].get('out_of_core')
+    assert counts_ooc.equals(counts)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#title       : test_parse_opts.py
+#description : Profile readers stream text into preallocated values and keep the first of duplicated genes.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import gzip
+import shutil
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pytest
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.parse_opts import read_text, read_text_memmap, read_profiles, profile_format
+
+#-----------------------------------------------------
+
+def text_profile(tmpdir, ngenes = 5000, nsamples = 40, sep = '\t'):
+    rng = np.random.RandomState(0)
+    profiles = pd.DataFrame(rng.lognormal(4, 1, (ngenes, nsamples)), index = [ 'g{0}'.format(idx) for idx in range(ngenes) ],
+        columns = [ 's{0}'.format(idx) for idx in range(nsamples) ])
+    profiles.index.name = 'Gene'
+    duplicated = profiles.iloc[[3, ngenes // 2]] * 2 # later rows of a gene are dropped
+    profile_fil = str(tmpdir.join('profile.txt'))
+    pd.concat([profiles, duplicated]).to_csv(profile_fil, sep = sep)
+    return profile_fil, profiles
+
+def test_read_text_drops_duplicates(tmpdir):
+    for sep in ['\t', ',']:
+        profile_fil, expected = text_profile(tmpdir, sep = sep)
+        profiles = read_text(profile_fil, np.float64, chunk_rows = 1000)
+        assert profiles.index.equals(expected.index) and list(profiles.columns) == list(expected.columns)
+        assert np.allclose(profiles.values, expected.values, rtol = 1e-12)
+        assert read_text_memmap(profile_fil, str(tmpdir), np.float64, chunk_rows = 1000).equals(profiles)
+
+def test_read_text_single_copy(tmpdir):
+    peaks = []
+    for ngenes in [4000, 8000]: # parser buffers cost the same for both, so only the values account for the growth of the peak
+        profile_fil = text_profile(tmpdir.mkdir(str(ngenes)), ngenes, 200)[0]
+        read_text(profile_fil, np.float64, chunk_rows = 500)
+        tracemalloc.start()
+        try:
+            profiles = read_text(profile_fil, np.float64, chunk_rows = 500)
+            peaks.append((profiles.values.nbytes, tracemalloc.get_traced_memory()[1]))
+        finally:
+            tracemalloc.stop()
+    growth = float(peaks[1][1] - peaks[0][1]) / (peaks[1][0] - peaks[0][0])
+    assert growth < 1.5, 'chunks held next to their concatenation'
+
+def test_read_profiles_text(tmpdir):
+    profile_fil, expected = text_profile(tmpdir)
+    assert read_profiles(profile_fil, np.float64).index.equals(expected.index)
+
+def test_formats_by_magic_bytes(tmpdir):
+    profile_fil, expected = text_profile(tmpdir, ngenes = 300)
+    expected = expected.astype(np.float32)
+    with open(profile_fil, 'rb') as fp, gzip.open(profile_fil + '.gz', 'wb') as gz: shutil.copyfileobj(fp, gz)
+    np.savez(str(tmpdir.join('profile.npz')), values = expected.values, genes = expected.index.values, samples = expected.columns.values)
+    shutil.copy(profile_fil, str(tmpdir.join('profile.bin'))) # the extension is not used
+    for fil, fmt in [(profile_fil, 'text'), (profile_fil + '.gz', 'text'), (str(tmpdir.join('profile.bin')), 'text'), (str(tmpdir.join('profile.npz')), 'npz')]:
+        assert profile_format(fil) == fmt, fil
+    assert read_profiles(profile_fil + '.gz', np.float32).equals(read_profiles(profile_fil, np.float32))
+    assert read_profiles(str(tmpdir.join('profile.npz')), np.float32).equals(expected)
+
+def test_parquet_profile(tmpdir):
+    pytest.importorskip('pyarrow')
+    profile_fil, expected = text_profile(tmpdir, ngenes = 300)
+    expected.reset_index().to_parquet(str(tmpdir.join('profile.pq')))
+    profiles = read_profiles(str(tmpdir.join('profile.pq')), np.float64)
+    assert profile_format(str(tmpdir.join('profile.pq'))) == 'parquet' and list(profiles.index) == list(expected.index)
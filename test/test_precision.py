@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#title       : test_precision.py
+#description : Gene counts take the smallest unsigned dtype and single precision searches match double precision.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import numpy as np
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.utils     import rank_dtype, diff_dtype, report_scope
+from modules.synthetic import synthetic_profile, write_synthetic
+import MSearcher
+
+#-----------------------------------------------------
+
+QUERY_GENES = ['M0_0000', 'M0_0001']
+
+def search(profile_fil, precision):
+    with report_scope() as report:
+        query_genes, gene_counts, genes = MSearcher.preprocess_counts(profile_fil, QUERY_GENES, verbose = False, precision = precision, nthreads = 2)
+    search_res = MSearcher.search_markers(query_genes, gene_counts, verbose = False, nthreads = 2, backend = 'thread')
+    return gene_counts, search_res, dict((record['name'], record) for record in report['stages'])
+
+def test_rank_dtype():
+    assert rank_dtype(65535) == np.uint16 and rank_dtype(65536) == np.uint32
+    assert diff_dtype(65535) == np.int32
+
+def test_single_matches_double(tmpdir):
+    profiles = synthetic_profile(5000, 80, seed = 0, dtype = np.float64, noise = 0.15)[0]
+    profile_fil = write_synthetic(profiles, str(tmpdir.join('profile.npy')))
+    counts_double, double, stages_double = search(profile_fil, 'double')
+    counts_single, single, stages_single = search(profile_fil, 'single')
+    assert stages_double['read_profiles']['dtype'] == 'float64' and stages_single['read_profiles']['dtype'] == 'float32'
+    assert counts_double.values.dtype == counts_single.values.dtype == np.uint16
+
+    # the tolerances of compare_precision in test.bash
+    common = double.index.intersection(single.index)
+    assert len(common) >= 0.99 * len(double)
+    sig_double, sig_single = set(double.index[double['FDR'] <= 0.05]), set(single.index[single['FDR'] <= 0.05])
+    assert len(sig_double & sig_single) >= 0.9 * len(sig_double | sig_single)
+    double, single = double.loc[common], single.loc[common]
+    rel = abs(single['Similarity'] - double['Similarity']) / abs(double['Similarity'])
+    assert (rel <= 1e-2).mean() >= 0.99 and (rel <= 5e-2).all()
+    sig = (double['FDR'] <= 0.05) | (single['FDR'] <= 0.05)
+    assert (abs(single['Pvalue'] - double['Pvalue'])[sig] <= 5e-2).all()
+    top = lambda search_res: set(search_res.sort_values('Similarity', ascending = False).index[0 : 100])
+    assert len(top(double) & top(single)) >= 95
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#title       : test_preprocess.py
+#description : Column blocks normalized across threads give the serial results, whatever the number of threads.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import numpy  as np
+import pandas as pd
+from scipy import stats
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.utils      import is_logscale
+from modules.preprocess import COLUMN_BLOCK, column_map, query_rows, quantile_normalized, filter_lowexps
+from modules.synthetic  import synthetic_profile, write_synthetic
+import MSearcher
+
+#-----------------------------------------------------
+
+def profiles(ngenes = 2000, nsamples = 3 * COLUMN_BLOCK + 7):
+    rng = np.random.RandomState(0)
+    return pd.DataFrame(rng.lognormal(4, 1.5, (ngenes, nsamples)).round(1), index = [ 'g{0}'.format(idx) for idx in range(ngenes) ]) # rounded, with ties
+
+def test_column_map_block_order():
+    values = profiles().values
+    serial = column_map(lambda start, end: (start, end), values, 1)
+    assert serial == column_map(lambda start, end: (start, end), values, 4)
+    assert serial[0] == (0, COLUMN_BLOCK) and serial[-1] == (3 * COLUMN_BLOCK, values.shape[1])
+
+def test_quantile_normalized_threads():
+    frame = profiles()
+    values = frame.values
+    quantiles = np.mean(np.sort(values, axis = 0), axis = 1) # the single-threaded reference of ranks through rankdata
+    expected = quantiles[np.apply_along_axis(stats.rankdata, 0, values).astype(int) - 1]
+    serial = quantile_normalized(frame, 1)
+    assert np.allclose(serial.values, expected, rtol = 1e-12) and serial.index.equals(frame.index)
+    assert quantile_normalized(frame, 4).equals(serial)
+
+def test_filter_lowexps_threads():
+    frame = profiles()
+    low = frame.index[np.log2(frame + 1).sum(axis = 1).argsort()[0 : 3]].tolist() # below the expression cutoff, kept as query genes
+    serial = filter_lowexps(frame, low + ['missing'], nthreads = 1)
+    assert serial.equals(filter_lowexps(frame, low + ['missing'], nthreads = 4))
+    assert set(low) <= set(serial.index) and len(filter_lowexps(frame, [], nthreads = 1)) < len(serial)
+
+def test_query_rows():
+    genes = pd.Index([ 'g{0}'.format(idx) for idx in range(100) ])
+    assert query_rows(genes, ['g7', 'missing', 'g42']).tolist() == [7, 42]
+    assert query_rows(genes, []).tolist() == []
+
+def test_is_logscale_sampled():
+    frame = profiles()
+    for data in [frame, np.log2(frame + 1)]:
+        assert is_logscale(data, 10 ** 3) == is_logscale(data, None)
+    assert not is_logscale(frame, 10 ** 3) and is_logscale(np.log2(frame + 1), 10 ** 3)
+
+def test_preprocess_counts_threads(tmpdir):
+    profile_fil = write_synthetic(synthetic_profile(3000, 150, seed = 9, dtype = np.float64)[0], str(tmpdir.join('profile.npy')))
+    serial = MSearcher.preprocess_counts(profile_fil, [], verbose = False, nthreads = 1)[1]
+    assert MSearcher.preprocess_counts(profile_fil, [], verbose = False, nthreads = 4)[1].equals(serial)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#title       : test_queries.py
+#description : Query genes are scored in bounded blocks and large query sets split into the modules planted in the profile.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import collections
+import numpy as np
+import pytest
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.models    import measure_similarity, max_score, score_block, query_similarity, query_modules
+from modules.synthetic import synthetic_profile, write_synthetic
+import MSearcher
+
+#-----------------------------------------------------
+
+@pytest.fixture(scope = 'module')
+def counts(tmpdir_factory):
+    profiles, modules = synthetic_profile(2000, 20, seed = 8)
+    profile_fil = write_synthetic(profiles, str(tmpdir_factory.mktemp('queries').join('profile.npy')))
+    return MSearcher.preprocess_counts(profile_fil, [], verbose = False)[1], list(modules.values())
+
+def background(gene_counts, num = 3):
+    genes = [ gene for gene in gene_counts.index if gene.startswith('G') ]
+    return genes[100 : 100 + 500 * num : 500]
+
+def test_score_block_bounded(counts):
+    gene_counts = counts[0]
+    query_cnts, ngenes = gene_counts.values[0 : 7], gene_counts.shape[0]
+    expected = np.vstack([ measure_similarity(query, gene_counts.values, ngenes) for query in query_cnts ])
+    for max_cells in [1, gene_counts.size * 3, 2 ** 23]: # one query, uneven and a single block
+        assert np.allclose(score_block(query_cnts, gene_counts.values, ngenes, max_cells), expected, rtol = 1e-12)
+
+def test_query_similarity_pairwise(counts):
+    gene_counts, modules = counts
+    query_genes = modules[0][0 : 4] + background(gene_counts, 2)
+    scale = gene_counts.shape[1] * max_score(gene_counts.shape[0], gene_counts.shape[1])
+    expected = np.array([ [ measure_similarity(gene_counts.loc[gene_i].values, gene_counts.loc[[gene_j]].values, gene_counts.shape[0])[0] / scale
+        for gene_j in query_genes ] for gene_i in query_genes ])
+    assert np.allclose(query_similarity(gene_counts, query_genes, gene_counts.shape[0]), expected, rtol = 1e-12)
+
+def test_query_modules(counts):
+    gene_counts, modules = counts
+    query_genes = modules[0][0 : 12] + background(gene_counts) + modules[1][0 : 6]
+    found = query_modules(gene_counts, query_genes, gene_counts.shape[0])
+    assert found == [modules[0][0 : 12], modules[1][0 : 6]] # background genes join no module, the largest first
+    assert query_modules(gene_counts, modules[0][0 : 6], gene_counts.shape[0], min_size = 7) == []
+
+def test_split_modules(counts):
+    gene_counts, modules = counts
+    query_sets = collections.OrderedDict([('mixed', modules[2][0 : 5] + ['missing'] + modules[3][0 : 4])])
+    split = MSearcher.split_modules(query_sets, gene_counts, verbose = False)
+    assert list(split.items()) == [('mixed-module1', modules[2][0 : 5]), ('mixed-module2', modules[3][0 : 4])]
+    assert list(MSearcher.split_modules({'' : modules[2][0 : 5]}, gene_counts, verbose = False)) == ['module1']
+    with pytest.raises(SystemExit):
+        MSearcher.split_modules({'' : background(gene_counts)}, gene_counts, verbose = False)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#title       : test_report.py
+#description : Pipeline stages and pool chunks are timed into a JSON run report, apart for each thread of a server.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import json
+import threading
+import subprocess
+import numpy  as np
+import pandas as pd
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.utils     import report_scope, stage, frame_infos, multi_process, write_report
+from modules.synthetic import synthetic_profile, write_synthetic
+
+#-----------------------------------------------------
+
+def row_sums(frame):
+    return frame.values.sum(axis = 1)[:, np.newaxis]
+
+def test_stage_records():
+    frame = pd.DataFrame(np.ones((100, 4), dtype = np.float32))
+    with report_scope() as report:
+        with stage('outer', **frame_infos(frame)):
+            with stage('inner', rows = 100) as record:
+                record.update(cols = 4)
+                multi_process(frame, row_sums, 2, True, backend = 'thread')
+    inner, outer = report['stages']
+    assert (inner['name'], inner['parent'], inner['rows'], inner['cols']) == ('inner', 'outer', 100, 4)
+    assert outer['parent'] is None and outer['shape'] == [100, 4] and outer['dtype'] == 'float32' and outer['nbytes'] == 1600
+    for record in [inner, outer]:
+        assert record['wall_time'] >= 0 and record['cpu_time'] >= 0 and 'peak_rss_mb' in record
+    task, = report['tasks']
+    assert (task['func'], task['stage'], task['backend'], task['workers'], task['resumed']) == ('row_sums', 'inner', 'thread', 2, 0)
+    assert sum(chunk['rows'] for chunk in task['chunks']) == 100 and all(chunk['wall_time'] >= 0 for chunk in task['chunks'])
+
+def test_report_scope_per_thread():
+    reports = {}
+    def timed(name):
+        with report_scope() as report:
+            with stage(name): threading.Event().wait(0.05)
+        reports[name] = report
+    threads = [ threading.Thread(target = timed, args = ('stage{0}'.format(idx), )) for idx in range(4) ]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert all([ record['name'] for record in report['stages'] ] == [name] for name, report in reports.items())
+
+def test_write_report_numpy_values(tmpdir):
+    report_fil = str(tmpdir.join('run.report.json'))
+    with report_scope():
+        with stage('numbers', count = np.int64(3), ratio = np.float32(0.5)): pass
+        write_report(report_fil, status = 0)
+    with open(report_fil) as fp: report = json.load(fp)
+    assert report['status'] == 0 and report['stages'][0]['count'] == 3 and report['stages'][0]['ratio'] == 0.5
+
+def test_run_report(tmpdir):
+    profiles = synthetic_profile(2000, 20, seed = 1)[0]
+    profile_fil = write_synthetic(profiles, str(tmpdir.join('profile.npy')))
+    subprocess.check_call([sys.executable, os.path.join(ROOT, 'MSearcher.py'), '--profile', profile_fil, '-q', 'M0_0000,M0_0001,M0_0002', '--prefix', 'run',
+        '--outdir', str(tmpdir), '--nthreads', '2', '--report', '--profiler', 'cprofile', '--verbose', 'FALSE'])
+    with open(str(tmpdir.join('run.report.json'))) as fp: report = json.load(fp)
+    names = [ record['name'] for record in report['stages'] ]
+    for name in ['read_profiles', 'quantile_normalized', 'filter_lowexps', 'chk_queries_quality', 'similarity', 'estimate_FDR', 'write_results']:
+        assert name in names, name
+    assert report['status'] == 0 and report['cprofile'] == str(tmpdir.join('run.prof')) and os.path.exists(report['cprofile'])
+    assert any(task['stage'] == 'estimate_FDR' and task['chunks'] for task in report['tasks'])
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#title       : test_searcher.py
+#description : The Searcher API preprocesses a profile once and returns the results of the command line without importing sklearn up front.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import subprocess
+import numpy  as np
+import pandas as pd
+import pytest
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.synthetic import synthetic_profile, write_synthetic
+import MSearcher
+
+#-----------------------------------------------------
+
+@pytest.fixture(scope = 'module')
+def atlas(tmpdir_factory):
+    tmpdir = tmpdir_factory.mktemp('searcher')
+    profiles, modules = synthetic_profile(2000, 20, seed = 6)
+    return profiles, write_synthetic(profiles, str(tmpdir.join('atlas.npy'))), list(modules.values()), tmpdir
+
+def test_lazy_imports():
+    code = 'import sys; import MSearcher; print(",".join(sorted(set(name.split(".")[0] for name in sys.modules) & {"sklearn", "scipy"})))'
+    assert subprocess.check_output([sys.executable, '-c', code], cwd = ROOT).decode().strip() == ''
+
+def test_search_matches_command_line(atlas):
+    profiles, profile_fil, modules, tmpdir = atlas
+    query_genes = modules[0][0 : 3]
+    searcher = MSearcher.Searcher(profile_fil, nthreads = 2, backend = 'thread')
+    query_pass, gene_counts = MSearcher.preprocess_counts(profile_fil, query_genes, verbose = False)[0 : 2]
+    expected = MSearcher.search_markers(query_pass, gene_counts, verbose = False, nthreads = 2, backend = 'thread')
+    result = searcher.search(query_genes)
+    assert result.equals(expected) and not tmpdir.listdir('*.xls') # results are returned, not written
+    assert MSearcher.Searcher(profiles, nthreads = 2, backend = 'thread').search(query_genes).equals(result)
+    assert searcher.search(modules[1][0]).index.equals(searcher.search([modules[1][0]]).index)
+
+def test_search_errors(atlas):
+    profiles, profile_fil, modules, tmpdir = atlas
+    searcher = MSearcher.Searcher(profiles, nthreads = 1, backend = 'thread')
+    with pytest.raises(ValueError):
+        searcher.search(['missing'])
+    with pytest.raises(ValueError): # background genes are not alike, they fail the quality evaluation
+        searcher.search(['G001000', 'G001500', 'G001900'])
+
+def test_search_batch(atlas):
+    profiles, profile_fil, modules, tmpdir = atlas
+    searcher = MSearcher.Searcher(profiles, nthreads = 2, backend = 'thread')
+    results = searcher.search_batch({'first' : modules[0][0 : 3], 'second' : modules[1][0 : 3]})
+    assert list(results) == ['first', 'second']
+    assert results['second'].equals(searcher.search(modules[1][0 : 3]))
+    combined = searcher.search_batch({'first' : modules[0][0 : 3], 'second' : modules[1][0 : 3]}, combined = True)
+    assert isinstance(combined, pd.DataFrame) and len(combined) == sum(len(result) for result in results.values())
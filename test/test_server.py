@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#title       : test_server.py
+#description : The query server starts its worker pools before serving and answers concurrent requests apart.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import json
+import socket
+import threading
+import collections
+from urllib.request import urlopen, Request
+from urllib.error   import HTTPError
+import pytest
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.utils     import POOLS, HWM_PARAMS, get_pool
+from modules.server    import ProfilePool, serve
+from modules.synthetic import synthetic_profile, write_synthetic
+import MSearcher
+
+#-----------------------------------------------------
+
+@pytest.fixture(scope = 'module')
+def server(tmpdir_factory):
+    profiles, modules = synthetic_profile(2000, 20, seed = 1)
+    profile_fil = write_synthetic(profiles, str(tmpdir_factory.mktemp('atlas').join('atlas.npy')))
+    factory = lambda profile: MSearcher.Searcher(profile, nthreads = 2, backend = 'thread')
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    pool = ProfilePool(collections.OrderedDict([('atlas', profile_fil)]), factory)
+    threading.Thread(target = serve, args = ('127.0.0.1:{0}'.format(port), pool, MSearcher.LOGS, False, [(2, 'thread')]), daemon = True).start()
+    url = 'http://127.0.0.1:{0}'.format(port)
+    for idx in range(200): # until the server listens
+        try:
+            urlopen(url + '/health').read()
+            break
+        except OSError:
+            threading.Event().wait(0.05)
+    yield url, modules
+    HWM_PARAMS['reset'] = True
+
+def post(url, request):
+    try:
+        with urlopen(Request(url + '/search', json.dumps(request).encode())) as fp: return 200, json.loads(fp.read().decode())
+    except HTTPError as err:
+        return err.code, json.loads(err.read().decode())
+
+def test_get_pool_creates_one_pool_per_key():
+    pools = []
+    threads = [ threading.Thread(target = lambda: pools.append(get_pool(3, 'thread'))) for idx in range(16) ]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert len(set(map(id, pools))) == 1 and POOLS[('thread', 3)] is pools[0]
+
+def test_pools_started_before_requests(server):
+    assert ('thread', 2) in POOLS and not HWM_PARAMS['reset']
+
+def test_concurrent_requests(server):
+    url, modules = server
+    query_genes = list(modules.values())[0][0 : 3]
+    responses = [None] * 4
+    def ask(idx): responses[idx] = post(url, {'atlas' : 'atlas', 'query_genes' : query_genes, 'top' : 20})
+    threads = [ threading.Thread(target = ask, args = (idx, )) for idx in range(len(responses)) ]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert all(code == 200 for code, body in responses)
+    assert all(body['results'] == responses[0][1]['results'] for code, body in responses)
+
+def test_request_errors(server):
+    url, modules = server
+    assert post(url, {'atlas' : 'missing', 'query_genes' : ['M0_0000']})[0] == 404
+    assert post(url, {'atlas' : 'atlas'})[0] == 400
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#title       : test_sparse.py
+#description : Sparse profiles are read and reduced without densifying the cells, the same from Matrix Market and CSR files.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import gzip
+import numpy  as np
+import pandas as pd
+from scipy import sparse, io
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.parse_opts import read_sparse, profile_format
+from modules.models     import svd_filter_sparse
+import MSearcher
+
+#-----------------------------------------------------
+
+def sparse_profile(ngenes = 600, ncells = 80, ntypes = 4):
+    rng = np.random.RandomState(0) # genes of a cell type are mostly detected in its cells, rarely in others
+    detected = rng.uniform(size = (ngenes, ncells)) < np.where(np.arange(ngenes)[:, None] % ntypes == np.arange(ncells) % ntypes, 0.8, 0.02)
+    values = sparse.csr_matrix(np.where(detected, rng.poisson(5, (ngenes, ncells)) + 1.0, 0))
+    genes = np.array([ 'g{0}'.format(idx) for idx in range(ngenes) ], dtype = object)
+    genes[ngenes - 1] = genes[3] # a duplicated gene, the first is kept
+    return values, genes, np.array([ 'c{0}'.format(idx) for idx in range(ncells) ], dtype = object)
+
+def write_mtx(tmpdir, values, genes, cells):
+    prefix = str(tmpdir.join('sample_'))
+    io.mmwrite(prefix + 'matrix.mtx', values)
+    with open(prefix + 'matrix.mtx', 'rb') as fp, gzip.open(prefix + 'matrix.mtx.gz', 'wb') as gz: gz.write(fp.read())
+    with open(prefix + 'features.tsv', 'w') as fp: fp.write(''.join('ENSG{0}\t{1}\tGene Expression\n'.format(idx, gene) for idx, gene in enumerate(genes)))
+    with open(prefix + 'barcodes.tsv', 'w') as fp: fp.write('\n'.join(cells) + '\n')
+    return prefix + 'matrix.mtx.gz'
+
+def write_csr(tmpdir, values, genes, cells):
+    sparse.save_npz(str(tmpdir.join('cells.npz')), values)
+    for ext, names in [('.genes', genes), ('.samples', cells)]:
+        with open(str(tmpdir.join('cells' + ext)), 'w') as fp: fp.write('\n'.join(names) + '\n')
+    return str(tmpdir.join('cells.npz'))
+
+def test_read_sparse_formats(tmpdir):
+    values, genes, cells = sparse_profile()
+    for profile_fil, fmt in [(write_mtx(tmpdir, values, genes, cells), 'mtx'), (write_csr(tmpdir, values, genes, cells), 'csr')]:
+        assert profile_format(profile_fil) == fmt
+        read, read_genes, read_cells = read_sparse(profile_fil, fmt, np.float64)
+        assert sparse.isspmatrix_csr(read) and list(read_cells) == list(cells)
+        assert list(read_genes) == list(genes[0 : -1]) # duplicated gene dropped
+        assert (read != values[0 : -1]).nnz == 0
+
+def test_sparse_pca_matches_dense():
+    values, genes, cells = sparse_profile()
+    dense = values.toarray()
+    dense = (dense - dense.mean(axis = 1, keepdims = True)) / dense.std(axis = 1, ddof = 1, keepdims = True)
+    singular = np.linalg.svd(dense - dense.mean(axis = 0), compute_uv = False)[0 : 3]
+    reduced = svd_filter_sparse(values, pd.Index(genes), renorm = 'zscore', n_components = 3)
+    assert np.allclose(np.linalg.norm(reduced.values, axis = 0), singular, rtol = 1e-3)
+
+def test_sparse_counts_same_from_both_formats(tmpdir):
+    values, genes, cells = sparse_profile()
+    counts_mtx = MSearcher.preprocess_counts(write_mtx(tmpdir, values, genes, cells), [], False)[1]
+    counts_csr = MSearcher.preprocess_counts(write_csr(tmpdir, values, genes, cells), [], False)[1]
+    assert counts_mtx.equals(counts_csr) and counts_mtx.shape[1] > 0
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#title       : test_svd.py
+#description : Randomized and incremental reduction engines capture the variance and top genes of the full PCA.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules           import models
+from modules.synthetic import synthetic_profile, write_synthetic
+import MSearcher
+
+#-----------------------------------------------------
+
+def centered(ngenes = 2000, nsamples = 80):
+    profiles = synthetic_profile(ngenes, nsamples, seed = 2, dtype = np.float64, noise = 0.15)[0]
+    values = profiles.sub(profiles.mean(axis = 1), axis = 0).divide(profiles.std(axis = 1), axis = 0).values
+    return values - values.mean(axis = 0)
+
+def test_engines_capture_full_variance():
+    values = centered()
+    expected = np.cumsum(np.linalg.svd(values, compute_uv = False) ** 2) / np.sum(values ** 2)
+    for engine in [models.randomized_pca, models.incremental_pca]: # the five modules, components beyond them are noise
+        scores, captured = engine(values, 5)
+        assert scores.shape == (values.shape[0], 5)
+        assert captured >= 0.99 * expected[4], engine.__name__
+        assert np.isclose(np.sum(scores ** 2) / np.sum(values ** 2), captured, rtol = 1e-2) # incremental fits estimate the variance batch by batch
+    scores, captured = models.randomized_pca(values) # grown until the variance is explained
+    assert captured >= models.PCA_VARIANCE and scores.shape[1] == models.variance_cutoff(expected, models.PCA_VARIANCE)
+
+def test_time_budget_keeps_components():
+    values = centered()
+    for engine in [models.randomized_pca, models.incremental_pca]:
+        assert engine(values, 5, time_budget = 1e-9)[0].shape == (values.shape[0], 5), engine.__name__
+
+def test_full_engine_deterministic():
+    profiles = pd.DataFrame(np.random.RandomState(0).lognormal(4, 1, (2000, 80)))
+    assert models.svd_filter(profiles, n_components = 20).equals(models.svd_filter(profiles, n_components = 20))
+
+def test_engines_top_genes(tmpdir):
+    profiles, modules = synthetic_profile(3000, 80, seed = 2, dtype = np.float64, noise = 0.15)
+    profile_fil, markers = write_synthetic(profiles, str(tmpdir.join('profile.npy'))), list(modules.values())[0]
+    tops = {}
+    for engine in ['full', 'randomized', 'incremental']:
+        query_genes, gene_counts = MSearcher.preprocess_counts(profile_fil, markers[0 : 2], verbose = False, svd_params = {'engine' : engine, 'n_components' : 10})[0 : 2]
+        tops[engine] = set(MSearcher.score_queries(query_genes, gene_counts, False)[1].sort_values(ascending = False).index[0 : 40])
+    for engine in tops: # markers of a module are alike, their order within it is not meaningful
+        assert tops[engine] <= set(markers), engine
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#title       : test_utils.py
+#description : Shared frames reach pool workers without copies and are released after the run, even a failed one.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import pickle
+import numpy  as np
+import pandas as pd
+import pytest
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.utils import SharedFrame, multi_process, SHARED_ROOT
+
+#-----------------------------------------------------
+
+def row_scores(frame, weights):
+    return frame.values.dot(weights.values[:, 0 : 1])
+
+def failing(frame, weights):
+    raise RuntimeError('worker failed')
+
+def shared_dirs():
+    return set(fil for fil in os.listdir(SHARED_ROOT or '/tmp') if fil.startswith('msearcher-'))
+
+def frames():
+    rng = np.random.RandomState(0)
+    return pd.DataFrame(rng.normal(size = (300, 8)), index = [ 'g{0}'.format(idx) for idx in range(300) ]), pd.DataFrame(rng.normal(size = (8, 2)))
+
+def test_shared_frame_roundtrip():
+    frame = frames()[0]
+    shared = SharedFrame(frame)
+    try:
+        attached = pickle.loads(pickle.dumps(shared)).attach()
+        assert attached.equals(frame) and not attached.values.flags.writeable
+        assert len(pickle.dumps(shared)) < 1024 # workers get the path, not the values
+    finally:
+        shared.release()
+    assert not os.path.exists(shared.path)
+
+@pytest.mark.parametrize('backend', ['process', 'thread'])
+def test_multi_process_matches_serial(backend):
+    frame, weights = frames()
+    before = shared_dirs()
+    scores = multi_process(frame, row_scores, 3, True, backend = backend, weights = weights)
+    assert np.allclose(scores.values[:, 0], row_scores(frame, weights)[:, 0])
+    assert shared_dirs() == before
+
+def test_failed_worker_releases_frames():
+    frame, weights = frames()
+    before = shared_dirs()
+    with pytest.raises(RuntimeError):
+        multi_process(frame, failing, 2, True, backend = 'process', weights = weights)
+    assert shared_dirs() == before
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#title       : test_workqueue.py
+#description : Work queues require a key beyond localhost and hand out chunks of lost workers again after their lease.
+#author      : Huamei Li
+#date        : 17/10/2026
+#type        : test
+#version     : 3.6.9
+
+#-----------------------------------------------------
+# load python modules
+
+import os
+import sys
+import time
+import socket
+import threading
+import pytest
+from multiprocessing.connection import Client, AuthenticationError
+
+#-----------------------------------------------------
+# load own modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.workqueue import DirQueue, open_queue, queue_map, work, close_queues
+
+#-----------------------------------------------------
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def test_remote_queue_requires_authkey(monkeypatch):
+    monkeypatch.delenv('MSEARCHER_AUTHKEY', raising = False)
+    with pytest.raises(ValueError):
+        open_queue('tcp:0.0.0.0:{0}'.format(free_port()), serve = True)
+    with pytest.raises(ValueError):
+        open_queue('tcp:127.0.0.1:{0}'.format(free_port()))
+
+def test_local_queue_draws_random_key(monkeypatch):
+    monkeypatch.delenv('MSEARCHER_AUTHKEY', raising = False)
+    port = free_port()
+    open_queue('tcp:{0}'.format(port), serve = True)
+    authkey = os.environ['MSEARCHER_AUTHKEY']
+    assert len(authkey) == 32 and authkey != 'msearcher'
+    Client(('127.0.0.1', port), authkey = authkey.encode()).close()
+    with pytest.raises(AuthenticationError):
+        Client(('127.0.0.1', port), authkey = b'msearcher')
+
+def test_expired_lease_hands_out_chunks_again(tmpdir):
+    spec, data = 'dir:' + str(tmpdir.join('queue')), list(range(40))
+    tasks = [ (sum, data, start, start + 10, {}) for start in range(0, 40, 10) ]
+    results = []
+    runner = threading.Thread(target = lambda: results.extend(queue_map(spec, tasks, 0, lease = 0.5)))
+    runner.start()
+    try:
+        lost = DirQueue(spec[4:])
+        while len(os.listdir(os.path.join(lost.root, 'tasks'))) < len(tasks): time.sleep(0.01)
+        assert lost.get()[0] is not None # claimed by a worker that never finishes it
+        worker = threading.Thread(target = work, args = (spec, 3))
+        worker.start()
+        runner.join(10)
+        worker.join(10)
+    finally:
+        close_queues()
+    assert [ result[0] for result in results ] == [ sum(data[start : end]) for func, data, start, end, kargs in tasks ]